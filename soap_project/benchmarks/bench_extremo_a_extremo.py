@@ -0,0 +1,189 @@
+# Benchmark de extremo a extremo del CLI.
+#
+# Genera libros sintéticos, levanta el servidor SOAP local y ejecuta
+# `python -m soap_batch.batch_soap_sender` como proceso aparte, igual que en producción.
+# Mide filas/s, RSS máximo del proceso y percentiles de latencia HTTP (de --metrics-json),
+# y guarda el resultado en JSON para compararlo con ejecuciones anteriores. Uso, desde
+# soap_project/:
+#
+#     python -m benchmarks.bench_extremo_a_extremo --filas 20000 --concurrency 8 \
+#            --latencia 0.005 --salida resultados/base.json
+#     python -m benchmarks.bench_extremo_a_extremo --filas 20000 --concurrency 8 \
+#            --latencia 0.005 --comparar-con resultados/base.json
+#
+# Los argumentos no reconocidos se pasan tal cual al CLI (p. ej. --parse-workers 2).
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.libros_sinteticos import generar_libro
+from benchmarks.servidor_soap import ServidorSOAPStub
+
+try:
+    import resource
+except ImportError: # Windows: no se puede medir el RSS máximo del proceso hijo
+    resource = None
+
+RAIZ_PROYECTO = pathlib.Path(__file__).resolve().parent.parent
+
+# Métricas que se comparan entre ejecuciones y si un valor mayor es mejor.
+METRICAS_COMPARADAS = {
+    "filas_por_segundo": True,
+    "rss_pico_mb": False,
+    "latencia_http_ms.p50": False,
+    "latencia_http_ms.p95": False,
+    "latencia_http_ms.p99": False,
+}
+
+
+def _rss_pico_hijos_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(rss / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1) # bytes en macOS, KiB en Linux
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ_PROYECTO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar(filas, archivos=1, formato="xlsx", latencia=0.0, jitter=0.0, tasa_errores=0.0, codigo_error=500,
+             concurrencia=1, semilla=0, args_cli=()):
+    # Ejecuta una pasada completa y devuelve el diccionario de resultados.
+    with tempfile.TemporaryDirectory(prefix="bench_soap_") as temporal:
+        temporal = pathlib.Path(temporal)
+        excel_dir = temporal / "excel"
+        excel_dir.mkdir()
+        filas_por_archivo = [filas // archivos + (1 if i < filas % archivos else 0) for i in range(archivos)]
+
+        inicio = time.perf_counter()
+        for i, filas_archivo in enumerate(filas_por_archivo):
+            generar_libro(excel_dir / f"sintetico_{i:03d}.{formato}", filas_archivo, semilla=semilla + i)
+        segundos_generacion = time.perf_counter() - inicio
+
+        ruta_metricas = temporal / "metricas.json"
+        entorno = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(RAIZ_PROYECTO),
+                                                                             os.environ.get("PYTHONPATH")])))
+        with ServidorSOAPStub(latencia, jitter, tasa_errores, codigo_error, semilla) as servidor:
+            comando = [
+                sys.executable, "-m", "soap_batch.batch_soap_sender",
+                "--excel-dir", str(excel_dir),
+                "--soap-endpoint", servidor.url,
+                "--concurrency", str(concurrencia),
+                "--no-checkpoint",
+                "--metrics-json", str(ruta_metricas),
+                *args_cli,
+            ]
+            inicio = time.perf_counter()
+            # La salida por consola se descarta: se mide el pipeline, no la terminal.
+            proceso = subprocess.run(comando, cwd=temporal, env=entorno, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE, text=True)
+            segundos = time.perf_counter() - inicio
+            peticiones, errores = servidor.peticiones, servidor.errores
+
+        if proceso.returncode != 0:
+            raise RuntimeError(f"El CLI terminó con código {proceso.returncode}:\n{proceso.stderr}")
+        metricas = json.loads(ruta_metricas.read_text(encoding="utf-8"))
+
+    return {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "configuracion": {
+            "filas": filas,
+            "archivos": archivos,
+            "formato": formato,
+            "latencia": latencia,
+            "jitter": jitter,
+            "tasa_errores": tasa_errores,
+            "codigo_error": codigo_error,
+            "concurrency": concurrencia,
+            "semilla": semilla,
+            "args_cli": list(args_cli),
+        },
+        "segundos_generacion": round(segundos_generacion, 3),
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round(filas / segundos, 1),
+        "rss_pico_mb": _rss_pico_hijos_mb(),
+        "peticiones_servidor": peticiones,
+        "errores_simulados": errores,
+        "latencia_http_ms": metricas["latencia_http_ms"],
+        "etapas": metricas["etapas"],
+        "codigos_http": metricas["codigos_http"],
+        "bytes_enviados": metricas["bytes_enviados"],
+    }
+
+
+def _valor(resultado, clave):
+    for parte in clave.split("."):
+        resultado = (resultado or {}).get(parte)
+    return resultado
+
+
+def comparar(anterior, actual):
+    # Devuelve (métrica, anterior, actual, variación %, mejora) por cada métrica comparable.
+    filas = []
+    for clave, mayor_es_mejor in METRICAS_COMPARADAS.items():
+        antes, ahora = _valor(anterior, clave), _valor(actual, clave)
+        if antes is None or ahora is None:
+            continue
+        variacion = (ahora - antes) / antes * 100 if antes else 0.0
+        filas.append((clave, antes, ahora, round(variacion, 1), (ahora >= antes) == mayor_es_mejor))
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del envío SOAP desde Excel.")
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--archivos", type=int, default=1)
+    parser.add_argument("--formato", choices=["xlsx", "xls"], default="xlsx")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latencia fija del servidor en segundos.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latencia aleatoria adicional en segundos.")
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="Fracción de peticiones con SOAP Fault.")
+    parser.add_argument("--codigo-error", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", type=pathlib.Path, default=None, help="Fichero JSON donde guardar el resultado.")
+    parser.add_argument("--comparar-con", type=pathlib.Path, default=None, help="Resultado JSON anterior.")
+    args, args_cli = parser.parse_known_args()
+
+    resultado = ejecutar(args.filas, args.archivos, args.formato, args.latencia, args.jitter, args.tasa_errores,
+                         args.codigo_error, args.concurrency, args.semilla, args_cli)
+
+    latencia = resultado["latencia_http_ms"]
+    print(f"Filas: {args.filas} en {resultado['segundos']} s -> {resultado['filas_por_segundo']} filas/s")
+    print(f"RSS máximo: {resultado['rss_pico_mb']} MB")
+    if latencia["solicitudes"]:
+        print(f"Latencia HTTP (ms): p50 {latencia['p50']}, p95 {latencia['p95']}, p99 {latencia['p99']}")
+    for etapa, datos in resultado["etapas"].items():
+        print(f"  {etapa:<14} {datos['segundos']:10.3f} s  ({datos['llamadas']} llamadas)")
+
+    if args.salida:
+        args.salida.parent.mkdir(parents=True, exist_ok=True)
+        args.salida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"Resultado guardado en {args.salida}")
+
+    if args.comparar_con:
+        anterior = json.loads(args.comparar_con.read_text(encoding="utf-8"))
+        if anterior.get("configuracion") != resultado["configuracion"]:
+            print("AVISO: la configuración difiere de la ejecución anterior; la comparación es orientativa.")
+        print(f"\nComparación con {args.comparar_con}:")
+        for clave, antes, ahora, variacion, mejora in comparar(anterior, resultado):
+            print(f"  {clave:<22} {antes:>12} -> {ahora:>12}  ({variacion:+.1f}%){'' if mejora else '  PEOR'}")
+
+
+if __name__ == "__main__":
+    main()
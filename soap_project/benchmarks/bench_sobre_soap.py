@@ -0,0 +1,67 @@
+# Microbenchmark del constructor de sobres SOAP.
+#
+# Compara la ruta antigua (fila pandas -> f-string -> encode en el envío) con el
+# constructor por plantilla, fila a fila y por lotes. Uso, desde soap_project/:
+#
+#     python -m benchmarks.bench_sobre_soap --filas 10000
+
+import argparse
+import timeit
+
+import pandas as pd
+
+from soap_batch.batch_soap_sender import generar_cuerpo_soap
+from soap_batch.sobre_soap import construir_cuerpo_soap, construir_cuerpos_soap
+from soap_batch.validacion import COLUMNAS_EVENTO
+
+
+def _f_string_original(fila_datos):
+    # Copia del generar_cuerpo_soap original (sin escapado), como referencia.
+    fecha_evento_str = fila_datos["FECHA_EVENTO"]
+    if isinstance(fecha_evento_str, pd.Timestamp):
+        fecha_evento_str = fecha_evento_str.strftime('%Y-%m-%d')
+    return f'''<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
+  <soap12:Body>
+    <ns2:EventoPNR xmlns:ns2="http://ejemplo.com/eventoPNR/v1">
+      <cdiApto>{fila_datos["CDIAPTO"]}</cdiApto>
+      <fechaEvento>{fecha_evento_str}</fechaEvento>
+      <pnr>{fila_datos["PNR_CODE"]}</pnr>
+      <asiento>{fila_datos["ASIENTO"]}</asiento>
+      <tarjetaFidelizacion>{fila_datos["TARJETA_FIDELIZACION"]}</tarjetaFidelizacion>
+    </ns2:EventoPNR>
+  </soap12:Body>
+</soap12:Envelope>'''
+
+
+def _medir(nombre, funcion, filas, repeticiones):
+    segundos = min(timeit.repeat(funcion, number=1, repeat=repeticiones))
+    print(f"{nombre:<45} {segundos * 1e6 / filas:8.2f} µs/fila  {filas / segundos:12,.0f} filas/s")
+    return segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark del constructor de sobres SOAP.")
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    valores = [
+        ("MAD", "2023-10-26", f"PNR{i:06d}", f"{i % 40}A", f"F{i:08d}")
+        for i in range(args.filas)
+    ]
+    series = [pd.Series(dict(zip(COLUMNAS_EVENTO, fila))) for fila in valores]
+
+    print(f"Filas: {args.filas}, repeticiones: {args.repeticiones} (mejor tiempo)")
+    base = _medir("f-string original (Series) + encode",
+                  lambda: [_f_string_original(s).encode('utf-8') for s in series], args.filas, args.repeticiones)
+    _medir("generar_cuerpo_soap (Series) + encode",
+           lambda: [generar_cuerpo_soap(s).encode('utf-8') for s in series], args.filas, args.repeticiones)
+    fila = _medir("construir_cuerpo_soap (tupla -> bytes)",
+                  lambda: [construir_cuerpo_soap(v) for v in valores], args.filas, args.repeticiones)
+    lote = _medir("construir_cuerpos_soap (bloque -> bytes)",
+                  lambda: construir_cuerpos_soap(valores), args.filas, args.repeticiones)
+    print(f"Aceleración fila a fila: {base / fila:.1f}x, por lotes: {base / lote:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
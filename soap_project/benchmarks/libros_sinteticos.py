@@ -0,0 +1,97 @@
+# Generador de libros Excel sintéticos con las columnas esperadas por el emisor.
+#
+# Con la misma semilla se generan exactamente los mismos datos, para que las
+# ejecuciones de benchmark sean comparables. Uso, desde soap_project/:
+#
+#     python -m benchmarks.libros_sinteticos --filas 100000 --salida /tmp/excel/datos.xlsx
+
+import argparse
+import datetime
+import pathlib
+import random
+import string
+
+from soap_batch.validacion import COLUMNAS_EVENTO
+
+AEROPUERTOS = ("MAD", "BCN", "AGP", "PMI", "LPA", "SVQ", "VLC", "BIO", "TFN", "ALC")
+MAX_FILAS_XLS = 65535 # Límite de filas de una hoja .xls (BIFF8), sin contar la cabecera
+_FECHA_BASE = datetime.datetime(2024, 1, 1)
+
+
+def filas_sinteticas(filas, semilla=0, proporcion_nulos=0.0):
+    # Filas en el orden de COLUMNAS_EVENTO. FECHA_EVENTO es un datetime, como una
+    # celda de fecha de Excel. Con `proporcion_nulos` algunas filas llevan un ASIENTO vacío.
+    aleatorio = random.Random(semilla)
+    letras = string.ascii_uppercase + string.digits
+    for i in range(filas):
+        asiento = None if aleatorio.random() < proporcion_nulos else f"{aleatorio.randint(1, 40)}{aleatorio.choice('ABCDEF')}"
+        yield (
+            aleatorio.choice(AEROPUERTOS),
+            _FECHA_BASE + datetime.timedelta(days=aleatorio.randrange(366)),
+            "".join(aleatorio.choices(letras, k=6)),
+            asiento,
+            f"IB{aleatorio.randrange(10 ** 8):08d}",
+        )
+
+
+def _escribir_xlsx(ruta, filas):
+    import openpyxl
+
+    libro = openpyxl.Workbook(write_only=True) # Escritura en streaming: memoria constante
+    hoja = libro.create_sheet()
+    hoja.append(COLUMNAS_EVENTO)
+    for fila in filas:
+        hoja.append(fila)
+    libro.save(ruta)
+
+
+def _escribir_xls(ruta, filas):
+    try:
+        import xlwt
+    except ImportError as e:
+        raise RuntimeError("Generar libros .xls requiere el paquete xlwt (pip install xlwt)") from e
+
+    libro = xlwt.Workbook()
+    hoja = libro.add_sheet("Hoja1")
+    estilo_fecha = xlwt.easyxf(num_format_str="YYYY-MM-DD")
+    for columna, nombre in enumerate(COLUMNAS_EVENTO):
+        hoja.write(0, columna, nombre)
+    for numero, fila in enumerate(filas, start=1):
+        for columna, valor in enumerate(fila):
+            if isinstance(valor, datetime.datetime):
+                hoja.write(numero, columna, valor, estilo_fecha)
+            elif valor is not None:
+                hoja.write(numero, columna, valor)
+    libro.save(str(ruta))
+
+
+ESCRITORES_LIBRO = {
+    ".xlsx": _escribir_xlsx,
+    ".xls": _escribir_xls,
+}
+
+
+def generar_libro(ruta, filas, semilla=0, proporcion_nulos=0.0):
+    ruta = pathlib.Path(ruta)
+    escritor = ESCRITORES_LIBRO.get(ruta.suffix.lower())
+    if escritor is None:
+        raise ValueError(f"Extensión no soportada: {ruta.suffix} (usa .xlsx o .xls)")
+    if ruta.suffix.lower() == ".xls" and filas > MAX_FILAS_XLS:
+        raise ValueError(f"Un libro .xls admite como mucho {MAX_FILAS_XLS} filas de datos")
+    escritor(ruta, filas_sinteticas(filas, semilla, proporcion_nulos))
+    return ruta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un libro Excel sintético para benchmarks.")
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--salida", type=pathlib.Path, required=True, help="Ruta .xlsx o .xls a generar.")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--proporcion-nulos", type=float, default=0.0)
+    args = parser.parse_args()
+    generar_libro(args.salida, args.filas, args.semilla, args.proporcion_nulos)
+    print(f"Generado {args.salida} con {args.filas} filas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Servidor SOAP 1.2 local para pruebas y benchmarks.
+#
+# Responde a cada POST tras una latencia configurable (fija más un jitter uniforme) y
+# devuelve un SOAP Fault con el código `codigo_error` en una fracción `tasa_errores` de
+# las peticiones. Con la misma `semilla` la secuencia de latencias y errores se repite.
+# Los sobres con varios EventoPNR se aceptan con un 200 y, si alguno de sus eventos
+# "falla", un Fault que detalla cada evento rechazado con errorEvento/indiceEvento.
+# También se puede lanzar aparte, desde soap_project/:
+#
+#     python -m benchmarks.servidor_soap --puerto 8080 --latencia 0.02 --tasa-errores 0.01
+
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPUESTA_OK = b'''<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
+  <soap12:Body>
+    <ns2:EventoPNRResponse xmlns:ns2="http://ejemplo.com/eventoPNR/v1"><resultado>OK</resultado></ns2:EventoPNRResponse>
+  </soap12:Body>
+</soap12:Envelope>'''
+
+RESPUESTA_FAULT = b'''<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
+  <soap12:Body>
+    <soap12:Fault>
+      <soap12:Code><soap12:Value>soap12:Receiver</soap12:Value></soap12:Code>
+      <soap12:Reason><soap12:Text xml:lang="es">Error simulado por el servidor de pruebas</soap12:Text></soap12:Reason>
+    </soap12:Fault>
+  </soap12:Body>
+</soap12:Envelope>'''
+
+_PLANTILLA_FAULT_EVENTOS = '''<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
+  <soap12:Body>
+    <soap12:Fault>
+      <soap12:Code><soap12:Value>soap12:Sender</soap12:Value></soap12:Code>
+      <soap12:Reason><soap12:Text xml:lang="es">Eventos rechazados</soap12:Text></soap12:Reason>
+      <soap12:Detail xmlns:ns2="http://ejemplo.com/eventoPNR/v1">{}</soap12:Detail>
+    </soap12:Fault>
+  </soap12:Body>
+</soap12:Envelope>'''
+
+
+def fault_eventos(indices):
+    # Fault de un sobre multievento con un errorEvento por cada posición (desde 1) rechazada.
+    errores = "".join(
+        f"<ns2:errorEvento><indiceEvento>{i}</indiceEvento><motivo>Evento {i} rechazado (simulado)</motivo></ns2:errorEvento>"
+        for i in indices
+    )
+    return _PLANTILLA_FAULT_EVENTOS.format(errores).encode("utf-8")
+
+
+class _ManejadorSOAP(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo salen en dos escrituras: sin TCP_NODELAY, Nagle + ACK retardado
+    # añadirían ~40 ms a cada respuesta en conexiones keep-alive.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.bloqueo:
+            self.server.conexiones += 1
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        eventos = max(1, self.rfile.read(longitud).count(b"<ns2:EventoPNR"))
+        with self.server.bloqueo:
+            self.server.peticiones += 1
+            self.server.eventos += eventos
+            self.server.bytes_recibidos += longitud
+            espera = self.server.latencia + self.server.aleatorio.random() * self.server.jitter
+            fallidos = [i for i in range(1, eventos + 1) if self.server.aleatorio.random() < self.server.tasa_errores]
+            self.server.errores += len(fallidos)
+        time.sleep(espera)
+        if eventos > 1:
+            status, cuerpo = (200, fault_eventos(fallidos)) if fallidos else (200, RESPUESTA_OK)
+        else:
+            status, cuerpo = (self.server.codigo_error, RESPUESTA_FAULT) if fallidos else (200, RESPUESTA_OK)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/soap+xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass # Silenciar el log por petición del servidor de pruebas
+
+
+class ServidorSOAPStub:
+    # Servidor SOAP local mínimo, en un hilo, con latencia y tasa de errores configurables.
+
+    def __init__(self, latencia=0.0, jitter=0.0, tasa_errores=0.0, codigo_error=500, semilla=0,
+                 host="127.0.0.1", puerto=0):
+        self.servidor = ThreadingHTTPServer((host, puerto), _ManejadorSOAP)
+        self.servidor.daemon_threads = True
+        self.servidor.latencia = latencia
+        self.servidor.jitter = jitter
+        self.servidor.tasa_errores = tasa_errores
+        self.servidor.codigo_error = codigo_error
+        self.servidor.aleatorio = random.Random(semilla)
+        self.servidor.peticiones = 0
+        self.servidor.errores = 0
+        self.servidor.eventos = 0
+        self.servidor.bytes_recibidos = 0
+        self.servidor.conexiones = 0
+        self.servidor.bloqueo = threading.Lock()
+        self._hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, puerto = self.servidor.server_address
+        return f"http://{host}:{puerto}/soap"
+
+    @property
+    def peticiones(self):
+        return self.servidor.peticiones
+
+    @property
+    def eventos(self):
+        return self.servidor.eventos
+
+    @property
+    def errores(self):
+        return self.servidor.errores
+
+    @property
+    def bytes_recibidos(self):
+        return self.servidor.bytes_recibidos
+
+    @property
+    def conexiones(self):
+        return self.servidor.conexiones
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        self._hilo.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor SOAP 1.2 local con latencia y errores simulados.")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos fijos por petición.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Segundos aleatorios adicionales (uniforme).")
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="Fracción de peticiones que fallan (0-1).")
+    parser.add_argument("--codigo-error", type=int, default=500)
+    parser.add_argument("--semilla", type=int, default=0)
+    args = parser.parse_args()
+
+    with ServidorSOAPStub(args.latencia, args.jitter, args.tasa_errores, args.codigo_error, args.semilla,
+                          puerto=args.puerto) as servidor:
+        print(f"Servidor SOAP escuchando en {servidor.url} (Ctrl+C para terminar)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print(f"Peticiones: {servidor.peticiones}, errores simulados: {servidor.errores}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,155 @@
 import argparse
+import contextlib
+import functools
+import logging
 import pathlib
-import pandas as pd
+import signal
+import threading
+import time
 import requests
-from lxml import etree
 import csv # Importar el módulo csv
 
-# Definición de las columnas esperadas
-EXPECTED_COLUMNS = {"CDIAPTO", "FECHA_EVENTO", "PNR_CODE", "ASIENTO", "TARJETA_FIDELIZACION"}
+from soap_batch.checkpoint import RUTA_CHECKPOINT_POR_DEFECTO, DiarioCheckpoint
+from soap_batch.consola import (
+    ERROR,
+    INTERVALO_RESUMEN_POR_DEFECTO,
+    OK,
+    OMITIDA,
+    Progreso,
+    configurar_consola,
+    log,
+)
+from soap_batch.deduplicacion import RUTA_INDICE_POR_DEFECTO, IndiceDeduplicacion
+from soap_batch.ingesta import ArchivoDescartado, InicioArchivo, listar_archivos
+from soap_batch.lectores import LECTORES, TAMANO_BLOQUE_POR_DEFECTO, leer_por_bloques
+from soap_batch.lotes import MAX_BYTES_SOLICITUD_POR_DEFECTO, FalloEvento, es_enviable
+from soap_batch.metricas import Metricas, TiemposArchivo
+from soap_batch.pipeline import PresupuestoMemoria, enviar_eventos, ingerir_por_etapas
+from soap_batch.politica_envio import (
+    CODIGOS_REINTENTABLES_POR_DEFECTO,
+    ESPERA_BASE_POR_DEFECTO,
+    ESPERA_MAXIMA_POR_DEFECTO,
+    ConcurrenciaAdaptativa,
+    LimitadorTasa,
+    PoliticaEnvio,
+)
+from soap_batch.registro import (
+    ESCRITORES,
+    INTERVALO_FLUSH_POR_DEFECTO,
+    MAX_FILAS_BUFFER_POR_DEFECTO,
+    RegistroSOAP,
+    registro_abierto,
+    rotar_log,
+)
+from soap_batch.respuestas import MAX_BYTES_FALLO_POR_DEFECTO, procesar_respuesta
+from soap_batch.sobre_soap import construir_cuerpo_soap_str
+from soap_batch.transporte import (
+    CABECERAS_SOAP,
+    TIMEOUT_CONEXION_POR_DEFECTO,
+    TIMEOUT_LECTURA_POR_DEFECTO,
+    TransporteSOAP,
+)
+from soap_batch.validacion import EXPECTED_COLUMNS, normalizar_fecha_evento
+from soap_batch.vigilancia import INTERVALO_SONDEO_POR_DEFECTO, crear_espera, vigilar
 
 def generar_cuerpo_soap(fila_datos):
     # Asegurarse de que FECHA_EVENTO esté en formato YYYY-MM-DD
-    fecha_evento_str = fila_datos["FECHA_EVENTO"]
-    if isinstance(fecha_evento_str, pd.Timestamp):
-        fecha_evento_str = fecha_evento_str.strftime('%Y-%m-%d')
-    elif not isinstance(fecha_evento_str, str): # Si no es Timestamp ni string, intentar convertir
-        try:
-            fecha_evento_str = pd.to_datetime(fecha_evento_str).strftime('%Y-%m-%d')
-        except Exception:
-            # Si falla la conversión, se usará tal cual, pero podría ser un problema.
-            # Considerar loguear esta situación o lanzar un error específico.
-            pass
-
-
-    return f'''<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
-  <soap12:Body>
-    <ns2:EventoPNR xmlns:ns2="http://ejemplo.com/eventoPNR/v1">
-      <cdiApto>{fila_datos["CDIAPTO"]}</cdiApto>
-      <fechaEvento>{fecha_evento_str}</fechaEvento>
-      <pnr>{fila_datos["PNR_CODE"]}</pnr>
-      <asiento>{fila_datos["ASIENTO"]}</asiento>
-      <tarjetaFidelizacion>{fila_datos["TARJETA_FIDELIZACION"]}</tarjetaFidelizacion>
-    </ns2:EventoPNR>
-  </soap12:Body>
-</soap12:Envelope>'''
-
-def enviar_solicitud_soap(endpoint_url, soap_body_str):
-    headers = {'Content-Type': 'application/soap+xml; charset=utf-8'}
+    fecha_evento_str = normalizar_fecha_evento(fila_datos["FECHA_EVENTO"])
+
+    return construir_cuerpo_soap_str((
+        fila_datos["CDIAPTO"],
+        fecha_evento_str,
+        fila_datos["PNR_CODE"],
+        fila_datos["ASIENTO"],
+        fila_datos["TARJETA_FIDELIZACION"],
+    ))
+
+def enviar_solicitud_soap(endpoint_url, soap_body, transporte=None):
+    # `soap_body` puede ser str o los bytes ya codificados por construir_cuerpos_soap.
+    if isinstance(soap_body, str):
+        soap_body = soap_body.encode('utf-8')
     try:
-        response = requests.post(endpoint_url, data=soap_body_str.encode('utf-8'), headers=headers, timeout=20) # Timeout de 20s
-        return response
+        if transporte is not None:
+            return transporte.post(endpoint_url, soap_body)
+        # Sin transporte compartido: una conexión nueva por solicitud.
+        response = requests.post(endpoint_url, data=soap_body, headers=CABECERAS_SOAP,
+                                 timeout=(TIMEOUT_CONEXION_POR_DEFECTO, TIMEOUT_LECTURA_POR_DEFECTO), stream=True)
+        return procesar_respuesta(response)
     except requests.exceptions.RequestException as e:
         # No imprimir aquí para no duplicar logs si el llamador ya lo hace.
         # print(f"Excepción durante la solicitud SOAP: {e}") 
         return None
 
 def log_soap_request(log_file_path, nombre_archivo, numero_linea, http_status, resultado, detalle_error):
+    # Para llamadores directos: si hay un RegistroSOAP abierto para esta ruta, la fila se
+    # encola en su buffer; si no, se abre el fichero y se añade. main() no pasa por aquí:
+    # usa el método registrar de su RegistroSOAP.
+    registro = registro_abierto(log_file_path)
+    if registro is not None:
+        registro.registrar(nombre_archivo, numero_linea, http_status, resultado, detalle_error)
+        return
     # Usar csv.writer para manejar correctamente comas y comillas en los campos.
     with open(log_file_path, 'a', newline='', encoding='utf-8') as f:
         writer = csv.writer(f, quoting=csv.QUOTE_ALL)
         writer.writerow([nombre_archivo, numero_linea, http_status, resultado, detalle_error])
 
-def main():
+def _con_reintentos(detalle, reintentos):
+    # Los reintentos se anotan en la columna detalle_error del log, solo si los hubo.
+    if not reintentos:
+        return detalle
+    return f"{detalle} (reintentos: {reintentos})"
+
+def _anunciar_envios(eventos):
+    # Con -v avisa de cada envío justo cuando el despachador toma la fila.
+    for evento in eventos:
+        if es_enviable(evento):
+            log.debug("  Fila %s: Enviando SOAP para PNR %s", evento.linea_excel, evento.pnr)
+        yield evento
+
+class Contadores:
+    # Contadores del resumen. En modo --watch hay unos por ciclo y otros acumulados.
+
+    def __init__(self):
+        self.archivos_procesados = 0
+        self.total_filas_leidas = 0
+        self.filas_procesadas_total = 0
+        self.filas_enviadas_exitosamente = 0
+        self.filas_con_fallo_envio = 0
+        self.filas_omitidas_por_columnas_o_datos = 0 # Unificado para todos los tipos de omisiones previas al envío
+        self.filas_ya_confirmadas = 0 # Omitidas con --resume por estar confirmadas en una ejecución anterior
+        self.filas_reintentadas = 0 # Filas que necesitaron al menos un reintento (cualquiera que fuera el resultado final)
+        self.filas_duplicadas = 0 # Omitidas con --dedup por ser un evento ya enviado o repetido
+
+    def sumar(self, otros):
+        for nombre, valor in vars(otros).items():
+            setattr(self, nombre, getattr(self, nombre) + valor)
+
+def _imprimir_resumen(c, args, titulo):
+    print(f"\n{titulo}")
+    print(f"Total de archivos procesados (o intentados): {c.archivos_procesados}")
+    print(f"Total de filas leídas de los archivos: {c.total_filas_leidas}")
+    print(f"Total de filas procesadas (intentos de envío + omitidas individualmente): {c.filas_procesadas_total}")
+    print(f"Filas enviadas exitosamente: {c.filas_enviadas_exitosamente}")
+    print(f"Filas con fallo en el envío (conexión, HTTP error, o error procesando fila): {c.filas_con_fallo_envio}")
+    print(f"Filas omitidas (archivo con cabecera incorrecta, o fila con datos nulos/faltantes): {c.filas_omitidas_por_columnas_o_datos}")
+    if args.max_retries:
+        print(f"Filas que necesitaron reintentos: {c.filas_reintentadas}")
+    if args.resume or (args.watch and c.filas_ya_confirmadas):
+        print(f"Filas omitidas por estar ya confirmadas (--resume): {c.filas_ya_confirmadas}")
+    if args.dedup:
+        print(f"Filas omitidas por ser eventos duplicados (--dedup): {c.filas_duplicadas}")
+
+def main(transporte=None, parar=None):
+    # `transporte` permite inyectar un objeto con método post(url, data) (p. ej. un
+    # transporte falso en las pruebas). Si no se indica, se crea un TransporteSOAP
+    # a partir de los argumentos de línea de comandos. `parar` (un threading.Event)
+    # detiene el modo --watch desde otro hilo.
     parser = argparse.ArgumentParser(description="Envía solicitudes SOAP basadas en datos de archivos Excel.")
     parser.add_argument(
         "--excel-dir",
         type=pathlib.Path,
         required=True,
-        help="Directorio que contiene los archivos Excel a procesar."
+        help=f"Directorio con los archivos a procesar ({', '.join(LECTORES)})."
     )
     parser.add_argument(
         "--soap-endpoint",
@@ -64,115 +157,518 @@ def main():
         required=True,
         help="URL del endpoint SOAP para enviar las solicitudes."
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Número máximo de solicitudes SOAP en vuelo simultáneamente (por defecto 1, envío secuencial)."
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=TAMANO_BLOQUE_POR_DEFECTO,
+        help=f"Filas leídas del Excel por bloque (por defecto {TAMANO_BLOQUE_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=None,
+        help="Conexiones HTTP persistentes hacia el endpoint (por defecto, el valor de --concurrency)."
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=TIMEOUT_CONEXION_POR_DEFECTO,
+        help=f"Timeout en segundos para establecer la conexión (por defecto {TIMEOUT_CONEXION_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=TIMEOUT_LECTURA_POR_DEFECTO,
+        help=f"Timeout en segundos esperando la respuesta SOAP (por defecto {TIMEOUT_LECTURA_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        action="store_true",
+        help="Cerrar la conexión tras cada solicitud en lugar de reutilizarla."
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=sorted(ESCRITORES),
+        default="csv",
+        help="Formato del log de resultados: csv (soap_log.csv) o parquet (soap_log.parquet, requiere pyarrow)."
+    )
+    parser.add_argument(
+        "--log-buffer-rows",
+        type=int,
+        default=MAX_FILAS_BUFFER_POR_DEFECTO,
+        help=f"Filas acumuladas antes de volcar el log a disco (por defecto {MAX_FILAS_BUFFER_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--log-flush-interval",
+        type=float,
+        default=INTERVALO_FLUSH_POR_DEFECTO,
+        help=f"Segundos máximos entre volcados del log (por defecto {INTERVALO_FLUSH_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=pathlib.Path,
+        default=RUTA_CHECKPOINT_POR_DEFECTO,
+        help=f"Diario SQLite de filas confirmadas con respuesta 2xx (por defecto {RUTA_CHECKPOINT_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--no-checkpoint",
+        action="store_true",
+        help="No registrar las filas confirmadas en el diario de checkpoint."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Reanudar una ejecución anterior: omitir las filas ya confirmadas en el diario y añadir al log existente."
+    )
+    parser.add_argument(
+        "--max-fault-bytes",
+        type=int,
+        default=MAX_BYTES_FALLO_POR_DEFECTO,
+        help=f"Bytes leídos como máximo del cuerpo de una respuesta de error; de ellos solo se registra el faultcode/Reason (por defecto {MAX_BYTES_FALLO_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="No reenviar eventos (PNR, aeropuerto, fecha y asiento) ya enviados en esta u otras ejecuciones."
+    )
+    parser.add_argument(
+        "--dedup-index",
+        type=pathlib.Path,
+        default=RUTA_INDICE_POR_DEFECTO,
+        help=f"Índice SQLite de eventos enviados usado por --dedup (por defecto {RUTA_INDICE_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=1,
+        help="Procesos que leen y validan archivos Excel en paralelo (por defecto 1, en el propio proceso)."
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        help="Presupuesto en MiB para los datos en vuelo en el pipeline (bloques leídos y sobres aún sin enviar); la lectura se frena al alcanzarlo (por defecto sin límite)."
+    )
+    parser.add_argument(
+        "--max-rps",
+        type=float,
+        default=None,
+        help="Límite de solicitudes por segundo hacia el endpoint, incluidos los reintentos (por defecto sin límite)."
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=0,
+        help="Reintentos por fila ante errores de conexión o códigos HTTP reintentables (por defecto 0)."
+    )
+    parser.add_argument(
+        "--retry-status",
+        type=lambda valor: {int(codigo) for codigo in valor.split(",") if codigo.strip()},
+        default=set(CODIGOS_REINTENTABLES_POR_DEFECTO),
+        help="Códigos HTTP reintentables separados por comas (por defecto 429,502,503,504)."
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=ESPERA_BASE_POR_DEFECTO,
+        help=f"Espera base en segundos del backoff exponencial con jitter (por defecto {ESPERA_BASE_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--retry-max-wait",
+        type=float,
+        default=ESPERA_MAXIMA_POR_DEFECTO,
+        help=f"Espera máxima en segundos entre reintentos (por defecto {ESPERA_MAXIMA_POR_DEFECTO})."
+    )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Reducir automáticamente las solicitudes en vuelo (hasta --concurrency) ante picos de latencia o errores 5xx."
+    )
+    parser.add_argument(
+        "--events-per-request",
+        type=int,
+        default=1,
+        help="Filas agrupadas en cada sobre SOAP, para endpoints que aceptan varios EventoPNR (por defecto 1)."
+    )
+    parser.add_argument(
+        "--max-request-bytes",
+        type=int,
+        default=MAX_BYTES_SOLICITUD_POR_DEFECTO,
+        help=f"Tamaño máximo de un sobre con varios eventos (por defecto {MAX_BYTES_SOLICITUD_POR_DEFECTO} bytes)."
+    )
+    parser.add_argument(
+        "--excel-cache",
+        type=pathlib.Path,
+        default=None,
+        help="Directorio donde guardar cada Excel leído como Parquet (por hash del contenido) para no volver a parsearlo (requiere pyarrow)."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Modo vigilancia: seguir en ejecución y procesar los archivos nuevos o modificados de --excel-dir."
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=INTERVALO_SONDEO_POR_DEFECTO,
+        help=f"Segundos entre comprobaciones del directorio en modo --watch (por defecto {INTERVALO_SONDEO_POR_DEFECTO})."
+    )
+    verbosidad = parser.add_mutually_exclusive_group()
+    verbosidad.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        help="Mostrar una línea por cada fila enviada u omitida."
+    )
+    verbosidad.add_argument(
+        "-q", "--quiet",
+        action="store_true",
+        help="Mostrar solo avisos, errores de archivo y el resumen final (sin progreso)."
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=INTERVALO_RESUMEN_POR_DEFECTO,
+        help=f"Segundos entre resúmenes de progreso en la salida (por defecto {INTERVALO_RESUMEN_POR_DEFECTO}; 0 los desactiva)."
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=pathlib.Path,
+        default=None,
+        help="Guardar un resumen JSON con tiempos por etapa, latencias HTTP (p50/p95/p99), filas/s y bytes enviados."
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=pathlib.Path,
+        default=None,
+        help="Guardar las mismas métricas en formato de texto de Prometheus (textfile collector)."
+    )
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency debe ser un entero mayor o igual que 1")
+    if args.parse_workers < 1:
+        parser.error("--parse-workers debe ser un entero mayor o igual que 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size debe ser un entero mayor o igual que 1")
+    if args.max_memory is not None and args.max_memory < 1:
+        parser.error("--max-memory debe ser un entero mayor o igual que 1")
+    if args.pool_size is not None and args.pool_size < 1:
+        parser.error("--pool-size debe ser un entero mayor o igual que 1")
+    if args.log_buffer_rows < 1:
+        parser.error("--log-buffer-rows debe ser un entero mayor o igual que 1")
+    if args.max_rps is not None and args.max_rps <= 0:
+        parser.error("--max-rps debe ser mayor que 0")
+    if args.max_retries < 0:
+        parser.error("--max-retries debe ser un entero mayor o igual que 0")
+    if args.events_per_request < 1:
+        parser.error("--events-per-request debe ser un entero mayor o igual que 1")
+    if args.max_request_bytes < 1:
+        parser.error("--max-request-bytes debe ser un entero mayor o igual que 1")
+    if args.max_fault_bytes < 1:
+        parser.error("--max-fault-bytes debe ser un entero mayor o igual que 1")
+    if args.progress_interval < 0:
+        parser.error("--progress-interval debe ser mayor o igual que 0")
+    if args.watch_interval <= 0:
+        parser.error("--watch-interval debe ser mayor que 0")
+    if args.excel_cache is not None:
+        try:
+            import pyarrow # noqa: F401
+        except ImportError:
+            parser.error("--excel-cache requiere el paquete pyarrow (pip install pyarrow)")
+        if args.excel_cache.resolve() == args.excel_dir.resolve():
+            parser.error("--excel-cache no puede ser el propio --excel-dir")
+    if args.resume and args.no_checkpoint:
+        parser.error("--resume necesita el diario de checkpoint (no es compatible con --no-checkpoint)")
+    if args.resume and args.log_format == "parquet":
+        parser.error("--resume no es compatible con --log-format parquet (el log no se puede ampliar)")
 
-    print(f"Directorio Excel: {args.excel_dir}")
-    print(f"Endpoint SOAP: {args.soap_endpoint}")
+    configurar_consola(logging.WARNING if args.quiet else logging.DEBUG if args.verbose else logging.INFO)
+    log.info("Directorio Excel: %s", args.excel_dir)
+    log.info("Endpoint SOAP: %s", args.soap_endpoint)
+    log.info("Concurrencia: %s", args.concurrency)
+    if args.events_per_request > 1:
+        log.info("Eventos por solicitud: %s (máximo %s bytes)", args.events_per_request, args.max_request_bytes)
 
     if not args.excel_dir.is_dir():
-        print(f"Error: El directorio especificado no existe o no es un directorio: {args.excel_dir}")
+        log.error("Error: El directorio especificado no existe o no es un directorio: %s", args.excel_dir)
         return
 
-    total_filas_leidas = 0
-    archivos_procesados = 0
-    filas_procesadas_total = 0
-    filas_enviadas_exitosamente = 0
-    filas_con_fallo_envio = 0
-    filas_omitidas_por_columnas_o_datos = 0 # Unificado para todos los tipos de omisiones previas al envío
-    
-    log_file_path = pathlib.Path("soap_log.csv")
-    # Escribir la cabecera del CSV usando log_soap_request para asegurar consistencia de formato
-    # Esto es un poco un truco, ya que log_soap_request espera datos de fila.
-    # Una alternativa es abrir el archivo y escribir la cabecera directamente.
-    with open(log_file_path, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
-        writer.writerow(["nombre_archivo", "numero_linea", "http_status", "resultado", "detalle_error"])
+    transporte_propio = transporte is None
+    if transporte_propio:
+        transporte = TransporteSOAP(
+            tamano_pool=args.pool_size or args.concurrency,
+            timeout_conexion=args.connect_timeout,
+            timeout_lectura=args.read_timeout,
+            keep_alive=not args.no_keep_alive,
+            conservar_contenido=args.events_per_request > 1,
+            max_bytes_fallo=args.max_fault_bytes,
+        )
 
+    # Sin --metrics-* no se crea ningún objeto de métricas y no se mide nada.
+    metricas = Metricas() if args.metrics_json or args.metrics_prom else None
 
-    for file_extension in ['*.xlsx', '*.xls']:
-        for file_path in args.excel_dir.glob(file_extension):
-            engine = 'openpyxl' if file_extension == '*.xlsx' else 'xlrd'
-            try:
-                df = pd.read_excel(file_path, sheet_name=0, engine=engine)
-                print(f"Procesando archivo: {file_path.name}")
-                archivos_procesados += 1
-                total_filas_leidas += len(df)
-
-                columnas_actuales = set(df.columns)
-                if not EXPECTED_COLUMNS.issubset(columnas_actuales):
-                    columnas_faltantes = EXPECTED_COLUMNS - columnas_actuales
-                    msg_error = f"Cabecera no contiene todas las columnas esperadas. Faltantes: {columnas_faltantes}"
-                    print(f"WARNING: Archivo {file_path.name} omitido. {msg_error}")
+    log_file_path = pathlib.Path("soap_log.csv" if args.log_format == "csv" else "soap_log.parquet")
+    if args.watch and not args.resume:
+        # El proceso vigilante conserva el log de la ejecución anterior en lugar de truncarlo.
+        rotado = rotar_log(log_file_path)
+        if rotado is not None:
+            log.info("Log anterior rotado a: %s", rotado)
+    # El registro escribe la cabecera al abrirse y mantiene el fichero abierto hasta el final.
+    # Al reanudar se añade al log existente en lugar de truncarlo.
+    registro = RegistroSOAP(
+        log_file_path,
+        formato=args.log_format,
+        max_filas_buffer=args.log_buffer_rows,
+        intervalo_flush=args.log_flush_interval,
+        truncar=not args.resume,
+        metricas=metricas,
+    )
+    # El bucle de resultados escribe directamente en el registro abierto: sin buscarlo
+    # por ruta en cada fila como hace log_soap_request.
+    registrar_log = registro.registrar if metricas is None else metricas.medir(registro.registrar, "log")
+    diario = None if args.no_checkpoint else DiarioCheckpoint(args.checkpoint)
+    indice_deduplicacion = IndiceDeduplicacion(args.dedup_index) if args.dedup else None
+    opciones_ingesta = {
+        "lector": leer_por_bloques if args.excel_cache is None else functools.partial(
+            leer_por_bloques, directorio_cache=args.excel_cache),
+        "tamano_bloque": args.chunk_size,
+        "ruta_checkpoint": None if args.no_checkpoint else args.checkpoint,
+        # En modo --watch un archivo que se vuelve a guardar sin cambios no reenvía sus
+        # filas confirmadas. El diario va por hash del archivo entero: si el contenido
+        # cambia, el archivo se reenvía completo (con --dedup solo salen sus filas nuevas).
+        "reanudar": args.resume or (args.watch and not args.no_checkpoint),
+        "medir": metricas is not None,
+        "indice_deduplicacion": indice_deduplicacion,
+    }
+    presupuesto = PresupuestoMemoria(args.max_memory << 20) if args.max_memory else None
+
+    politica = PoliticaEnvio(
+        max_reintentos=args.max_retries,
+        codigos_reintentables=args.retry_status,
+        espera_base=args.retry_backoff,
+        espera_maxima=args.retry_max_wait,
+        limitador=LimitadorTasa(args.max_rps) if args.max_rps else None,
+        concurrencia=ConcurrenciaAdaptativa(args.concurrency) if args.adaptive_concurrency else None,
+    )
+
+    def enviar(fila):
+        return politica.ejecutar(lambda: enviar_solicitud_soap(args.soap_endpoint, fila.cuerpo_soap, transporte))
+
+    def enviar_medido(fila):
+        # Cada intento (incluidos los reintentos) alimenta el histograma de latencia.
+        def intento():
+            inicio = time.perf_counter()
+            response = enviar_solicitud_soap(args.soap_endpoint, fila.cuerpo_soap, transporte)
+            metricas.registrar_envio(time.perf_counter() - inicio, len(fila.cuerpo_soap), response)
+            return response
+        return politica.ejecutar(intento)
+
+    def procesar(rutas, c):
+        # Lee, valida, envía y registra los archivos `rutas`, acumulando en los contadores `c`.
+        # Lectura, validación + sobres, envío y log son etapas de soap_batch/pipeline.py
+        # unidas por colas acotadas: la primera solicitud sale en cuanto se ha preparado
+        # el primer bloque y, si el envío va por detrás, la lectura se frena (también al
+        # llegar a --max-memory). Los resultados llegan en el orden de los eventos de
+        # ingesta. Con --events-per-request las filas viajan en lotes y sus resultados se
+        # reparten después fila a fila, de modo que el bucle y el log no distinguen ambos modos.
+        etapas = eventos = ingerir_por_etapas(rutas, args.parse_workers, presupuesto, **opciones_ingesta)
+        if log.isEnabledFor(logging.DEBUG):
+            eventos = _anunciar_envios(eventos)
+        resultados = enviar_eventos(
+            eventos,
+            enviar if metricas is None else enviar_medido,
+            concurrencia=args.concurrency,
+            eventos_por_solicitud=args.events_per_request,
+            max_bytes=args.max_request_bytes,
+            indice_deduplicacion=indice_deduplicacion,
+        )
+
+        # Sin -v no se escribe nada por fila: solo la línea de progreso (en un terminal) y
+        # un resumen periódico. Las etapas se cierran explícitamente al salir, también con
+        # Ctrl+C: si se dejaran al recolector, los procesos de --parse-workers seguirían
+        # bloqueados en su cola y el intérprete no terminaría al esperarlos.
+        with contextlib.closing(etapas), contextlib.closing(resultados), \
+                Progreso(rutas, linea=False if args.quiet else None,
+                         intervalo_resumen=None if args.quiet else args.progress_interval) as progreso:
+            for evento, resultado_envio, error in resultados:
+                if isinstance(evento, InicioArchivo):
+                    log.info("Procesando archivo: %s", evento.nombre_archivo)
+                    c.archivos_procesados += 1
+                    progreso.inicio_archivo(evento.nombre_archivo, evento.filas_estimadas)
+                    if evento.filas_ya_confirmadas:
+                        log.info("Reanudando %s: %s filas ya confirmadas se omiten", evento.nombre_archivo,
+                                 evento.filas_ya_confirmadas)
+                    continue
+
+                if isinstance(evento, TiemposArchivo):
+                    metricas.fusionar_etapas(evento.tiempos)
+                    continue
+
+                if isinstance(evento, ArchivoDescartado):
+                    if evento.resultado == "OMITIDO_CABECERA":
+                        log.warning("WARNING: Archivo %s omitido. %s", evento.nombre_archivo, evento.detalle)
+                    else:
+                        log.error("ERROR: %s. %s", evento.nombre_archivo, evento.detalle)
+                    progreso.fila(evento.nombre_archivo, OMITIDA, evento.filas)
                     # Loguear una entrada para todo el archivo omitido
-                    log_soap_request(log_file_path, file_path.name, "N/A", "N/A", "OMITIDO_CABECERA", msg_error)
-                    filas_omitidas_por_columnas_o_datos += len(df)
+                    registrar_log(evento.nombre_archivo, "N/A", "N/A", evento.resultado, evento.detalle)
+                    c.total_filas_leidas += evento.filas
+                    c.filas_omitidas_por_columnas_o_datos += evento.filas
                     continue
 
-                for index, row_original in df.iterrows():
-                    filas_procesadas_total += 1
-                    linea_excel = index + 2 # Para reportar al usuario (1-based + cabecera)
-                    
-                    # Validar datos de la fila
-                    datos_fila_map = row_original[list(EXPECTED_COLUMNS)].copy() # Usar .copy() para evitar SettingWithCopyWarning
-                    if datos_fila_map.isnull().any():
-                        cols_nulas = datos_fila_map[datos_fila_map.isnull()].index.tolist()
-                        msg_error = f"Contiene valores nulos en columnas esperadas: {cols_nulas}"
-                        print(f"WARNING: Fila {linea_excel} en {file_path.name} omitida. {msg_error}")
-                        log_soap_request(log_file_path, file_path.name, linea_excel, "N/A", "OMITIDO_NULOS", msg_error)
-                        filas_omitidas_por_columnas_o_datos +=1
-                        continue
-                    
-                    try:
-                        # La conversión de fecha ahora está dentro de generar_cuerpo_soap
-                        soap_body_str = generar_cuerpo_soap(datos_fila_map)
-                        print(f"  Fila {linea_excel}: Enviando SOAP para PNR {datos_fila_map['PNR_CODE']}")
-                        
-                        response = enviar_solicitud_soap(args.soap_endpoint, soap_body_str)
-
-                        if response is None:
-                            error_detalle = "Error de conexión o timeout"
-                            print(f"    ERROR DE CONEXIÓN: Fila {linea_excel}, PNR {datos_fila_map['PNR_CODE']}. {error_detalle}")
-                            log_soap_request(log_file_path, file_path.name, linea_excel, "N/A", "ERROR_CONEXION", error_detalle)
-                            filas_con_fallo_envio += 1
-                        else:
-                            if 200 <= response.status_code < 300:
-                                print(f"    SUCCESS: Fila {linea_excel}, PNR {datos_fila_map['PNR_CODE']}, Status: {response.status_code}")
-                                log_soap_request(log_file_path, file_path.name, linea_excel, response.status_code, "OK", "")
-                                filas_enviadas_exitosamente += 1
-                            else:
-                                error_text = response.text.strip() if response.text else "Respuesta vacía"
-                                print(f"    ERROR HTTP: Fila {linea_excel}, PNR {datos_fila_map['PNR_CODE']}, Status: {response.status_code}, Msg: {error_text[:100]}")
-                                log_soap_request(log_file_path, file_path.name, linea_excel, response.status_code, "ERROR_HTTP", error_text)
-                                filas_con_fallo_envio += 1
-                    
-                    except KeyError as e:
-                        msg_error = f"Falta la columna esperada: {e}"
-                        print(f"WARNING: Fila {linea_excel} en {file_path.name} omitida. {msg_error}")
-                        log_soap_request(log_file_path, file_path.name, linea_excel, "N/A", "ERROR_DATOS_FILA", msg_error)
-                        filas_omitidas_por_columnas_o_datos += 1
-                        continue # Asegurarse de que continúa al siguiente ciclo de fila
-                    except Exception as e:
-                        msg_error = f"Error inesperado procesando fila: {str(e)}"
-                        print(f"ERROR: Fila {linea_excel} en {file_path.name}. {msg_error}")
-                        log_soap_request(log_file_path, file_path.name, linea_excel, "N/A", "ERROR_PROCESANDO_FILA", msg_error)
-                        filas_con_fallo_envio += 1 # Contar como fallo de envío si no se pudo ni intentar enviar
-
-            except Exception as e:
-                msg_error = f"Error crítico leyendo o procesando el archivo: {str(e)}"
-                print(f"ERROR: {file_path.name}. {msg_error}")
-                log_soap_request(log_file_path, file_path.name, "N/A", "N/A", "ERROR_LECTURA_PROCESO_ARCHIVO", msg_error)
-                # Si el archivo no se puede leer, no hay filas que contar como omitidas individualmente,
-                # pero se podría añadir a un contador de archivos fallidos si fuera necesario.
-
-
-    print(f"\n--- Resumen del Procesamiento ---")
-    print(f"Total de archivos procesados (o intentados): {archivos_procesados}")
-    print(f"Total de filas leídas de los archivos: {total_filas_leidas}")
-    print(f"Total de filas procesadas (intentos de envío + omitidas individualmente): {filas_procesadas_total}")
-    print(f"Filas enviadas exitosamente: {filas_enviadas_exitosamente}")
-    print(f"Filas con fallo en el envío (conexión, HTTP error, o error procesando fila): {filas_con_fallo_envio}")
-    print(f"Filas omitidas (archivo con cabecera incorrecta, o fila con datos nulos/faltantes): {filas_omitidas_por_columnas_o_datos}")
+                fila = evento
+                nombre_archivo = fila.nombre_archivo
+                linea_excel = fila.linea_excel
+                c.total_filas_leidas += 1
+                if fila.resultado == "YA_CONFIRMADO":
+                    # Ya está en el log de la ejecución anterior: no se vuelve a registrar.
+                    c.filas_ya_confirmadas += 1
+                    progreso.fila(nombre_archivo)
+                    continue
+                c.filas_procesadas_total += 1
+
+                if fila.resultado is not None:
+                    # Fila descartada antes del envío (nulos o error construyendo el SOAP)
+                    if fila.resultado == "ERROR_PROCESANDO_FILA":
+                        log.debug("ERROR: Fila %s en %s. %s", linea_excel, nombre_archivo, fila.detalle)
+                        c.filas_con_fallo_envio += 1 # Contar como fallo de envío si no se pudo ni intentar enviar
+                        progreso.fila(nombre_archivo, ERROR)
+                    elif fila.resultado == "DUPLICADO":
+                        log.debug("INFO: Fila %s en %s (PNR %s) no se envía. %s", linea_excel, nombre_archivo, fila.pnr,
+                                  fila.detalle)
+                        c.filas_duplicadas += 1
+                        progreso.fila(nombre_archivo, OMITIDA)
+                    else:
+                        log.debug("WARNING: Fila %s en %s omitida. %s", linea_excel, nombre_archivo, fila.detalle)
+                        c.filas_omitidas_por_columnas_o_datos += 1
+                        progreso.fila(nombre_archivo, OMITIDA)
+                    registrar_log(nombre_archivo, linea_excel, "N/A", fila.resultado, fila.detalle)
+                    continue
+
+                if error is not None:
+                    msg_error = f"Error inesperado procesando fila: {str(error)}"
+                    log.debug("ERROR: Fila %s en %s. %s", linea_excel, nombre_archivo, msg_error)
+                    registrar_log(nombre_archivo, linea_excel, "N/A", "ERROR_PROCESANDO_FILA", msg_error)
+                    c.filas_con_fallo_envio += 1
+                    progreso.fila(nombre_archivo, ERROR)
+                    continue
+
+                response, reintentos = resultado_envio
+                c.filas_reintentadas += 1 if reintentos else 0
+                if response is None:
+                    error_detalle = _con_reintentos("Error de conexión o timeout", reintentos)
+                    log.debug("    ERROR DE CONEXIÓN: Fila %s, PNR %s. %s", linea_excel, fila.pnr, error_detalle)
+                    registrar_log(nombre_archivo, linea_excel, "N/A", "ERROR_CONEXION", error_detalle)
+                    c.filas_con_fallo_envio += 1
+                    progreso.fila(nombre_archivo, ERROR)
+                elif isinstance(response, FalloEvento):
+                    # Evento rechazado dentro de un sobre multievento.
+                    log.debug("    ERROR SOAP: Fila %s, PNR %s, Status: %s, Msg: %.100s", linea_excel, fila.pnr,
+                              response.status_code, response.detalle)
+                    registrar_log(nombre_archivo, linea_excel, response.status_code, "ERROR_SOAP",
+                                  _con_reintentos(response.detalle, reintentos))
+                    c.filas_con_fallo_envio += 1
+                    progreso.fila(nombre_archivo, ERROR)
+                elif 200 <= response.status_code < 300:
+                    log.debug("    SUCCESS: Fila %s, PNR %s, Status: %s%s", linea_excel, fila.pnr, response.status_code,
+                              _con_reintentos("", reintentos))
+                    registrar_log(nombre_archivo, linea_excel, response.status_code, "OK",
+                                  _con_reintentos("", reintentos).strip())
+                    c.filas_enviadas_exitosamente += 1
+                    progreso.fila(nombre_archivo, OK)
+                    if diario is not None:
+                        diario.confirmar(fila.hash_archivo, linea_excel)
+                    if indice_deduplicacion is not None and fila.clave is not None:
+                        indice_deduplicacion.agregar(fila.clave)
+                else:
+                    error_text = response.text.strip() if response.text else "Respuesta vacía"
+                    log.debug("    ERROR HTTP: Fila %s, PNR %s, Status: %s, Msg: %.100s", linea_excel, fila.pnr,
+                              response.status_code, error_text)
+                    registrar_log(nombre_archivo, linea_excel, response.status_code, "ERROR_HTTP",
+                                  _con_reintentos(error_text, reintentos))
+                    c.filas_con_fallo_envio += 1
+                    progreso.fila(nombre_archivo, ERROR)
+                if metricas is not None:
+                    metricas.fila_completada()
+
+    def guardar_metricas():
+        if args.metrics_json:
+            metricas.guardar_json(args.metrics_json)
+        if args.metrics_prom:
+            metricas.guardar_prometheus(args.metrics_prom)
+
+    def ciclo_vigilancia(rutas):
+        # Un ciclo del modo --watch: procesa solo los archivos nuevos o modificados con el
+        # mismo transporte, log, diario e índice, y deja todo persistido al terminar.
+        log.info("\n%s archivo(s) nuevo(s) o modificado(s) en %s", len(rutas), args.excel_dir)
+        contadores_ciclo = Contadores()
+        procesar(rutas, contadores_ciclo)
+        registro.flush()
+        if diario is not None:
+            diario.commit()
+        if indice_deduplicacion is not None:
+            indice_deduplicacion.commit()
+        if metricas is not None:
+            guardar_metricas()
+        _imprimir_resumen(contadores_ciclo, args, "--- Resumen del ciclo ---")
+        contadores.sumar(contadores_ciclo)
+
+    contadores = Contadores()
+    try:
+        if args.watch:
+            if parar is None:
+                parar = threading.Event()
+            en_hilo_principal = threading.current_thread() is threading.main_thread()
+            if en_hilo_principal:
+                sigterm_anterior = signal.signal(signal.SIGTERM, lambda *_: parar.set())
+            try:
+                espera = crear_espera(args.excel_dir)
+                log.info("Vigilando %s (cada %s s, %s). Ctrl+C para terminar.", args.excel_dir,
+                         args.watch_interval, espera.nombre)
+                try:
+                    vigilar(args.excel_dir, ciclo_vigilancia, intervalo=args.watch_interval, parar=parar,
+                            espera=espera)
+                except KeyboardInterrupt:
+                    log.warning("\nInterrumpido: cerrando el modo vigilancia...")
+            finally:
+                if en_hilo_principal:
+                    # None: el manejador anterior no se instaló desde Python; se deja el de por defecto.
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL if sigterm_anterior is None else sigterm_anterior)
+        else:
+            procesar(listar_archivos(args.excel_dir), contadores)
+    finally:
+        # Vaciar el buffer del log y del diario aunque la ejecución se interrumpa.
+        registro.close()
+        if diario is not None:
+            diario.close()
+        if indice_deduplicacion is not None:
+            indice_deduplicacion.close()
+        if transporte_propio:
+            transporte.close()
+        if metricas is not None:
+            # También tras una interrupción: las métricas parciales ayudan a ver dónde se atascó.
+            metricas.finalizar()
+            guardar_metricas()
+
+
+    _imprimir_resumen(contadores, args, "--- Resumen del Procesamiento ---")
     print(f"Logs guardados en: {log_file_path.resolve()}")
+    if presupuesto is not None:
+        print(f"Pico de datos en vuelo en el pipeline: {presupuesto.maximo / (1 << 20):.1f} MiB "
+              f"(presupuesto {args.max_memory} MiB)")
+    if metricas is not None:
+        resumen = metricas.resumen()
+        latencia = resumen["latencia_http_ms"]
+        if latencia["solicitudes"]:
+            print(f"Latencia HTTP (ms): p50 {latencia['p50']}, p95 {latencia['p95']}, p99 {latencia['p99']}")
+        for ruta_metricas in (args.metrics_json, args.metrics_prom):
+            if ruta_metricas:
+                print(f"Métricas guardadas en: {ruta_metricas.resolve()}")
 
 if __name__ == "__main__":
     main()
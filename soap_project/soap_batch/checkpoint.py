@@ -0,0 +1,98 @@
+import hashlib
+import pathlib
+import sqlite3
+import time
+
+RUTA_CHECKPOINT_POR_DEFECTO = pathlib.Path("soap_checkpoint.sqlite")
+FILAS_POR_COMMIT_POR_DEFECTO = 500
+INTERVALO_COMMIT_POR_DEFECTO = 1.0 # Segundos máximos con confirmaciones sin persistir
+
+
+def hash_archivo(ruta, tamano_lectura=1 << 20):
+    # Hash del contenido (no del nombre ni de la fecha): si el Excel cambia, sus filas
+    # se consideran nuevas; si solo se renombra o se copia, se reconocen.
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for trozo in iter(lambda: f.read(tamano_lectura), b""):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+def lineas_confirmadas_en(ruta_checkpoint, hash_archivo):
+    # Consulta de solo lectura, usable desde otros procesos mientras el proceso
+    # principal escribe en el diario (modo WAL).
+    ruta_checkpoint = pathlib.Path(ruta_checkpoint)
+    if not ruta_checkpoint.exists():
+        return set()
+    conexion = sqlite3.connect(f"{ruta_checkpoint.resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        cursor = conexion.execute(
+            "SELECT linea_excel FROM filas_confirmadas WHERE hash_archivo = ?", (hash_archivo,)
+        )
+        return {linea for (linea,) in cursor}
+    finally:
+        conexion.close()
+
+
+class DiarioCheckpoint:
+    # Diario persistente (SQLite) de las filas que recibieron una respuesta 2xx, por
+    # hash de archivo y línea del Excel. La clave primaria compuesta (tabla WITHOUT
+    # ROWID) hace que cargar las líneas confirmadas de un archivo sea una búsqueda por
+    # índice aunque el diario tenga millones de entradas; después la comprobación por
+    # fila es un `in` sobre un set en memoria.
+    #
+    # Las confirmaciones se agrupan y se persisten cada `filas_por_commit` filas o cada
+    # `intervalo_commit` segundos. Si el proceso muere, como mucho esas últimas filas
+    # se reenviarán al reanudar (entrega al menos una vez).
+
+    def __init__(self, ruta=RUTA_CHECKPOINT_POR_DEFECTO, filas_por_commit=FILAS_POR_COMMIT_POR_DEFECTO,
+                 intervalo_commit=INTERVALO_COMMIT_POR_DEFECTO):
+        self.ruta = pathlib.Path(ruta)
+        self.filas_por_commit = filas_por_commit
+        self.intervalo_commit = intervalo_commit
+        self.conexion = sqlite3.connect(self.ruta)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("PRAGMA synchronous=NORMAL")
+        self.conexion.execute(
+            "CREATE TABLE IF NOT EXISTS filas_confirmadas ("
+            " hash_archivo TEXT NOT NULL,"
+            " linea_excel INTEGER NOT NULL,"
+            " confirmada_en REAL NOT NULL,"
+            " PRIMARY KEY (hash_archivo, linea_excel)"
+            ") WITHOUT ROWID"
+        )
+        self.conexion.commit()
+        self._pendientes = []
+        self._ultimo_commit = time.monotonic()
+
+    def lineas_confirmadas(self, hash_archivo):
+        cursor = self.conexion.execute(
+            "SELECT linea_excel FROM filas_confirmadas WHERE hash_archivo = ?", (hash_archivo,)
+        )
+        return {linea for (linea,) in cursor}
+
+    def confirmar(self, hash_archivo, linea_excel):
+        self._pendientes.append((hash_archivo, linea_excel, time.time()))
+        if (len(self._pendientes) >= self.filas_por_commit
+                or time.monotonic() - self._ultimo_commit >= self.intervalo_commit):
+            self.commit()
+
+    def commit(self):
+        if self._pendientes:
+            self.conexion.executemany(
+                "INSERT OR IGNORE INTO filas_confirmadas (hash_archivo, linea_excel, confirmada_en) VALUES (?, ?, ?)",
+                self._pendientes,
+            )
+            self.conexion.commit()
+            self._pendientes.clear()
+        self._ultimo_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.conexion.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,151 @@
+import logging
+import math
+import sys
+import time
+
+# Logger de la utilidad. Los mensajes por fila van a DEBUG (solo con -v), los de cada
+# archivo a INFO y los problemas de un archivo completo a WARNING/ERROR (también con
+# --quiet). Se usa el formato perezoso de logging ("%s", args): si el nivel no está
+# activo el mensaje ni siquiera se formatea.
+log = logging.getLogger("soap_batch")
+
+INTERVALO_DIBUJO = 0.2 # Segundos mínimos entre dos redibujados de la línea de progreso
+INTERVALO_RESUMEN_POR_DEFECTO = 30.0 # Segundos entre resúmenes periódicos en el log
+
+# Índices de los contadores por archivo de Progreso
+OK, ERROR, OMITIDA = 0, 1, 2
+
+_progreso_activo = None # La línea de progreso que hay que borrar antes de escribir un mensaje
+
+
+class _ManejadorConsola(logging.StreamHandler):
+    def emit(self, record):
+        if _progreso_activo is not None:
+            _progreso_activo.borrar_linea()
+        super().emit(record)
+
+
+def configurar_consola(nivel=logging.INFO, flujo=None):
+    # (Re)configura el logger con un único manejador que escribe solo el mensaje en
+    # `flujo` (stdout por defecto). Se puede llamar en cada ejecución de main().
+    manejador = _ManejadorConsola(flujo or sys.stdout)
+    manejador.setFormatter(logging.Formatter("%(message)s"))
+    for anterior in list(log.handlers):
+        log.removeHandler(anterior)
+    log.addHandler(manejador)
+    log.setLevel(nivel)
+    log.propagate = False
+
+
+def _duracion(segundos):
+    minutos, segundos = divmod(int(segundos), 60)
+    horas, minutos = divmod(minutos, 60)
+    return f"{horas}:{minutos:02d}:{segundos:02d}" if horas else f"{minutos:02d}:{segundos:02d}"
+
+
+class Progreso:
+    # Progreso de una ejecución (o de un ciclo de --watch) con coste casi nulo por fila:
+    # fila() solo suma contadores y consulta el reloj. En un terminal, una única línea en
+    # `flujo` (stderr) se redibuja como mucho cada `intervalo` segundos con filas/s, ETA y
+    # los contadores OK/error/omitidas del archivo en curso; además, cada
+    # `intervalo_resumen` segundos se escribe el mismo texto en el log (útil cuando la
+    # salida se redirige a un fichero). Al terminar se registra el desglose por archivo.
+    #
+    # La ETA sale de las filas estimadas de cada archivo (las que anuncia su lector) y,
+    # para los archivos aún sin abrir, de su tamaño en bytes.
+
+    def __init__(self, rutas=(), flujo=None, linea=None, intervalo=INTERVALO_DIBUJO,
+                 intervalo_resumen=INTERVALO_RESUMEN_POR_DEFECTO, reloj=time.monotonic):
+        self.flujo = flujo or sys.stderr
+        self.linea = linea if linea is not None else self.flujo.isatty()
+        self.intervalo = intervalo
+        self.intervalo_resumen = intervalo_resumen if intervalo_resumen else math.inf
+        self.reloj = reloj
+        self.bytes_por_archivo = {}
+        for ruta in rutas:
+            try:
+                self.bytes_por_archivo[ruta.name] = ruta.stat().st_size
+            except OSError:
+                pass
+        self.filas_estimadas = {}
+        self.por_archivo = {}
+        self.filas = 0
+        self.archivo_actual = None
+        self.inicio = reloj()
+        self._ultimo_dibujo = -math.inf
+        self._ultimo_resumen = self.inicio
+        self._ancho = 0
+
+    def inicio_archivo(self, nombre_archivo, filas_estimadas=None):
+        self.archivo_actual = nombre_archivo
+        self.por_archivo.setdefault(nombre_archivo, [0, 0, 0])
+        if filas_estimadas:
+            self.filas_estimadas[nombre_archivo] = filas_estimadas
+
+    def fila(self, nombre_archivo, categoria=None, filas=1):
+        # `categoria` es OK, ERROR u OMITIDA; None solo hace avanzar el progreso.
+        self.filas += filas
+        if categoria is not None:
+            self.por_archivo.setdefault(nombre_archivo, [0, 0, 0])[categoria] += filas
+        ahora = self.reloj()
+        if self.linea and ahora - self._ultimo_dibujo >= self.intervalo:
+            self._dibujar(ahora)
+        if ahora - self._ultimo_resumen >= self.intervalo_resumen:
+            self._ultimo_resumen = ahora
+            log.info("Progreso: %s", self.texto(ahora))
+
+    def filas_totales_estimadas(self):
+        conocidas = sum(self.filas_estimadas.values())
+        bytes_conocidos = sum(self.bytes_por_archivo.get(nombre, 0) for nombre in self.filas_estimadas)
+        bytes_restantes = sum(self.bytes_por_archivo.values()) - bytes_conocidos
+        if bytes_restantes <= 0:
+            return conocidas or None
+        if not bytes_conocidos:
+            return None
+        return conocidas + bytes_restantes * conocidas / bytes_conocidos
+
+    def texto(self, ahora=None):
+        ahora = self.reloj() if ahora is None else ahora
+        transcurrido = ahora - self.inicio
+        ritmo = self.filas / transcurrido if transcurrido > 0 else 0.0
+        total = self.filas_totales_estimadas()
+        avance = f"{self.filas} filas"
+        eta = "ETA --:--"
+        if total:
+            avance += f" de ~{int(total)} ({min(100.0, self.filas * 100 / total):.0f}%)"
+            if ritmo > 0:
+                eta = f"ETA {_duracion(max(0.0, total - self.filas) / ritmo)}"
+        partes = [avance, f"{ritmo:.0f} filas/s", eta]
+        if self.archivo_actual is not None:
+            ok, error, omitidas = self.por_archivo[self.archivo_actual]
+            partes.append(f"{self.archivo_actual}: {ok} OK, {error} con error, {omitidas} omitidas")
+        return " | ".join(partes)
+
+    def _dibujar(self, ahora):
+        texto = self.texto(ahora)
+        self.flujo.write("\r" + texto.ljust(self._ancho))
+        self.flujo.flush()
+        self._ancho = len(texto)
+        self._ultimo_dibujo = ahora
+
+    def borrar_linea(self):
+        if self._ancho:
+            self.flujo.write("\r" + " " * self._ancho + "\r")
+            self.flujo.flush()
+            self._ancho = 0
+            self._ultimo_dibujo = -math.inf # Redibujar en la siguiente fila
+
+    def terminar(self):
+        self.borrar_linea()
+        for nombre_archivo, (ok, error, omitidas) in self.por_archivo.items():
+            log.info("  %s: %d OK, %d con error, %d omitidas", nombre_archivo, ok, error, omitidas)
+
+    def __enter__(self):
+        global _progreso_activo
+        _progreso_activo = self
+        return self
+
+    def __exit__(self, *exc):
+        global _progreso_activo
+        _progreso_activo = None
+        self.terminar()
@@ -0,0 +1,212 @@
+import hashlib
+import math
+import os
+import pathlib
+import sqlite3
+import struct
+import threading
+import time
+
+RUTA_INDICE_POR_DEFECTO = pathlib.Path("soap_dedup.sqlite")
+CAPACIDAD_MINIMA_BLOOM = 1_000_000
+TASA_FALSOS_POSITIVOS = 0.01
+FILAS_POR_COMMIT_POR_DEFECTO = 500
+INTERVALO_COMMIT_POR_DEFECTO = 1.0
+
+MOTIVO_YA_ENVIADO = "Evento ya enviado en una ejecución anterior"
+MOTIVO_REPETIDO = "Evento repetido en esta ejecución"
+
+_SEPARADOR = "\x1f"
+# Cabecera del filtro de Bloom guardado junto al índice: marca, capacidad, funciones y
+# número de claves del índice que contiene.
+_CABECERA_BLOOM = struct.Struct("<4sQQQ")
+_MARCA_BLOOM = b"SDB1"
+
+
+def clave_evento(valores):
+    # Identidad de un evento: PNR_CODE, CDIAPTO, FECHA_EVENTO y ASIENTO normalizados
+    # (sin espacios en los extremos y en mayúsculas; la fecha ya llega como YYYY-MM-DD).
+    # La tarjeta de fidelización no forma parte de la clave. `valores` sigue el orden de
+    # COLUMNAS_EVENTO. Se guarda como un hash de 16 bytes.
+    cdiapto, fecha_evento, pnr, asiento = valores[0], valores[1], valores[2], valores[3]
+    normalizada = _SEPARADOR.join((pnr.strip().upper(), cdiapto.strip().upper(), fecha_evento.strip(),
+                                   asiento.strip().upper()))
+    return hashlib.blake2b(normalizada.encode("utf-8"), digest_size=16).digest()
+
+
+class FiltroBloom:
+    # Filtro de Bloom sobre claves que ya son hashes uniformes: las k posiciones salen
+    # de las dos mitades de la clave (doble hashing), sin volver a hashear.
+
+    def __init__(self, capacidad, tasa_falsos_positivos=TASA_FALSOS_POSITIVOS):
+        capacidad = max(1, capacidad)
+        self.capacidad = capacidad
+        self.bits = max(8, int(-capacidad * math.log(tasa_falsos_positivos) / (math.log(2) ** 2)))
+        self.funciones = max(1, round(self.bits / capacidad * math.log(2)))
+        self._tabla = bytearray((self.bits + 7) // 8)
+
+    def _posiciones(self, clave):
+        h1 = int.from_bytes(clave[:8], "little")
+        h2 = int.from_bytes(clave[8:16], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.funciones))
+
+    def agregar(self, clave):
+        for posicion in self._posiciones(clave):
+            self._tabla[posicion >> 3] |= 1 << (posicion & 7)
+
+    def __contains__(self, clave):
+        return all(self._tabla[posicion >> 3] & (1 << (posicion & 7)) for posicion in self._posiciones(clave))
+
+
+class IndiceDeduplicacion:
+    # Índice persistente (SQLite) de las claves de los eventos enviados con éxito, con un
+    # filtro de Bloom en memoria delante: la gran mayoría de eventos nuevos se descartan
+    # sin tocar el disco y solo los positivos del filtro se confirman con una búsqueda
+    # por clave primaria. Como el diario de checkpoint, las altas se agrupan por commits.
+    #
+    # Con `solo_lectura` no se crea ni se modifica la base de datos (procesos de ingesta).
+    # Se puede consultar desde un hilo (la etapa de preparación del pipeline) mientras
+    # otro registra las altas: los accesos a la conexión van bajo un cerrojo.
+    #
+    # Reconstruir el filtro recorriendo la tabla cuesta segundos por millón de claves, así
+    # que al cerrar se guarda en `<ruta>.bloom` y al abrir se reutiliza si sigue cubriendo
+    # exactamente las claves de la tabla. Los procesos de ingesta reciben el filtro ya
+    # cargado del proceso principal (`bloom`) en lugar de cargarlo cada uno.
+
+    def __init__(self, ruta=RUTA_INDICE_POR_DEFECTO, solo_lectura=False,
+                 filas_por_commit=FILAS_POR_COMMIT_POR_DEFECTO, intervalo_commit=INTERVALO_COMMIT_POR_DEFECTO,
+                 bloom=None):
+        self.ruta = pathlib.Path(ruta)
+        self.ruta_bloom = self.ruta.with_name(self.ruta.name + ".bloom")
+        self.solo_lectura = solo_lectura
+        self.filas_por_commit = filas_por_commit
+        self.intervalo_commit = intervalo_commit
+        self._pendientes = []
+        self._ultimo_commit = time.monotonic()
+        self._cerrojo = threading.Lock()
+        if solo_lectura:
+            self.conexion = None
+            if self.ruta.exists():
+                self.conexion = sqlite3.connect(f"{self.ruta.resolve().as_uri()}?mode=ro", uri=True,
+                                                check_same_thread=False)
+        else:
+            self.conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            self.conexion.execute("PRAGMA journal_mode=WAL")
+            self.conexion.execute("PRAGMA synchronous=NORMAL")
+            self.conexion.execute(
+                "CREATE TABLE IF NOT EXISTS eventos_enviados ("
+                " clave BLOB PRIMARY KEY,"
+                " enviado_en REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self.conexion.commit()
+        self._cargar_bloom(bloom)
+
+    def _contar(self):
+        if self.conexion is None:
+            return 0
+        (total,) = self.conexion.execute("SELECT COUNT(*) FROM eventos_enviados").fetchone()
+        return total
+
+    def _cargar_bloom(self, bloom=None):
+        total = self._contar()
+        if bloom is None and total:
+            bloom = self._leer_bloom(total)
+        if bloom is None:
+            # Margen para las altas de esta ejecución sin que se dispare la tasa de falsos positivos.
+            bloom = FiltroBloom(max(CAPACIDAD_MINIMA_BLOOM, total * 2))
+            if total:
+                for (clave,) in self.conexion.execute("SELECT clave FROM eventos_enviados"):
+                    bloom.agregar(clave)
+        self.bloom = bloom
+        self.total = total
+
+    def _leer_bloom(self, total):
+        # El filtro guardado solo vale si contiene las mismas claves que la tabla (las
+        # claves nunca se borran, así que basta con comparar cuántas hay) y si no se ha
+        # superado la capacidad para la que se dimensionó; si no, se reconstruye.
+        try:
+            with open(self.ruta_bloom, "rb") as f:
+                marca, capacidad, funciones, total_guardado = _CABECERA_BLOOM.unpack(f.read(_CABECERA_BLOOM.size))
+                tabla = f.read()
+        except (OSError, struct.error):
+            return None
+        if marca != _MARCA_BLOOM or total_guardado != total or total > capacidad:
+            return None
+        bloom = FiltroBloom(capacidad)
+        if bloom.funciones != funciones or len(tabla) != len(bloom._tabla):
+            return None
+        bloom._tabla = bytearray(tabla)
+        return bloom
+
+    def _guardar_bloom(self):
+        # Se escribe en un temporal y se renombra: un cierre a medias deja el filtro
+        # anterior, que al no cuadrar con la tabla se descarta en la siguiente carga.
+        cabecera = _CABECERA_BLOOM.pack(_MARCA_BLOOM, self.bloom.capacidad, self.bloom.funciones, self._contar())
+        temporal = self.ruta_bloom.with_name(self.ruta_bloom.name + ".tmp")
+        with open(temporal, "wb") as f:
+            f.write(cabecera)
+            f.write(self.bloom._tabla)
+        os.replace(temporal, self.ruta_bloom)
+
+    def __contains__(self, clave):
+        if clave not in self.bloom:
+            return False
+        with self._cerrojo:
+            if self.conexion is None:
+                return False
+            fila = self.conexion.execute("SELECT 1 FROM eventos_enviados WHERE clave = ?", (clave,)).fetchone()
+            return fila is not None or any(pendiente == clave for pendiente, _ in self._pendientes)
+
+    def agregar(self, clave):
+        if self.solo_lectura:
+            raise ValueError("El índice de deduplicación está abierto en solo lectura")
+        self.bloom.agregar(clave)
+        with self._cerrojo:
+            self._pendientes.append((clave, time.time()))
+        if (len(self._pendientes) >= self.filas_por_commit
+                or time.monotonic() - self._ultimo_commit >= self.intervalo_commit):
+            self.commit()
+
+    def commit(self):
+        with self._cerrojo:
+            if self._pendientes:
+                self.conexion.executemany(
+                    "INSERT OR IGNORE INTO eventos_enviados (clave, enviado_en) VALUES (?, ?)", self._pendientes
+                )
+                self.conexion.commit()
+                self.total += len(self._pendientes)
+                self._pendientes.clear()
+            self._ultimo_commit = time.monotonic()
+
+    def close(self):
+        if self.conexion is not None:
+            if not self.solo_lectura:
+                self.commit()
+                self._guardar_bloom()
+            with self._cerrojo:
+                self.conexion.close()
+                self.conexion = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Deduplicador:
+    # Decide, fila a fila y antes de construir el sobre, si un evento ya se envió en una
+    # ejecución anterior según el índice. Los repetidos dentro de la misma ejecución no
+    # se deciden aquí: una copia solo cuenta como enviada cuando se confirma, así que eso
+    # lo resuelve la etapa de envío (pipeline.enviar_eventos) con el resultado de la copia
+    # anterior ya registrado.
+
+    def __init__(self, indice=None):
+        self.indice = indice
+
+    def motivo_duplicado(self, clave):
+        # Devuelve el detalle para el log si el evento es un duplicado, o None si no lo es.
+        if self.indice is not None and clave in self.indice:
+            return MOTIVO_YA_ENVIADO
+        return None
@@ -0,0 +1,81 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# Marcador que se puede intercalar entre los elementos: antes de pedir el siguiente, se
+# espera a las llamadas en vuelo y se entregan todos los resultados pendientes. No se
+# devuelve como resultado.
+BARRERA = object()
+
+# Elementos que puede retener la ventana por cada llamada en vuelo, contando también
+# los que no pasan el filtro: así una racha de elementos filtrados detrás de una
+# petición lenta no se acumula sin límite.
+ELEMENTOS_POR_LLAMADA = 4
+
+
+def _resolver(elemento, futuro):
+    if futuro is None:
+        return elemento, None, None
+    try:
+        return elemento, futuro.result(), None
+    except Exception as e:
+        return elemento, None, e
+
+
+def despachar_en_orden(elementos, funcion, concurrencia=1, filtro=None):
+    # Aplica `funcion` a cada elemento manteniendo como máximo `concurrencia` llamadas
+    # en vuelo. Devuelve tuplas (elemento, resultado, excepcion) en el mismo orden de
+    # entrada, de modo que el log y los contadores no dependen del orden en que
+    # terminan las peticiones. Los elementos para los que `filtro` devuelve False se
+    # devuelven tal cual, sin llamar a `funcion`, respetando su posición.
+    if concurrencia <= 1:
+        for elemento in elementos:
+            if elemento is BARRERA:
+                continue # En serie no hay nada en vuelo
+            if filtro is not None and not filtro(elemento):
+                yield elemento, None, None
+                continue
+            try:
+                resultado = funcion(elemento)
+            except Exception as e:
+                yield elemento, None, e
+                continue
+            yield elemento, resultado, None
+        return
+
+    ventana = collections.deque()
+    en_vuelo = 0
+    max_ventana = concurrencia * ELEMENTOS_POR_LLAMADA
+    executor = ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="soap-envio")
+    try:
+        for elemento in elementos:
+            if elemento is BARRERA:
+                while ventana:
+                    yield _resolver(*ventana.popleft())
+                en_vuelo = 0
+                continue
+
+            futuro = None
+            if filtro is None or filtro(elemento):
+                futuro = executor.submit(funcion, elemento)
+                en_vuelo += 1
+            ventana.append((elemento, futuro))
+
+            # Entregar todo lo que ya esté listo en cabeza; si hay tantas llamadas en vuelo
+            # como permite `concurrencia`, o la ventana retiene ya max_ventana elementos,
+            # bloquear en el elemento más antiguo para no superar el límite.
+            while ventana:
+                elemento_cabeza, futuro_cabeza = ventana[0]
+                if (futuro_cabeza is not None and en_vuelo < concurrencia and len(ventana) < max_ventana
+                        and not futuro_cabeza.done()):
+                    break
+                ventana.popleft()
+                if futuro_cabeza is not None:
+                    en_vuelo -= 1
+                yield _resolver(elemento_cabeza, futuro_cabeza)
+
+        while ventana:
+            elemento_cabeza, futuro_cabeza = ventana.popleft()
+            yield _resolver(elemento_cabeza, futuro_cabeza)
+    finally:
+        # Si el consumidor abandona antes de tiempo, no lanzar peticiones pendientes.
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,332 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from soap_batch.checkpoint import hash_archivo, lineas_confirmadas_en
+from soap_batch.deduplicacion import Deduplicador, IndiceDeduplicacion, clave_evento
+from soap_batch.lectores import (
+    FILAS_ESTIMADAS,
+    HASH_CONTENIDO,
+    LECTORES,
+    TAMANO_BLOQUE_POR_DEFECTO,
+    leer_por_bloques,
+)
+from soap_batch.metricas import TiemposArchivo, TiemposEtapas
+from soap_batch.sobre_soap import construir_cuerpo_soap, construir_cuerpos_soap
+from soap_batch.validacion import COLUMNAS_EVENTO, columnas_faltantes, validar_bloque
+
+# Eventos que produce la ingesta de cada archivo, en este orden: un InicioArchivo,
+# después una FilaPreparada por fila y, si el archivo no se puede procesar, un
+# ArchivoDescartado (con `filas` leídas que se cuentan como omitidas). Si se piden
+# métricas, cada archivo termina además con un TiemposArchivo. `filas_estimadas` es la
+# estimación de filas que da el lector al abrir el archivo (None si no la conoce).
+InicioArchivo = namedtuple("InicioArchivo", ["nombre_archivo", "filas_ya_confirmadas", "filas_estimadas"],
+                           defaults=(None,))
+ArchivoDescartado = namedtuple("ArchivoDescartado", ["nombre_archivo", "resultado", "detalle", "filas"])
+
+# Resultado de preparar una fila: o bien trae el cuerpo SOAP listo para enviar,
+# o bien el código de resultado y el detalle con el que se omite. `clave` es la clave
+# de deduplicación del evento (solo con deduplicación activa).
+FilaPreparada = namedtuple(
+    "FilaPreparada",
+    ["nombre_archivo", "linea_excel", "pnr", "cuerpo_soap", "resultado", "detalle", "hash_archivo", "clave"],
+    defaults=(None,),
+)
+
+# Un bloque leído de un archivo, con lo necesario para validarlo y construir sus sobres
+# en otra etapa: el hash del archivo, sus líneas ya confirmadas (al reanudar) y el
+# TiemposEtapas del archivo (solo si se mide).
+BloqueLeido = namedtuple("BloqueLeido",
+                         ["nombre_archivo", "bloque", "hash_archivo", "lineas_confirmadas", "tiempos"])
+
+_INDICE_PNR = COLUMNAS_EVENTO.index("PNR_CODE")
+
+
+def listar_archivos(directorio):
+    # Archivos de todas las extensiones con lector registrado, por orden de registro.
+    return [ruta for extension in LECTORES for ruta in directorio.glob(f"*{extension}")]
+
+
+def preparar_filas(df, nombre_archivo="", hash_actual=None, lineas_confirmadas=None, tiempos=None,
+                   deduplicador=None):
+    # Valida el bloque completo de una vez y construye los cuerpos SOAP de todas sus
+    # filas válidas con la API por lotes. Con `deduplicador` los eventos ya enviados en
+    # una ejecución anterior se descartan antes de construir su sobre (los repetidos
+    # dentro de la ejecución los decide la etapa de envío). Con `tiempos` (un
+    # TiemposEtapas) se mide cuánto cuesta cada etapa.
+    if lineas_confirmadas:
+        # Al reanudar, las filas ya confirmadas se descartan antes de validar o construir nada.
+        ya_confirmadas = (df.index + 2).isin(lineas_confirmadas)
+        if ya_confirmadas.any():
+            for linea_excel in (df.index[ya_confirmadas] + 2).tolist():
+                yield FilaPreparada(nombre_archivo, linea_excel, None, None, "YA_CONFIRMADO", "", hash_actual)
+            df = df[~ya_confirmadas]
+
+    inicio = time.perf_counter()
+    filas = validar_bloque(df)
+    validas = [fila for fila in filas if fila.valores is not None]
+    if tiempos is not None:
+        tiempos.sumar("validacion", time.perf_counter() - inicio)
+        inicio = time.perf_counter()
+
+    claves = {}
+    duplicadas = {}
+    if deduplicador is not None:
+        for fila in validas:
+            clave = clave_evento(fila.valores)
+            motivo = deduplicador.motivo_duplicado(clave)
+            if motivo is None:
+                claves[fila.linea_excel] = clave
+            else:
+                duplicadas[fila.linea_excel] = motivo
+        if duplicadas:
+            validas = [fila for fila in validas if fila.linea_excel not in duplicadas]
+        if tiempos is not None:
+            tiempos.sumar("deduplicacion", time.perf_counter() - inicio)
+            inicio = time.perf_counter()
+
+    try:
+        cuerpos = construir_cuerpos_soap(fila.valores for fila in validas)
+    except Exception:
+        cuerpos = None # Reintentar fila a fila para aislar la que falla
+    if tiempos is not None:
+        tiempos.sumar("sobre", time.perf_counter() - inicio)
+
+    cuerpos_por_linea = dict(zip((fila.linea_excel for fila in validas), cuerpos or ()))
+    for fila in filas:
+        if fila.valores is None:
+            yield FilaPreparada(nombre_archivo, fila.linea_excel, None, None, fila.resultado, fila.detalle, hash_actual)
+            continue
+        if fila.linea_excel in duplicadas:
+            yield FilaPreparada(nombre_archivo, fila.linea_excel, fila.valores[_INDICE_PNR], None, "DUPLICADO",
+                                duplicadas[fila.linea_excel], hash_actual)
+            continue
+
+        soap_body = cuerpos_por_linea.get(fila.linea_excel)
+        if soap_body is None:
+            try:
+                soap_body = construir_cuerpo_soap(fila.valores)
+            except Exception as e:
+                msg_error = f"Error inesperado procesando fila: {str(e)}"
+                yield FilaPreparada(nombre_archivo, fila.linea_excel, None, None, "ERROR_PROCESANDO_FILA", msg_error,
+                                    hash_actual)
+                continue
+
+        yield FilaPreparada(nombre_archivo, fila.linea_excel, fila.valores[_INDICE_PNR], soap_body, None, None,
+                            hash_actual, claves.get(fila.linea_excel))
+
+
+def _bloques_medidos(bloques, tiempos):
+    # Suma a "ingesta" lo que tarda el lector en entregar cada bloque.
+    while True:
+        inicio = time.perf_counter()
+        try:
+            bloque = next(bloques)
+        except StopIteration:
+            return
+        finally:
+            tiempos.sumar("ingesta", time.perf_counter() - inicio)
+        yield bloque
+
+
+def leer_archivo(ruta, tamano_bloque=TAMANO_BLOQUE_POR_DEFECTO, ruta_checkpoint=None, reanudar=False,
+                 lector=leer_por_bloques, tiempos=None):
+    # Primera etapa de la ingesta: lee un archivo bloque a bloque y entrega un
+    # InicioArchivo seguido de un BloqueLeido por bloque, sin validar ni construir nada.
+    # Cualquier error de lectura se convierte en un ArchivoDescartado para que el resto
+    # del lote continúe.
+    try:
+        bloques = lector(ruta, tamano_bloque=tamano_bloque)
+        if tiempos is not None:
+            bloques = _bloques_medidos(bloques, tiempos)
+        primer_bloque = next(bloques)
+
+        inicio = time.perf_counter()
+        hash_actual = None
+        if ruta_checkpoint is not None: # Con --excel-cache el lector ya lo ha calculado
+            hash_actual = primer_bloque.attrs.get(HASH_CONTENIDO) or hash_archivo(ruta)
+        lineas_confirmadas = lineas_confirmadas_en(ruta_checkpoint, hash_actual) if reanudar else None
+        if tiempos is not None:
+            tiempos.sumar("ingesta", time.perf_counter() - inicio, llamadas=0)
+        yield InicioArchivo(ruta.name, len(lineas_confirmadas or ()), primer_bloque.attrs.get(FILAS_ESTIMADAS))
+
+        faltantes = columnas_faltantes(primer_bloque.columns)
+        if faltantes:
+            msg_error = f"Cabecera no contiene todas las columnas esperadas. Faltantes: {faltantes}"
+            filas_archivo = len(primer_bloque) + sum(len(bloque) for bloque in bloques)
+            yield ArchivoDescartado(ruta.name, "OMITIDO_CABECERA", msg_error, filas_archivo)
+            return
+
+        yield BloqueLeido(ruta.name, primer_bloque, hash_actual, lineas_confirmadas, tiempos)
+        for bloque in bloques:
+            yield BloqueLeido(ruta.name, bloque, hash_actual, lineas_confirmadas, tiempos)
+    except Exception as e:
+        msg_error = f"Error crítico leyendo o procesando el archivo: {str(e)}"
+        yield ArchivoDescartado(ruta.name, "ERROR_LECTURA_PROCESO_ARCHIVO", msg_error, 0)
+
+
+def leer_archivos(rutas, medir=False, **opciones):
+    # leer_archivo para varios archivos. Con `medir` cada archivo termina con un
+    # TiemposArchivo, que la etapa de preparación deja pasar cuando ya ha sumado los
+    # tiempos de todos sus bloques.
+    for ruta in rutas:
+        tiempos = TiemposEtapas() if medir else None
+        yield from leer_archivo(ruta, tiempos=tiempos, **opciones)
+        if tiempos is not None:
+            yield TiemposArchivo(ruta.name, tiempos)
+
+
+def preparar_bloques(elementos, deduplicador=None, descartados=None):
+    # Segunda etapa de la ingesta: sustituye cada BloqueLeido por las FilaPreparada de
+    # sus filas; el resto de eventos pasan tal cual. Si un bloque falla, su archivo se
+    # descarta y se ignoran sus bloques siguientes. `descartados` (un set de nombres de
+    # archivo) permite conservar ese estado entre llamadas con bloques sueltos.
+    descartados = set() if descartados is None else descartados
+    for elemento in elementos:
+        if not isinstance(elemento, BloqueLeido):
+            yield elemento
+            continue
+        if elemento.nombre_archivo in descartados:
+            continue
+        try:
+            yield from preparar_filas(elemento.bloque, elemento.nombre_archivo, elemento.hash_archivo,
+                                      elemento.lineas_confirmadas, elemento.tiempos, deduplicador)
+        except Exception as e:
+            descartados.add(elemento.nombre_archivo)
+            msg_error = f"Error crítico leyendo o procesando el archivo: {str(e)}"
+            yield ArchivoDescartado(elemento.nombre_archivo, "ERROR_LECTURA_PROCESO_ARCHIVO", msg_error, 0)
+
+
+def eventos_archivo(ruta, deduplicador=None, **opciones):
+    # Lee, valida y prepara un archivo bloque a bloque (ambas etapas en el mismo hilo).
+    yield from preparar_bloques(leer_archivos([ruta], **opciones), deduplicador)
+
+
+def ingerir_en_serie(rutas, indice_deduplicacion=None, **opciones):
+    # Con `indice_deduplicacion` (un IndiceDeduplicacion) se descartan los eventos ya
+    # enviados en una ejecución anterior.
+    deduplicador = Deduplicador(indice_deduplicacion) if indice_deduplicacion is not None else None
+    yield from preparar_bloques(leer_archivos(rutas, **opciones), deduplicador)
+
+
+# --- Ingesta en paralelo ---
+
+_cola_trabajador = None # Cola compartida, heredada por cada proceso al arrancar
+_cancelado_trabajador = None # Evento que el consumidor activa si abandona la ingesta
+_deduplicador_trabajador = None # Sobre el índice en solo lectura; uno por proceso
+_FIN_ARCHIVO = "FIN_ARCHIVO"
+_ESPERA_PUT = 0.1 # Segundos entre comprobaciones de cancelación con la cola llena
+
+
+class _Cancelado(Exception):
+    pass
+
+
+def _inicializar_trabajador(cola, cancelado, ruta_deduplicacion=None, bloom=None):
+    global _cola_trabajador, _cancelado_trabajador, _deduplicador_trabajador
+    # Ctrl+C lo gestiona el proceso principal, que cancela la ingesta y cierra el pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _cola_trabajador = cola
+    _cancelado_trabajador = cancelado
+    if ruta_deduplicacion is not None:
+        # El filtro de Bloom llega ya cargado del proceso principal: no se recorre la tabla.
+        _deduplicador_trabajador = Deduplicador(IndiceDeduplicacion(ruta_deduplicacion, solo_lectura=True,
+                                                                    bloom=bloom))
+
+
+def _poner(elemento):
+    # put en la cola acotada que se rinde si el consumidor ha abandonado la ingesta.
+    while True:
+        if _cancelado_trabajador.is_set():
+            raise _Cancelado()
+        try:
+            _cola_trabajador.put(elemento, timeout=_ESPERA_PUT)
+            return
+        except queue.Full:
+            pass
+
+
+def _ingerir_archivo(ruta, opciones):
+    # Se ejecuta en un proceso del pool. Los eventos viajan en lotes (uno por bloque
+    # leído) para no pagar un put/pickle por fila; la cola acotada bloquea este put
+    # cuando el emisor va por detrás, frenando el parseo.
+    tamano_lote = opciones.get("tamano_bloque", TAMANO_BLOQUE_POR_DEFECTO)
+    lote = []
+    try:
+        try:
+            for evento in eventos_archivo(ruta, deduplicador=_deduplicador_trabajador, **opciones):
+                lote.append(evento)
+                if len(lote) >= tamano_lote:
+                    _poner((ruta, lote))
+                    lote = []
+        finally:
+            if lote:
+                _poner((ruta, lote))
+            _poner((ruta, _FIN_ARCHIVO))
+    except _Cancelado:
+        pass
+
+
+def ingerir_en_paralelo(rutas, trabajadores, lotes_en_cola=None, indice_deduplicacion=None, **opciones):
+    # Parsea y valida varios archivos a la vez en un pool de procesos y entrega sus
+    # eventos a un único consumidor a través de una cola acotada. Los lotes de distintos
+    # archivos pueden intercalarse, pero los de un mismo archivo llegan en orden porque
+    # los produce un único proceso.
+    rutas = list(rutas)
+    if not rutas:
+        return
+    contexto = multiprocessing.get_context("spawn") # Evita fork con hilos activos (log, transporte)
+    cola = contexto.Queue(maxsize=lotes_en_cola or trabajadores * 2)
+    cancelado = contexto.Event()
+    ruta_deduplicacion = indice_deduplicacion.ruta if indice_deduplicacion is not None else None
+    bloom = indice_deduplicacion.bloom if indice_deduplicacion is not None else None
+    executor = ProcessPoolExecutor(max_workers=trabajadores, mp_context=contexto,
+                                   initializer=_inicializar_trabajador,
+                                   initargs=(cola, cancelado, ruta_deduplicacion, bloom))
+    pendientes = set(rutas)
+    try:
+        futuros = {executor.submit(_ingerir_archivo, ruta, opciones): ruta for ruta in rutas}
+        while pendientes:
+            try:
+                ruta, lote = cola.get(timeout=0.5)
+            except queue.Empty:
+                # Si un proceso muere sin llegar a enviar su FIN, no esperar indefinidamente.
+                for futuro, ruta_futuro in futuros.items():
+                    if ruta_futuro in pendientes and futuro.done() and futuro.exception() is not None:
+                        pendientes.discard(ruta_futuro)
+                        msg_error = f"Error crítico leyendo o procesando el archivo: {futuro.exception()}"
+                        yield ArchivoDescartado(ruta_futuro.name, "ERROR_LECTURA_PROCESO_ARCHIVO", msg_error, 0)
+                continue
+            if lote == _FIN_ARCHIVO:
+                pendientes.discard(ruta)
+                continue
+            yield from lote
+    finally:
+        if pendientes:
+            # El consumidor abandona (o falla) a mitad: los procesos pueden estar
+            # bloqueados en un put con la cola llena, o con su hilo alimentador esperando a
+            # que alguien lea la tubería para poder terminar. Se les pide parar y se vacía
+            # la cola hasta que el pool se haya cerrado.
+            cancelado.set()
+            drenado = threading.Event()
+            drenador = threading.Thread(target=_drenar, args=(cola, drenado), name="soap-drenado", daemon=True)
+            drenador.start()
+            try:
+                executor.shutdown(wait=True, cancel_futures=True)
+            finally:
+                drenado.set()
+                drenador.join()
+        else:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _drenar(cola, parar):
+    while not parar.is_set():
+        try:
+            cola.get(timeout=_ESPERA_PUT)
+        except queue.Empty:
+            pass
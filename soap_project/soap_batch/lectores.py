@@ -0,0 +1,299 @@
+import itertools
+import os
+import pathlib
+import tempfile
+
+import openpyxl
+import pandas as pd
+import xlrd
+
+from soap_batch.checkpoint import hash_archivo
+from soap_batch.validacion import COLUMNAS_EVENTO, EXPECTED_COLUMNS, columnas_faltantes, normalizar_fechas
+
+TAMANO_BLOQUE_POR_DEFECTO = 1000 # Filas por bloque entregado al emisor
+VERSION_CACHE = 2 # Cambia si cambia el contenido de la caché Parquet de los Excel
+
+# Clave de DataFrame.attrs con la que el primer bloque de un archivo anuncia cuántas
+# filas de datos tiene aproximadamente (para el progreso). Es opcional para los lectores.
+FILAS_ESTIMADAS = "filas_estimadas"
+
+# Clave de DataFrame.attrs con el hash del contenido del archivo, cuando el lector ya lo
+# ha calculado (la caché de los Excel lo usa como nombre) y la ingesta puede reutilizarlo.
+HASH_CONTENIDO = "hash_contenido"
+
+
+def _anunciar_filas(df, filas, filas_cabecera=0):
+    if filas:
+        df.attrs[FILAS_ESTIMADAS] = max(0, filas - filas_cabecera)
+    return df
+
+
+def _nombres_columnas(cabecera):
+    # Igual que pandas: las celdas de cabecera vacías se nombran "Unnamed: <n>".
+    return [str(valor) if valor is not None else f"Unnamed: {i}" for i, valor in enumerate(cabecera)]
+
+
+def _filas_xlsx(ruta, dimensiones):
+    # Modo read_only: openpyxl recorre el XML de la hoja en streaming, sin cargar
+    # el libro completo en memoria. El número de filas sale de la dimensión declarada.
+    libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        dimensiones["filas"] = hoja.max_row
+        for fila in hoja.iter_rows(values_only=True):
+            yield fila
+    finally:
+        libro.close() # En read_only el fichero queda abierto hasta cerrar el libro
+
+
+def _valor_celda_xls(celda, datemode):
+    if celda.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    if celda.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate_as_datetime(celda.value, datemode)
+    if celda.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(celda.value)
+    if celda.ctype == xlrd.XL_CELL_ERROR:
+        return None
+    if celda.ctype == xlrd.XL_CELL_NUMBER and celda.value == int(celda.value):
+        return int(celda.value) # Mismo criterio que pandas con xlrd
+    return celda.value
+
+
+def _filas_xls(ruta, dimensiones):
+    # xlrd no puede leer .xls en streaming, pero con on_demand solo carga la primera
+    # hoja y aquí las filas se convierten de una en una, sin construir el DataFrame entero.
+    libro = xlrd.open_workbook(ruta, on_demand=True)
+    try:
+        hoja = libro.sheet_by_index(0)
+        dimensiones["filas"] = hoja.nrows
+        for indice in range(hoja.nrows):
+            yield tuple(_valor_celda_xls(celda, libro.datemode) for celda in hoja.row(indice))
+    finally:
+        libro.release_resources()
+
+
+LECTORES_FILAS = {
+    ".xlsx": _filas_xlsx,
+    ".xls": _filas_xls,
+}
+
+
+def leer_excel_por_bloques(ruta, tamano_bloque=TAMANO_BLOQUE_POR_DEFECTO):
+    # Lee la primera hoja de `ruta` y la entrega en DataFrames de hasta `tamano_bloque`
+    # filas. El índice de cada bloque es la posición de la fila de datos (como con
+    # pd.read_excel), así que `indice + 2` sigue siendo la línea en el Excel.
+    # Siempre se entrega al menos un bloque (posiblemente vacío) con las columnas de la
+    # cabecera, para poder validarla antes de procesar ninguna fila.
+    lector = LECTORES_FILAS.get(ruta.suffix.lower())
+    if lector is None:
+        raise ValueError(f"Extensión de archivo no soportada: {ruta.suffix}")
+
+    dimensiones = {}
+    filas = lector(ruta, dimensiones)
+    try:
+        cabecera = next(filas, None)
+        columnas = _nombres_columnas(cabecera or ())
+        ancho = len(columnas)
+
+        bloque = []
+        vacias_pendientes = 0 # Filas vacías que solo se emiten si después hay datos
+        inicio = 0
+        entregado = False
+        for fila in filas:
+            fila = tuple(fila[:ancho]) + (None,) * (ancho - len(fila))
+            if all(valor is None for valor in fila):
+                vacias_pendientes += 1
+                continue
+            bloque.extend([(None,) * ancho] * vacias_pendientes)
+            vacias_pendientes = 0
+            bloque.append(fila)
+            if len(bloque) >= tamano_bloque:
+                df = pd.DataFrame(bloque, columns=columnas, index=range(inicio, inicio + len(bloque)), dtype=object)
+                if not entregado:
+                    _anunciar_filas(df, dimensiones.get("filas"), 1)
+                yield df
+                entregado = True
+                inicio += len(bloque)
+                bloque = []
+
+        # Como pandas, las filas completamente vacías al final de la hoja se descartan.
+        if bloque or not entregado:
+            df = pd.DataFrame(bloque, columns=columnas, index=range(inicio, inicio + len(bloque)), dtype=object)
+            if not entregado:
+                _anunciar_filas(df, dimensiones.get("filas"), 1)
+            yield df
+    finally:
+        filas.close() # Cierra el libro aunque el consumidor abandone a mitad
+
+
+def _importar_pyarrow(uso):
+    # pyarrow es una dependencia opcional: solo la necesitan Parquet/Arrow y la caché.
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError(f"{uso} requiere el paquete pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def _proyeccion(nombres):
+    # Solo se leen las columnas esperadas, en el orden del archivo. Si falta alguna, la
+    # comprobación de cabecera lo detecta igual que con un Excel.
+    return [nombre for nombre in nombres if nombre in EXPECTED_COLUMNS]
+
+
+def _bloque_arrow(lote, inicio):
+    df = lote.to_pandas()
+    df.index = range(inicio, inicio + len(df))
+    return df
+
+
+def leer_csv_por_bloques(ruta, tamano_bloque=TAMANO_BLOQUE_POR_DEFECTO):
+    # CSV con cabecera, leído por bloques y solo con las columnas esperadas. Los valores
+    # se leen como texto (un "010" no pierde el cero) y solo una celda vacía cuenta como
+    # nula. Las líneas en blanco se saltan, así que `indice + 2` es la línea del archivo
+    # siempre que no las haya.
+    cabecera = pd.read_csv(ruta, nrows=0, encoding="utf-8-sig").columns
+    columnas = _proyeccion(cabecera)
+    # Sin ninguna columna esperada se lee la primera, para que el archivo se descarte
+    # con sus filas contadas como con un Excel (con usecols=[] pandas no entrega filas).
+    usecols = columnas or list(cabecera[:1])
+    bloques = pd.read_csv(ruta, usecols=usecols, dtype=str, keep_default_na=False, na_values=[""],
+                          encoding="utf-8-sig", chunksize=tamano_bloque)
+    with bloques:
+        entregado = False
+        for bloque in bloques:
+            yield bloque
+            entregado = True
+        if not entregado:
+            yield pd.DataFrame(columns=columnas)
+
+
+def leer_parquet_por_bloques(ruta, tamano_bloque=TAMANO_BLOQUE_POR_DEFECTO):
+    # Parquet leído por lotes de `tamano_bloque` filas, descomprimiendo solo las
+    # columnas esperadas.
+    pa = _importar_pyarrow("La lectura de archivos .parquet")
+    archivo = pa.parquet.ParquetFile(ruta)
+    try:
+        columnas = _proyeccion(archivo.schema_arrow.names)
+        total = archivo.metadata.num_rows
+        inicio = 0
+        for lote in archivo.iter_batches(batch_size=tamano_bloque, columns=columnas):
+            df = _bloque_arrow(lote, inicio)
+            yield _anunciar_filas(df, total) if not inicio else df
+            inicio += lote.num_rows
+        if not inicio:
+            yield pd.DataFrame(columns=columnas)
+    finally:
+        archivo.close()
+
+
+def leer_arrow_por_bloques(ruta, tamano_bloque=TAMANO_BLOQUE_POR_DEFECTO):
+    # Arrow IPC (.arrow / Feather v2) mapeado en memoria: los lotes se recortan a las
+    # columnas esperadas y a `tamano_bloque` filas sin copiar el archivo.
+    pa = _importar_pyarrow("La lectura de archivos Arrow")
+    with pa.memory_map(str(ruta)) as fuente:
+        lector = pa.ipc.open_file(fuente)
+        columnas = _proyeccion(lector.schema.names)
+        total = sum(lector.get_batch(i).num_rows for i in range(lector.num_record_batches))
+        inicio = 0
+        for i in range(lector.num_record_batches):
+            lote = lector.get_batch(i).select(columnas)
+            for desde in range(0, lote.num_rows, tamano_bloque):
+                trozo = lote.slice(desde, tamano_bloque)
+                df = _bloque_arrow(trozo, inicio)
+                yield _anunciar_filas(df, total) if not inicio else df
+                inicio += trozo.num_rows
+        if not inicio:
+            yield pd.DataFrame(columns=columnas)
+
+
+# Lector por extensión (en minúsculas). Todos entregan DataFrames con el mismo contrato
+# que leer_excel_por_bloques, así que la validación y el log no distinguen el formato.
+LECTORES = {}
+
+
+def registrar_lector(extension, lector):
+    # `lector(ruta, tamano_bloque=...)` debe devolver un iterable de DataFrames.
+    LECTORES[extension.lower()] = lector
+
+
+registrar_lector(".xlsx", leer_excel_por_bloques)
+registrar_lector(".xls", leer_excel_por_bloques)
+registrar_lector(".csv", leer_csv_por_bloques)
+registrar_lector(".parquet", leer_parquet_por_bloques)
+registrar_lector(".arrow", leer_arrow_por_bloques)
+registrar_lector(".feather", leer_arrow_por_bloques)
+
+
+def _tabla_cache(pa, bloque):
+    # Las columnas esperadas como texto, ya normalizadas como lo haría la validación
+    # (que sobre estos valores vuelve a dar el mismo resultado), con los nulos intactos.
+    columnas = {}
+    for columna in COLUMNAS_EVENTO:
+        serie = bloque[columna]
+        nulos = serie.isnull().tolist()
+        texto = normalizar_fechas(serie) if columna == "FECHA_EVENTO" else serie.astype(str)
+        columnas[columna] = pa.array([None if nulo else valor for valor, nulo in zip(texto.tolist(), nulos)],
+                                     type=pa.string())
+    return pa.table(columnas)
+
+
+def _leer_excel_guardando_cache(pa, ruta, tamano_bloque, destino):
+    # Entrega los bloques del Excel mientras los escribe en un Parquet temporal, que solo
+    # pasa a ser la caché si el archivo se lee entero. Los archivos con la cabecera
+    # incompleta no se guardan.
+    bloques = leer_excel_por_bloques(ruta, tamano_bloque=tamano_bloque)
+    escritor = None
+    completo = False
+    try:
+        primer_bloque = next(bloques)
+        if not columnas_faltantes(primer_bloque.columns):
+            descriptor, temporal = tempfile.mkstemp(dir=destino.parent, prefix=destino.name, suffix=".tmp")
+            os.close(descriptor)
+            esquema = pa.schema([(columna, pa.string()) for columna in COLUMNAS_EVENTO])
+            escritor = pa.parquet.ParquetWriter(temporal, esquema, compression="zstd")
+        for bloque in itertools.chain([primer_bloque], bloques):
+            if escritor is not None:
+                escritor.write_table(_tabla_cache(pa, bloque))
+            yield bloque
+        completo = True
+    finally:
+        bloques.close()
+        if escritor is not None:
+            escritor.close()
+            if completo:
+                os.replace(temporal, destino)
+            else:
+                os.unlink(temporal)
+
+
+def _con_hash(bloques, hash_contenido):
+    try:
+        for bloque in bloques:
+            bloque.attrs[HASH_CONTENIDO] = hash_contenido
+            yield bloque
+    finally:
+        bloques.close()
+
+
+def leer_por_bloques(ruta, tamano_bloque=TAMANO_BLOQUE_POR_DEFECTO, directorio_cache=None):
+    # Elige el lector por la extensión de `ruta`. Con `directorio_cache`, cada Excel se
+    # guarda la primera vez como Parquet (con nombre el hash de su contenido) y las
+    # siguientes se lee de ahí, sin volver a parsear el Excel.
+    lector = LECTORES.get(ruta.suffix.lower())
+    if lector is None:
+        raise ValueError(f"Extensión de archivo no soportada: {ruta.suffix}")
+    if directorio_cache is None or ruta.suffix.lower() not in LECTORES_FILAS:
+        return lector(ruta, tamano_bloque=tamano_bloque)
+
+    pa = _importar_pyarrow("La caché Parquet de los Excel")
+    directorio_cache = pathlib.Path(directorio_cache)
+    directorio_cache.mkdir(parents=True, exist_ok=True)
+    hash_contenido = hash_archivo(ruta)
+    destino = directorio_cache / f"{hash_contenido}.v{VERSION_CACHE}.parquet"
+    if destino.exists():
+        return _con_hash(leer_parquet_por_bloques(destino, tamano_bloque=tamano_bloque), hash_contenido)
+    return _con_hash(_leer_excel_guardando_cache(pa, ruta, tamano_bloque, destino), hash_contenido)
@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+from soap_batch.despacho import BARRERA
+from soap_batch.ingesta import FilaPreparada
+from soap_batch.politica_envio import ResultadoEnvio
+from soap_batch.respuestas import analizar_fallos, detalle_fallo
+from soap_batch.sobre_soap import PREFIJO_SOBRE, SEPARADOR_EVENTOS, SUFIJO_SOBRE, construir_sobre_multievento
+
+MAX_BYTES_SOLICITUD_POR_DEFECTO = 1 << 20 # 1 MiB por sobre multievento
+# Eventos no enviables que puede retener un lote abierto por cada fila que admite. Su
+# presupuesto de memoria ya se liberó al salir del pipeline, así que pasado ese número
+# el lote se envía incompleto en lugar de seguir acumulándolos.
+NO_ENVIABLES_POR_FILA = 4
+
+# Resultado de una fila cuyo evento rechazó el endpoint dentro de un sobre multievento.
+# Sustituye a la respuesta HTTP de esa fila: `status_code` es el del sobre completo.
+FalloEvento = namedtuple("FalloEvento", ["status_code", "detalle"])
+
+
+def es_enviable(evento):
+    return isinstance(evento, FilaPreparada) and evento.cuerpo_soap is not None
+
+
+class LoteEventos:
+    # Varias filas que se envían en un único sobre, junto con los eventos no enviables
+    # (filas omitidas, inicios de archivo...) que llegaron entre ellas, para poder
+    # devolverlos después en el orden original.
+
+    def __init__(self, eventos):
+        self.eventos = eventos
+        self.filas = [evento for evento in eventos if es_enviable(evento)]
+        self.cuerpo_soap = construir_sobre_multievento(fila.cuerpo_soap for fila in self.filas)
+
+    def resultados_por_fila(self, resultado_envio):
+        # Reparte el resultado del sobre entre sus filas, en el orden de self.filas.
+        response, reintentos = resultado_envio
+        if response is None:
+            return [ResultadoEnvio(None, reintentos)] * len(self.filas)
+
+        exito = 200 <= response.status_code < 300
+        fallo_general, fallos_por_evento = analizar_fallos(response.content)
+        resultados = []
+        for indice in range(1, len(self.filas) + 1):
+            fallo = fallos_por_evento.get(indice)
+            if fallo is None and exito and fallo_general is not None and not fallos_por_evento:
+                fallo = fallo_general # Fault sin detalle por evento en una respuesta 2xx: afecta a todas
+            if fallo is not None:
+                resultados.append(ResultadoEnvio(FalloEvento(response.status_code, detalle_fallo(fallo)), reintentos))
+            else:
+                # Sin fallo propio la fila corre la suerte del sobre: OK si fue 2xx y
+                # ERROR_HTTP con el cuerpo de la respuesta si no.
+                resultados.append(ResultadoEnvio(response, reintentos))
+        return resultados
+
+
+def agrupar_en_lotes(eventos, eventos_por_solicitud, max_bytes=MAX_BYTES_SOLICITUD_POR_DEFECTO):
+    # Agrupa las filas enviables consecutivas en LoteEventos de hasta
+    # `eventos_por_solicitud` filas, sin que el sobre supere `max_bytes` (una fila que por
+    # sí sola lo supere viaja sola). Los eventos no enviables fuera de un lote pasan tal cual.
+    # Una BARRERA cierra el lote abierto para que se envíe antes de esperar.
+    pendientes = []
+    filas = 0
+    tamano = 0
+    max_no_enviables = NO_ENVIABLES_POR_FILA * eventos_por_solicitud
+    for evento in eventos:
+        if evento is BARRERA:
+            if filas:
+                yield LoteEventos(pendientes)
+                pendientes, filas = [], 0
+            yield evento
+            continue
+
+        if not es_enviable(evento):
+            if filas:
+                pendientes.append(evento)
+                if len(pendientes) - filas >= max_no_enviables:
+                    yield LoteEventos(pendientes)
+                    pendientes, filas = [], 0
+            else:
+                yield evento
+            continue
+
+        tamano_evento = len(evento.cuerpo_soap) - len(PREFIJO_SOBRE) - len(SUFIJO_SOBRE)
+        if filas and tamano + len(SEPARADOR_EVENTOS) + tamano_evento > max_bytes:
+            yield LoteEventos(pendientes)
+            pendientes, filas = [], 0
+
+        if not filas:
+            tamano = len(PREFIJO_SOBRE) + len(SUFIJO_SOBRE) + tamano_evento
+        else:
+            tamano += len(SEPARADOR_EVENTOS) + tamano_evento
+        pendientes.append(evento)
+        filas += 1
+
+        if filas >= eventos_por_solicitud:
+            yield LoteEventos(pendientes)
+            pendientes, filas = [], 0
+
+    if filas:
+        yield LoteEventos(pendientes)
+
+
+def desagrupar_resultados(resultados):
+    # Inversa de agrupar_en_lotes sobre la salida de despachar_en_orden: devuelve
+    # (evento, resultado, excepcion) por evento original, con el resultado de cada fila.
+    for elemento, resultado, error in resultados:
+        if not isinstance(elemento, LoteEventos):
+            yield elemento, resultado, error
+            continue
+        por_fila = iter(elemento.resultados_por_fila(resultado) if error is None else ())
+        for evento in elemento.eventos:
+            if not es_enviable(evento):
+                yield evento, None, None
+            elif error is not None:
+                yield evento, None, error
+            else:
+                yield evento, next(por_fila), None
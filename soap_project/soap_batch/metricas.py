@@ -0,0 +1,211 @@
+import array
+import bisect
+import json
+import math
+import os
+import pathlib
+import threading
+import time
+from collections import namedtuple
+
+# Etapas instrumentadas, en el orden del pipeline. "escritura_log" es el volcado a disco
+# que hace el hilo escritor del RegistroSOAP; "log" es lo que cuesta encolar cada fila.
+ETAPAS = ("ingesta", "validacion", "deduplicacion", "sobre", "envio", "log", "escritura_log")
+
+# Límites (en segundos) del histograma de latencia HTTP; los mismos que usa por
+# defecto el cliente de Prometheus.
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PERCENTILES = (50, 95, 99)
+INTERVALO_SERIE_POR_DEFECTO = 1.0 # Segundos por punto de la serie de filas/s
+
+# Evento de ingesta con los tiempos de un archivo; solo se produce si se piden métricas.
+TiemposArchivo = namedtuple("TiemposArchivo", ["nombre_archivo", "tiempos"])
+
+
+class TiemposEtapas:
+    # Acumula llamadas y segundos por etapa. Es serializable con pickle para que los
+    # procesos de ingesta en paralelo devuelvan sus tiempos junto con las filas.
+
+    def __init__(self):
+        self.etapas = {}
+
+    def sumar(self, etapa, segundos, llamadas=1):
+        acumulado = self.etapas.get(etapa)
+        if acumulado is None:
+            self.etapas[etapa] = [llamadas, segundos]
+        else:
+            acumulado[0] += llamadas
+            acumulado[1] += segundos
+
+    def fusionar(self, otros):
+        for etapa, (llamadas, segundos) in otros.etapas.items():
+            self.sumar(etapa, segundos, llamadas)
+
+    def como_dict(self):
+        orden = [etapa for etapa in ETAPAS if etapa in self.etapas]
+        orden += sorted(etapa for etapa in self.etapas if etapa not in ETAPAS)
+        return {
+            etapa: {"llamadas": self.etapas[etapa][0], "segundos": round(self.etapas[etapa][1], 6)}
+            for etapa in orden
+        }
+
+
+def percentil(valores_ordenados, p):
+    # Percentil por rango más cercano sobre una secuencia ya ordenada.
+    if not valores_ordenados:
+        return None
+    rango = max(1, math.ceil(p / 100 * len(valores_ordenados)))
+    return valores_ordenados[rango - 1]
+
+
+class Metricas:
+    # Métricas de una ejecución: tiempos por etapa, latencia de cada intento HTTP,
+    # códigos de respuesta, bytes enviados y filas completadas a lo largo del tiempo.
+    # Es segura entre hilos (los envíos se registran desde el pool del despachador).
+    #
+    # Cuando no se piden métricas, main no crea ninguna instancia y el camino de envío
+    # y de log es exactamente el de siempre; no hay un objeto "nulo" con llamadas vacías.
+
+    def __init__(self, intervalo_serie=INTERVALO_SERIE_POR_DEFECTO, reloj=time.perf_counter):
+        self.intervalo_serie = intervalo_serie
+        self.etapas = TiemposEtapas()
+        self.latencias = array.array("d") # 8 bytes por intento: ~8 MB por millón de solicitudes
+        self.codigos_http = {}
+        self.bytes_enviados = 0
+        self.filas_completadas = 0
+        self._filas_por_intervalo = []
+        self._reloj = reloj
+        self._inicio = reloj()
+        self._fin = None
+        self._bloqueo = threading.Lock()
+
+    def registrar_etapa(self, etapa, segundos):
+        with self._bloqueo:
+            self.etapas.sumar(etapa, segundos)
+
+    def fusionar_etapas(self, tiempos):
+        with self._bloqueo:
+            self.etapas.fusionar(tiempos)
+
+    def medir(self, funcion, etapa):
+        # Envuelve `funcion` para sumar a `etapa` el tiempo de cada llamada.
+        def medida(*args, **kwargs):
+            inicio = self._reloj()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                self.registrar_etapa(etapa, self._reloj() - inicio)
+        return medida
+
+    def registrar_envio(self, segundos, bytes_enviados, response):
+        # Un intento HTTP (los reintentos cuentan como intentos distintos).
+        codigo = "ERROR_CONEXION" if response is None else str(response.status_code)
+        with self._bloqueo:
+            self.etapas.sumar("envio", segundos)
+            self.latencias.append(segundos)
+            self.bytes_enviados += bytes_enviados
+            self.codigos_http[codigo] = self.codigos_http.get(codigo, 0) + 1
+
+    def fila_completada(self):
+        with self._bloqueo:
+            intervalo = int((self._reloj() - self._inicio) / self.intervalo_serie)
+            if intervalo >= len(self._filas_por_intervalo):
+                self._filas_por_intervalo.extend([0] * (intervalo + 1 - len(self._filas_por_intervalo)))
+            self._filas_por_intervalo[intervalo] += 1
+            self.filas_completadas += 1
+
+    def finalizar(self):
+        if self._fin is None:
+            self._fin = self._reloj()
+
+    def duracion(self):
+        return (self._fin if self._fin is not None else self._reloj()) - self._inicio
+
+    def resumen(self):
+        with self._bloqueo:
+            ordenadas = sorted(self.latencias)
+            duracion = self.duracion()
+            latencia = {"solicitudes": len(ordenadas)}
+            if ordenadas:
+                for p in PERCENTILES:
+                    latencia[f"p{p}"] = round(percentil(ordenadas, p) * 1000, 3)
+                latencia["media"] = round(sum(ordenadas) / len(ordenadas) * 1000, 3)
+                latencia["max"] = round(ordenadas[-1] * 1000, 3)
+            return {
+                "duracion_s": round(duracion, 6),
+                "filas_completadas": self.filas_completadas,
+                "filas_por_segundo": round(self.filas_completadas / duracion, 3) if duracion > 0 else None,
+                "bytes_enviados": self.bytes_enviados,
+                "codigos_http": dict(sorted(self.codigos_http.items())),
+                "latencia_http_ms": latencia,
+                "histograma_latencia_http": [
+                    {"le": limite, "solicitudes": bisect.bisect_right(ordenadas, limite)}
+                    for limite in BUCKETS_LATENCIA
+                ],
+                "etapas": self.etapas.como_dict(),
+                "serie_filas_por_segundo": [
+                    {"segundo": round(i * self.intervalo_serie, 3), "filas_por_segundo": filas / self.intervalo_serie}
+                    for i, filas in enumerate(self._filas_por_intervalo)
+                ],
+            }
+
+    def texto_prometheus(self):
+        # Formato de exposición de texto de Prometheus (para el textfile collector).
+        resumen = self.resumen()
+        lineas = [
+            "# HELP soap_batch_etapa_segundos_total Segundos acumulados en cada etapa del pipeline.",
+            "# TYPE soap_batch_etapa_segundos_total counter",
+        ]
+        lineas += [f'soap_batch_etapa_segundos_total{{etapa="{etapa}"}} {datos["segundos"]}'
+                   for etapa, datos in resumen["etapas"].items()]
+        lineas += [
+            "# HELP soap_batch_etapa_llamadas_total Llamadas medidas en cada etapa del pipeline.",
+            "# TYPE soap_batch_etapa_llamadas_total counter",
+        ]
+        lineas += [f'soap_batch_etapa_llamadas_total{{etapa="{etapa}"}} {datos["llamadas"]}'
+                   for etapa, datos in resumen["etapas"].items()]
+        lineas += [
+            "# HELP soap_batch_latencia_http_segundos Latencia de cada intento HTTP.",
+            "# TYPE soap_batch_latencia_http_segundos histogram",
+        ]
+        lineas += [f'soap_batch_latencia_http_segundos_bucket{{le="{bucket["le"]}"}} {bucket["solicitudes"]}'
+                   for bucket in resumen["histograma_latencia_http"]]
+        with self._bloqueo:
+            suma_latencias = sum(self.latencias)
+        total = resumen["latencia_http_ms"]["solicitudes"]
+        lineas += [
+            f'soap_batch_latencia_http_segundos_bucket{{le="+Inf"}} {total}',
+            f"soap_batch_latencia_http_segundos_sum {round(suma_latencias, 6)}",
+            f"soap_batch_latencia_http_segundos_count {total}",
+            "# HELP soap_batch_solicitudes_http_total Intentos HTTP por código de respuesta.",
+            "# TYPE soap_batch_solicitudes_http_total counter",
+        ]
+        lineas += [f'soap_batch_solicitudes_http_total{{codigo="{codigo}"}} {cantidad}'
+                   for codigo, cantidad in resumen["codigos_http"].items()]
+        lineas += [
+            "# HELP soap_batch_bytes_enviados_total Bytes de cuerpos SOAP enviados (incluidos reintentos).",
+            "# TYPE soap_batch_bytes_enviados_total counter",
+            f"soap_batch_bytes_enviados_total {resumen['bytes_enviados']}",
+            "# HELP soap_batch_filas_completadas_total Filas con resultado de envío definitivo.",
+            "# TYPE soap_batch_filas_completadas_total counter",
+            f"soap_batch_filas_completadas_total {resumen['filas_completadas']}",
+            "# HELP soap_batch_duracion_segundos Duración de la ejecución.",
+            "# TYPE soap_batch_duracion_segundos gauge",
+            f"soap_batch_duracion_segundos {resumen['duracion_s']}",
+        ]
+        return "\n".join(lineas) + "\n"
+
+    def guardar_json(self, ruta):
+        _escribir_atomico(ruta, json.dumps(self.resumen(), indent=2, ensure_ascii=False) + "\n")
+
+    def guardar_prometheus(self, ruta):
+        _escribir_atomico(ruta, self.texto_prometheus())
+
+
+def _escribir_atomico(ruta, texto):
+    # Se escribe en un temporal y se renombra, para que un lector (p. ej. node_exporter)
+    # nunca vea un fichero a medio escribir.
+    ruta = pathlib.Path(ruta)
+    temporal = ruta.with_name(ruta.name + ".tmp")
+    temporal.write_text(texto, encoding="utf-8")
+    os.replace(temporal, ruta)
@@ -0,0 +1,269 @@
+import collections
+import queue
+import threading
+
+from soap_batch.deduplicacion import MOTIVO_REPETIDO, Deduplicador
+from soap_batch.despacho import BARRERA, despachar_en_orden
+from soap_batch.ingesta import BloqueLeido, ingerir_en_paralelo, leer_archivos, preparar_bloques
+from soap_batch.lectores import TAMANO_BLOQUE_POR_DEFECTO
+from soap_batch.lotes import (
+    MAX_BYTES_SOLICITUD_POR_DEFECTO,
+    LoteEventos,
+    agrupar_en_lotes,
+    desagrupar_resultados,
+    es_enviable,
+)
+
+# Pipeline por etapas, usable también como biblioteca (main() es solo uno de sus usos):
+#
+#   lectura ──cola──▶ validación + sobres ──cola──▶ envío (ventana en orden) ──▶ log
+#   (hilo)            (hilo)                        (pool de hilos)             (consumidor + RegistroSOAP)
+#
+# Cada etapa corre en su propio hilo y se comunica con la siguiente por una cola de
+# como mucho ELEMENTOS_EN_COLA_POR_DEFECTO elementos (bloques o lotes de filas). Si el
+# envío va por detrás, las colas se llenan y las etapas anteriores se bloquean, de modo
+# que la memoria no depende del tamaño del directorio. Con un PresupuestoMemoria,
+# además, la lectura no empieza un bloque nuevo mientras los datos en vuelo (bloques
+# leídos y sobres construidos aún sin enviar) superen el presupuesto.
+#
+#   eventos = ingerir_por_etapas(rutas, presupuesto=PresupuestoMemoria(256 << 20))
+#   for evento, resultado, error in enviar_eventos(eventos, enviar, concurrencia=8):
+#       ...  # registrar el resultado de cada fila, en el orden original
+
+ELEMENTOS_EN_COLA_POR_DEFECTO = 4
+BYTES_POR_EVENTO = 256 # Estimación de lo que ocupa una FilaPreparada sin contar su sobre
+
+_FIN = object()
+_ESPERA_COLA = 0.1 # Segundos entre comprobaciones de cancelación en un put bloqueado
+
+
+class PresupuestoMemoria:
+    # Bytes de datos en vuelo en el pipeline. La etapa de lectura reserva lo que ocupa
+    # cada bloque leído y se bloquea mientras el total supere `limite_bytes`; la de
+    # preparación cambia esa reserva por lo que ocupan los sobres construidos, y el
+    # consumidor la libera cuando el emisor toma la última fila del lote. Si no hay nada
+    # reservado se admite cualquier bloque, aunque supere el límite, para que un bloque
+    # grande no detenga el pipeline para siempre.
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self.en_uso = 0
+        self.maximo = 0 # Pico de bytes en vuelo observado
+        self._cancelado = False
+        self._condicion = threading.Condition()
+
+    def reservar(self, n):
+        with self._condicion:
+            while self.en_uso and self.en_uso + n > self.limite_bytes and not self._cancelado:
+                self._condicion.wait()
+            self.en_uso += n
+            self.maximo = max(self.maximo, self.en_uso)
+
+    def ajustar(self, anterior, nuevo):
+        # Cambia una reserva por otra sin bloquear: la preparación nunca espera al
+        # presupuesto, así que no puede quedar bloqueada por los bloques que ella misma
+        # tiene delante.
+        with self._condicion:
+            self.en_uso += nuevo - anterior
+            self.maximo = max(self.maximo, self.en_uso)
+            self._condicion.notify_all()
+
+    def liberar(self, n):
+        self.ajustar(n, 0)
+
+    def cancelar(self):
+        # Despierta a la lectura si el consumidor abandona el pipeline.
+        with self._condicion:
+            self._cancelado = True
+            self._condicion.notify_all()
+
+    def reiniciar(self):
+        # Deja el presupuesto listo para otra ejecución (p. ej. otro ciclo de --watch).
+        with self._condicion:
+            self.en_uso = 0
+            self._cancelado = False
+
+
+def memoria_bloque(bloque):
+    return int(bloque.memory_usage(index=True, deep=True).sum())
+
+
+def memoria_eventos(eventos):
+    return sum(len(getattr(evento, "cuerpo_soap", None) or b"") for evento in eventos) + BYTES_POR_EVENTO * len(eventos)
+
+
+def en_hilo(elementos, capacidad=ELEMENTOS_EN_COLA_POR_DEFECTO, nombre="soap-etapa"):
+    # Recorre `elementos` en un hilo propio y los entrega a través de una cola de como
+    # mucho `capacidad` elementos. Si el consumidor va por detrás, el hilo se bloquea en
+    # la cola y deja de pedir elementos a la etapa anterior. Las excepciones de la etapa
+    # se relanzan en el consumidor; si este abandona, el hilo termina en su siguiente put.
+    cola = queue.Queue(maxsize=capacidad)
+    parar = threading.Event()
+
+    def poner(elemento):
+        while not parar.is_set():
+            try:
+                cola.put(elemento, timeout=_ESPERA_COLA)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producir():
+        try:
+            for elemento in elementos:
+                if not poner((elemento, None)):
+                    return
+            poner((_FIN, None))
+        except BaseException as e:
+            poner((_FIN, e))
+        finally:
+            cerrar = getattr(elementos, "close", None)
+            if cerrar is not None:
+                cerrar()
+
+    hilo = threading.Thread(target=producir, name=nombre, daemon=True)
+    hilo.start()
+    try:
+        while True:
+            elemento, error = cola.get()
+            if elemento is _FIN:
+                if error is not None:
+                    raise error
+                return
+            yield elemento
+    finally:
+        parar.set()
+        hilo.join()
+
+
+def _leer_reservando(elementos, presupuesto):
+    # Etapa de lectura: cada elemento viaja con los bytes que tiene reservados.
+    for elemento in elementos:
+        reservado = 0
+        if presupuesto is not None and isinstance(elemento, BloqueLeido):
+            reservado = memoria_bloque(elemento.bloque)
+            presupuesto.reservar(reservado)
+        yield elemento, reservado
+
+
+def _preparar_por_bloques(entrada, deduplicador, presupuesto):
+    # Etapa de validación y construcción de sobres: un lote de eventos por bloque leído,
+    # para no pagar un put en la cola por fila.
+    descartados = set()
+    for elemento, reservado in entrada:
+        if not isinstance(elemento, BloqueLeido):
+            yield [elemento], reservado
+            continue
+        eventos = list(preparar_bloques([elemento], deduplicador, descartados))
+        del elemento # El DataFrame del bloque ya no hace falta
+        if presupuesto is not None:
+            nuevo = memoria_eventos(eventos)
+            presupuesto.ajustar(reservado, nuevo)
+            reservado = nuevo
+        yield eventos, reservado
+
+
+def _reservar_lotes(eventos, tamano_lote, presupuesto):
+    # Con --parse-workers la lectura y la preparación ocurren en otros procesos: aquí se
+    # agrupan sus eventos en lotes y se reserva lo que ocupan.
+    lote = []
+    for evento in eventos:
+        lote.append(evento)
+        if len(lote) >= tamano_lote:
+            yield lote, _reservar(lote, presupuesto)
+            lote = []
+    if lote:
+        yield lote, _reservar(lote, presupuesto)
+
+
+def _reservar(lote, presupuesto):
+    if presupuesto is None:
+        return 0
+    reservado = memoria_eventos(lote)
+    presupuesto.reservar(reservado)
+    return reservado
+
+
+def ingerir_por_etapas(rutas, trabajadores=1, presupuesto=None, capacidad=ELEMENTOS_EN_COLA_POR_DEFECTO,
+                       indice_deduplicacion=None, **opciones):
+    # Mismos eventos y en el mismo orden que ingerir_en_serie (o que ingerir_en_paralelo
+    # con `trabajadores` > 1), pero con la lectura y la preparación en hilos propios
+    # unidos por colas acotadas y, opcionalmente, limitadas por `presupuesto`. Los bytes
+    # reservados de cada lote se liberan cuando el consumidor pide el siguiente.
+    if trabajadores > 1:
+        tamano_lote = opciones.get("tamano_bloque", TAMANO_BLOQUE_POR_DEFECTO)
+        eventos = ingerir_en_paralelo(rutas, trabajadores, indice_deduplicacion=indice_deduplicacion, **opciones)
+        etapas = [en_hilo(_reservar_lotes(eventos, tamano_lote, presupuesto), capacidad, "soap-ingesta")]
+    else:
+        deduplicador = Deduplicador(indice_deduplicacion) if indice_deduplicacion is not None else None
+        lectura = en_hilo(_leer_reservando(leer_archivos(rutas, **opciones), presupuesto), capacidad, "soap-lectura")
+        preparacion = en_hilo(_preparar_por_bloques(lectura, deduplicador, presupuesto), capacidad,
+                              "soap-preparacion")
+        etapas = [lectura, preparacion]
+    try:
+        for lote, reservado in etapas[-1]:
+            yield from lote
+            if reservado:
+                presupuesto.liberar(reservado)
+    finally:
+        # Despertar primero a la lectura si espera al presupuesto; después cerrar las
+        # etapas de la última a la primera, esperando a que terminen sus hilos.
+        if presupuesto is not None:
+            presupuesto.cancelar()
+        for etapa in reversed(etapas):
+            etapa.close()
+        if presupuesto is not None:
+            presupuesto.reiniciar()
+
+
+def _descartar_repetidos(eventos, indice_deduplicacion, en_vuelo):
+    # Repetidos dentro de la ejecución: una copia solo cuenta como enviada cuando el
+    # consumidor la confirma y la añade al índice. Si otra copia del mismo evento sigue
+    # en vuelo, se intercala una BARRERA para que su resultado se registre antes de
+    # decidir; después, la copia se descarta si el evento ya está confirmado y, si no
+    # (la anterior falló), se envía con su propio sobre por el camino normal.
+    for evento in eventos:
+        if es_enviable(evento) and evento.clave is not None:
+            if en_vuelo[evento.clave]:
+                yield BARRERA
+            if evento.clave in indice_deduplicacion:
+                evento = evento._replace(cuerpo_soap=None, resultado="DUPLICADO", detalle=MOTIVO_REPETIDO)
+            else:
+                en_vuelo[evento.clave] += 1
+        yield evento
+
+
+def _resolver_repetidos(resultados, en_vuelo):
+    # Lleva la cuenta de copias en vuelo por clave (solo claves, y solo las que están
+    # entre la etapa anterior y el consumidor) a medida que salen sus resultados.
+    for resultado in resultados:
+        evento = resultado[0]
+        if es_enviable(evento) and evento.clave is not None:
+            en_vuelo[evento.clave] -= 1
+            if not en_vuelo[evento.clave]:
+                del en_vuelo[evento.clave]
+        yield resultado
+
+
+def enviar_eventos(eventos, enviar, concurrencia=1, eventos_por_solicitud=1,
+                   max_bytes=MAX_BYTES_SOLICITUD_POR_DEFECTO, indice_deduplicacion=None):
+    # Etapa de envío: aplica `enviar` a cada fila enviable (o a cada LoteEventos con
+    # `eventos_por_solicitud` > 1) con hasta `concurrencia` solicitudes en vuelo y
+    # devuelve tuplas (evento, resultado, excepcion) fila a fila, en el orden de
+    # `eventos`, listas para registrarse. Con `indice_deduplicacion` descarta además
+    # los eventos repetidos cuya copia anterior ya se confirmó (el consumidor debe
+    # añadir al índice cada fila confirmada antes de pedir el siguiente resultado).
+    en_vuelo = collections.Counter()
+    if indice_deduplicacion is not None:
+        eventos = _descartar_repetidos(eventos, indice_deduplicacion, en_vuelo)
+    filtro = es_enviable
+    if eventos_por_solicitud > 1:
+        eventos = agrupar_en_lotes(eventos, eventos_por_solicitud, max_bytes)
+        filtro = lambda e: isinstance(e, LoteEventos)
+    resultados = despachar_en_orden(eventos, enviar, concurrencia=concurrencia, filtro=filtro)
+    if eventos_por_solicitud > 1:
+        resultados = desagrupar_resultados(resultados)
+    if indice_deduplicacion is not None:
+        resultados = _resolver_repetidos(resultados, en_vuelo)
+    return resultados
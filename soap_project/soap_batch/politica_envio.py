@@ -0,0 +1,135 @@
+import random
+import threading
+import time
+from collections import namedtuple
+
+CODIGOS_REINTENTABLES_POR_DEFECTO = frozenset({429, 502, 503, 504})
+ESPERA_BASE_POR_DEFECTO = 0.5 # Segundos antes del primer reintento (se duplica en cada intento)
+ESPERA_MAXIMA_POR_DEFECTO = 30.0
+
+# `reintentos` es el número de intentos adicionales tras el primero.
+ResultadoEnvio = namedtuple("ResultadoEnvio", ["response", "reintentos"])
+
+
+class LimitadorTasa:
+    # Token bucket: repone `tasa` tokens por segundo hasta `rafaga` como máximo; cada
+    # solicitud (incluidos los reintentos) consume uno. Es seguro entre hilos.
+
+    def __init__(self, tasa, rafaga=None, reloj=time.monotonic, dormir=time.sleep):
+        if tasa <= 0:
+            raise ValueError("La tasa debe ser mayor que 0")
+        self.tasa = tasa
+        self.rafaga = rafaga if rafaga is not None else max(1.0, tasa / 10) # ~100 ms de ráfaga
+        self._reloj = reloj
+        self._dormir = dormir
+        self._tokens = self.rafaga
+        self._ultimo = reloj()
+        self._bloqueo = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self._bloqueo:
+                ahora = self._reloj()
+                self._tokens = min(self.rafaga, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1 - 1e-9: # Tolerancia al redondeo al reponer
+                    self._tokens = max(0.0, self._tokens - 1)
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            self._dormir(espera)
+
+
+class ConcurrenciaAdaptativa:
+    # Límite de solicitudes simultáneas que se ajusta solo (AIMD): crece en uno por
+    # cada "ventana" de respuestas sanas y se reduce multiplicativamente ante una
+    # respuesta 5xx/429, un error de conexión o una latencia muy por encima de la
+    # habitual. Las reducciones se espacian para no reaccionar varias veces al mismo pico.
+
+    def __init__(self, maximo, minimo=1, factor_latencia=3.0, factor_reduccion=0.5, reloj=time.monotonic):
+        self.maximo = maximo
+        self.minimo = minimo
+        self.factor_latencia = factor_latencia
+        self.factor_reduccion = factor_reduccion
+        self.limite = float(maximo)
+        self.latencia_base = None # Media móvil exponencial de las latencias sanas
+        self._reloj = reloj
+        self._ultima_reduccion = float("-inf")
+        self._en_uso = 0
+        self._condicion = threading.Condition()
+
+    def adquirir(self):
+        with self._condicion:
+            while self._en_uso >= int(self.limite):
+                self._condicion.wait()
+            self._en_uso += 1
+
+    def liberar(self, latencia, sobrecarga):
+        with self._condicion:
+            self._en_uso -= 1
+            pico = self.latencia_base is not None and latencia > self.factor_latencia * self.latencia_base
+            if sobrecarga or pico:
+                ahora = self._reloj()
+                if ahora - self._ultima_reduccion >= (self.latencia_base or latencia):
+                    self.limite = max(float(self.minimo), self.limite * self.factor_reduccion)
+                    self._ultima_reduccion = ahora
+            else:
+                self.limite = min(float(self.maximo), self.limite + 1 / self.limite)
+                self.latencia_base = latencia if self.latencia_base is None else 0.9 * self.latencia_base + 0.1 * latencia
+            self._condicion.notify_all()
+
+
+class PoliticaEnvio:
+    # Envuelve cada envío con el limitador de tasa, la concurrencia adaptativa y los
+    # reintentos con backoff exponencial con jitter. Sin opciones no añade nada al
+    # envío original: un único intento, sin esperas.
+
+    def __init__(self, max_reintentos=0, codigos_reintentables=CODIGOS_REINTENTABLES_POR_DEFECTO,
+                 espera_base=ESPERA_BASE_POR_DEFECTO, espera_maxima=ESPERA_MAXIMA_POR_DEFECTO,
+                 limitador=None, concurrencia=None, dormir=time.sleep, aleatorio=random.random):
+        self.max_reintentos = max_reintentos
+        self.codigos_reintentables = frozenset(codigos_reintentables)
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+        self.limitador = limitador
+        self.concurrencia = concurrencia
+        self._dormir = dormir
+        self._aleatorio = aleatorio
+
+    def es_reintentable(self, response):
+        return response is None or response.status_code in self.codigos_reintentables
+
+    def espera(self, intento, response=None):
+        # Si el servidor indica Retry-After (en segundos) se respeta; si no, backoff
+        # exponencial con "equal jitter": entre la mitad y el total del tope del intento.
+        if response is not None:
+            retry_after = (getattr(response, "headers", None) or {}).get("Retry-After")
+            if retry_after is not None:
+                try:
+                    return min(self.espera_maxima, max(0.0, float(retry_after)))
+                except (TypeError, ValueError):
+                    pass # Formato fecha HTTP: se usa el backoff normal
+        tope = min(self.espera_maxima, self.espera_base * (2 ** intento))
+        return tope / 2 + self._aleatorio() * tope / 2
+
+    def ejecutar(self, funcion):
+        # `funcion` hace un intento de envío y devuelve la respuesta o None si hubo
+        # error de conexión (como enviar_solicitud_soap).
+        intento = 0
+        while True:
+            if self.limitador is not None:
+                self.limitador.adquirir()
+            if self.concurrencia is not None:
+                self.concurrencia.adquirir()
+            inicio = time.monotonic()
+            response = None
+            try:
+                response = funcion()
+            finally:
+                if self.concurrencia is not None:
+                    sobrecarga = response is None or response.status_code >= 500 or response.status_code == 429
+                    self.concurrencia.liberar(time.monotonic() - inicio, sobrecarga)
+
+            if intento >= self.max_reintentos or not self.es_reintentable(response):
+                return ResultadoEnvio(response, intento)
+            self._dormir(self.espera(intento, response))
+            intento += 1
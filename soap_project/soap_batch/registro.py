@@ -0,0 +1,182 @@
+import csv
+import datetime
+import pathlib
+import queue
+import threading
+import time
+
+CABECERA_LOG = ["nombre_archivo", "numero_linea", "http_status", "resultado", "detalle_error"]
+
+MAX_FILAS_BUFFER_POR_DEFECTO = 1000
+INTERVALO_FLUSH_POR_DEFECTO = 1.0 # Segundos máximos que una fila puede quedar sin escribir
+
+_FIN = object() # Centinela para detener el hilo escritor
+
+# Registros abiertos por ruta, para que log_soap_request pueda delegar en ellos.
+_REGISTROS_ABIERTOS = {}
+_BLOQUEO_REGISTROS = threading.Lock()
+
+
+def _clave(ruta):
+    return pathlib.Path(ruta).resolve()
+
+
+def registro_abierto(ruta):
+    with _BLOQUEO_REGISTROS:
+        return _REGISTROS_ABIERTOS.get(_clave(ruta))
+
+
+def rotar_log(ruta):
+    # Renombra un log existente y no vacío a <nombre>.<AAAAmmdd-HHMMSS><extensión> para
+    # que la nueva ejecución no lo trunque. Devuelve la ruta rotada o None si no había log.
+    ruta = pathlib.Path(ruta)
+    if not ruta.exists() or ruta.stat().st_size == 0:
+        return None
+    marca = datetime.datetime.fromtimestamp(ruta.stat().st_mtime).strftime("%Y%m%d-%H%M%S")
+    destino = ruta.with_name(f"{ruta.stem}.{marca}{ruta.suffix}")
+    sufijo = 1
+    while destino.exists():
+        destino = ruta.with_name(f"{ruta.stem}.{marca}-{sufijo}{ruta.suffix}")
+        sufijo += 1
+    ruta.rename(destino)
+    return destino
+
+
+class _EscritorCSV:
+    def __init__(self, ruta, truncar):
+        existia = ruta.exists() and ruta.stat().st_size > 0
+        self.f = open(ruta, 'w' if truncar else 'a', newline='', encoding='utf-8', buffering=1 << 16)
+        self.writer = csv.writer(self.f, quoting=csv.QUOTE_ALL)
+        if truncar or not existia:
+            self.writer.writerow(CABECERA_LOG)
+
+    def escribir(self, filas):
+        self.writer.writerows(filas)
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class _EscritorParquet:
+    # Formato columnar compacto para ejecuciones grandes. Cada flush se escribe como un
+    # row group del mismo fichero. Requiere pyarrow (dependencia opcional).
+    def __init__(self, ruta, truncar):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("El formato de log 'parquet' requiere el paquete pyarrow (pip install pyarrow)") from e
+        if not truncar:
+            raise ValueError("El log parquet no admite añadir a un fichero existente")
+        self.pa = pa
+        self.esquema = pa.schema([(nombre, pa.string()) for nombre in CABECERA_LOG])
+        self.writer = pq.ParquetWriter(ruta, self.esquema, compression="zstd")
+
+    def escribir(self, filas):
+        columnas = [[None if valor is None else str(valor) for valor in columna] for columna in zip(*filas)]
+        self.writer.write_table(self.pa.table(columnas, schema=self.esquema))
+
+    def close(self):
+        self.writer.close()
+
+
+ESCRITORES = {
+    "csv": _EscritorCSV,
+    "parquet": _EscritorParquet,
+}
+
+
+class RegistroSOAP:
+    # Log de resultados con el fichero abierto durante toda la ejecución. Las filas se
+    # encolan desde cualquier hilo con registrar() y un único hilo escritor las agrupa
+    # y las vuelca cuando se acumulan `max_filas_buffer` filas, cuando pasan
+    # `intervalo_flush` segundos desde el último volcado, y al cerrar. Con `metricas`
+    # se mide cada volcado como etapa "escritura_log".
+
+    def __init__(self, ruta, formato="csv", max_filas_buffer=MAX_FILAS_BUFFER_POR_DEFECTO,
+                 intervalo_flush=INTERVALO_FLUSH_POR_DEFECTO, truncar=True, metricas=None):
+        if formato not in ESCRITORES:
+            raise ValueError(f"Formato de log no soportado: {formato}")
+        self.ruta = pathlib.Path(ruta)
+        self.max_filas_buffer = max_filas_buffer
+        self.intervalo_flush = intervalo_flush
+        self.metricas = metricas
+        self._escritor = ESCRITORES[formato](self.ruta, truncar)
+        self._cola = queue.Queue(maxsize=max_filas_buffer * 4)
+        self._error = None
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._bucle_escritura, name="soap-log", daemon=True)
+        self._hilo.start()
+        with _BLOQUEO_REGISTROS:
+            _REGISTROS_ABIERTOS[_clave(self.ruta)] = self
+
+    def registrar(self, nombre_archivo, numero_linea, http_status, resultado, detalle_error):
+        if self._cerrado:
+            raise ValueError("El registro ya está cerrado")
+        self._cola.put((nombre_archivo, numero_linea, http_status, resultado, detalle_error))
+
+    def flush(self):
+        # Espera a que todo lo encolado hasta ahora esté escrito en disco.
+        evento = threading.Event()
+        self._cola.put(evento)
+        evento.wait()
+        self._comprobar_error()
+
+    def close(self):
+        if self._cerrado:
+            return
+        self._cerrado = True
+        with _BLOQUEO_REGISTROS:
+            if _REGISTROS_ABIERTOS.get(_clave(self.ruta)) is self:
+                del _REGISTROS_ABIERTOS[_clave(self.ruta)]
+        self._cola.put(_FIN)
+        self._hilo.join()
+        self._escritor.close()
+        self._comprobar_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _comprobar_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Error escribiendo el log {self.ruta}: {self._error}") from self._error
+
+    def _volcar(self, buffer):
+        if buffer and self._error is None:
+            inicio = time.perf_counter()
+            try:
+                self._escritor.escribir(buffer)
+            except Exception as e:
+                self._error = e # Se reporta en flush()/close() desde el hilo llamador
+            if self.metricas is not None:
+                self.metricas.registrar_etapa("escritura_log", time.perf_counter() - inicio)
+        buffer.clear()
+
+    def _bucle_escritura(self):
+        buffer = []
+        ultimo_volcado = time.monotonic()
+        while True:
+            espera = max(0.0, self.intervalo_flush - (time.monotonic() - ultimo_volcado))
+            try:
+                elemento = self._cola.get(timeout=espera)
+            except queue.Empty:
+                elemento = None
+
+            if elemento is _FIN:
+                self._volcar(buffer)
+                return
+            if isinstance(elemento, threading.Event):
+                self._volcar(buffer)
+                ultimo_volcado = time.monotonic()
+                elemento.set()
+                continue
+            if elemento is not None:
+                buffer.append(elemento)
+
+            if len(buffer) >= self.max_filas_buffer or time.monotonic() - ultimo_volcado >= self.intervalo_flush:
+                self._volcar(buffer)
+                ultimo_volcado = time.monotonic()
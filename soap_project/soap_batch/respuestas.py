@@ -0,0 +1,132 @@
+from collections import namedtuple
+
+import requests
+import urllib3
+from lxml import etree
+
+MAX_BYTES_FALLO_POR_DEFECTO = 16 * 1024 # Bytes leídos del cuerpo de una respuesta de error
+MAX_BYTES_CONTENIDO_POR_DEFECTO = 1 << 20 # Bytes conservados de las respuestas de un sobre multievento
+_TAMANO_LECTURA = 64 * 1024
+
+# Fallo SOAP extraído de una respuesta: `codigo` es el Code/Value (SOAP 1.2) o el
+# faultcode (SOAP 1.1) y `motivo` el Reason/Text o el faultstring.
+Fallo = namedtuple("Fallo", ["codigo", "motivo"])
+
+# Respuesta ya procesada, con la misma interfaz mínima que requests.Response que usan
+# el bucle principal, la política de envío y los lotes. `text` es "" en las respuestas
+# 2xx y, en las de error, el faultcode/Reason del SOAP Fault (o el principio del cuerpo
+# si no es un Fault). `content` solo se conserva si se pide (sobres multievento).
+RespuestaSOAP = namedtuple("RespuestaSOAP", ["status_code", "headers", "text", "content"])
+
+# Parser sin resolución de entidades ni acceso a red: las respuestas vienen de fuera.
+# Con recover se aprovecha lo que se pueda de un cuerpo recortado a su tamaño máximo.
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=False, recover=True)
+
+
+def _texto(elemento, *rutas):
+    for ruta in rutas:
+        encontrado = elemento.find(ruta)
+        if encontrado is not None and encontrado.text:
+            return encontrado.text.strip()
+    return ""
+
+
+def _buscar_fault(contenido):
+    if not contenido or b"Fault" not in contenido:
+        return None # Caso habitual: sin Fault no hace falta parsear el XML
+    try:
+        raiz = etree.fromstring(contenido, parser=_PARSER)
+    except etree.XMLSyntaxError:
+        return None
+    if raiz is None:
+        return None
+    return raiz.find(".//{*}Fault")
+
+
+def _fallo(fault):
+    return Fallo(_texto(fault, "{*}Code/{*}Value", "faultcode"), _texto(fault, "{*}Reason/{*}Text", "faultstring"))
+
+
+def extraer_fallo(contenido):
+    # Solo el faultcode/Reason del SOAP Fault de `contenido`, o None si no lo hay.
+    fault = _buscar_fault(contenido)
+    return None if fault is None else _fallo(fault)
+
+
+def analizar_fallos(contenido):
+    # Analiza el cuerpo de una respuesta de un sobre multievento. Devuelve
+    # (fallo_general, fallos_por_evento): el Fault del sobre (o None si no lo hay) y un
+    # dict {posición del evento en el sobre, desde 1: Fallo} con los errores por evento.
+    #
+    # Contrato del endpoint por lotes: los eventos rechazados se detallan dentro del
+    # Detail del Fault, uno por elemento errorEvento con su indiceEvento y su motivo:
+    #
+    #   <soap12:Detail>
+    #     <ns2:errorEvento><indiceEvento>2</indiceEvento><motivo>PNR desconocido</motivo></ns2:errorEvento>
+    #   </soap12:Detail>
+    #
+    # Un Fault sin errorEvento afecta a todo el sobre.
+    fault = _buscar_fault(contenido)
+    if fault is None:
+        return None, {}
+    fallo_general = _fallo(fault)
+
+    fallos_por_evento = {}
+    for error in fault.iterfind(".//{*}errorEvento"):
+        try:
+            indice = int(_texto(error, "{*}indiceEvento"))
+        except ValueError:
+            continue
+        fallos_por_evento[indice] = Fallo(fallo_general.codigo, _texto(error, "{*}motivo") or fallo_general.motivo)
+    return fallo_general, fallos_por_evento
+
+
+def detalle_fallo(fallo):
+    if fallo.codigo and fallo.motivo:
+        return f"{fallo.codigo}: {fallo.motivo}"
+    return fallo.codigo or fallo.motivo or "SOAP Fault sin detalle"
+
+
+def resumir_error(contenido, truncado=False):
+    # Detalle para el log de una respuesta de error: "faultcode: Reason" si es un SOAP
+    # Fault y, si no, el cuerpo como texto (marcado si se recortó).
+    fallo = extraer_fallo(contenido)
+    if fallo is not None:
+        return detalle_fallo(fallo)
+    texto = contenido.decode("utf-8", errors="replace").strip()
+    return f"{texto} [...]" if truncado and texto else texto
+
+
+def _leer_hasta(raw, max_bytes):
+    partes = []
+    leidos = 0
+    for trozo in raw.stream(_TAMANO_LECTURA, decode_content=True):
+        partes.append(trozo)
+        leidos += len(trozo)
+        if leidos > max_bytes:
+            break
+    return b"".join(partes)[:max_bytes], leidos > max_bytes
+
+
+def procesar_respuesta(response, conservar_contenido=False, max_bytes_fallo=MAX_BYTES_FALLO_POR_DEFECTO,
+                       max_bytes_contenido=MAX_BYTES_CONTENIDO_POR_DEFECTO):
+    # Convierte una respuesta pedida con stream=True en una RespuestaSOAP. El cuerpo de
+    # una respuesta 2xx se lee y se descarta sin descomprimir ni decodificar (salvo con
+    # `conservar_contenido`); el de una respuesta de error se lee hasta `max_bytes_fallo`
+    # y solo se extrae su faultcode/Reason. En ambos casos el resto del cuerpo se descarta
+    # para que la conexión vuelva al pool. Se llama desde el hilo que hizo la solicitud,
+    # fuera del bucle que consume los resultados en orden.
+    exito = 200 <= response.status_code < 300
+    try:
+        if exito and not conservar_contenido:
+            response.raw.drain_conn()
+            return RespuestaSOAP(response.status_code, response.headers, "", b"")
+        contenido, truncado = _leer_hasta(response.raw, max_bytes_contenido if conservar_contenido else max_bytes_fallo)
+        response.raw.drain_conn()
+    except urllib3.exceptions.HTTPError as e:
+        # Un corte o un timeout leyendo el cuerpo cuenta como error de conexión.
+        raise requests.exceptions.ConnectionError(e) from e
+    finally:
+        response.close()
+    texto = "" if exito else resumir_error(contenido[:max_bytes_fallo], truncado or len(contenido) > max_bytes_fallo)
+    return RespuestaSOAP(response.status_code, response.headers, texto, contenido if conservar_contenido else b"")
@@ -0,0 +1,100 @@
+PLANTILLA_SOAP = '''<soap12:Envelope xmlns:soap12="http://www.w3.org/2003/05/soap-envelope">
+  <soap12:Body>
+    <ns2:EventoPNR xmlns:ns2="http://ejemplo.com/eventoPNR/v1">
+      <cdiApto>{}</cdiApto>
+      <fechaEvento>{}</fechaEvento>
+      <pnr>{}</pnr>
+      <asiento>{}</asiento>
+      <tarjetaFidelizacion>{}</tarjetaFidelizacion>
+    </ns2:EventoPNR>
+  </soap12:Body>
+</soap12:Envelope>'''
+
+# La plantilla se parte una sola vez en los seis tramos estáticos que rodean a los
+# cinco campos (como str y ya codificados a UTF-8).
+_TRAMOS = tuple(PLANTILLA_SOAP.split("{}"))
+_TRAMOS_BYTES = tuple(tramo.encode("utf-8") for tramo in _TRAMOS)
+
+_SEPARADOR = "\x00" # No puede aparecer en texto XML válido, pero sí en un valor leído
+
+
+def escapar_xml(texto):
+    # Dentro del contenido de un elemento solo hace falta escapar &, < y >. El caso
+    # habitual (sin ninguno) se resuelve con tres búsquedas en C y sin copiar.
+    texto = str(texto)
+    if "&" in texto or "<" in texto or ">" in texto:
+        return texto.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return texto
+
+
+def _escapar_columna(valores):
+    # Escapa una columna entera de una vez: se une con un separador, se comprueba y
+    # se sustituye sobre una sola cadena, y solo se vuelve a partir si había algo que escapar.
+    # Si algún valor contiene el propio separador, la partición no devolvería un valor
+    # por fila: entonces se escapa valor a valor.
+    valores = [str(valor) for valor in valores]
+    unida = _SEPARADOR.join(valores)
+    if "&" in unida or "<" in unida or ">" in unida:
+        escapados = escapar_xml(unida).split(_SEPARADOR)
+        if len(escapados) != len(valores):
+            return [escapar_xml(valor) for valor in valores]
+        return escapados
+    return valores
+
+
+def construir_cuerpo_soap_str(valores):
+    # `valores` son los cinco campos en el orden de COLUMNAS_EVENTO.
+    c0, c1, c2, c3, c4 = valores
+    t0, t1, t2, t3, t4, t5 = _TRAMOS
+    return (f"{t0}{escapar_xml(c0)}{t1}{escapar_xml(c1)}{t2}{escapar_xml(c2)}"
+            f"{t3}{escapar_xml(c3)}{t4}{escapar_xml(c4)}{t5}")
+
+
+def construir_cuerpo_soap(valores):
+    return construir_cuerpo_soap_str(valores).encode("utf-8")
+
+
+def construir_cuerpos_soap(filas_valores):
+    # API por lotes: escapa cada columna del bloque de golpe y monta todos los sobres
+    # directamente como bytes listos para enviar.
+    filas_valores = list(filas_valores)
+    if not filas_valores:
+        return []
+    columnas = [_escapar_columna(columna) for columna in zip(*filas_valores)]
+    t0, t1, t2, t3, t4, t5 = _TRAMOS
+    return [
+        f"{t0}{c0}{t1}{c1}{t2}{c2}{t3}{c3}{t4}{c4}{t5}".encode("utf-8")
+        for c0, c1, c2, c3, c4 in zip(*columnas)
+    ]
+
+
+def escribir_cuerpo_soap(buffer, valores):
+    # Escribe el sobre en un buffer binario reutilizable (p. ej. io.BytesIO) sin crear
+    # los bytes del sobre completo; devuelve el número de bytes escritos.
+    t0, t1, t2, t3, t4, t5 = _TRAMOS_BYTES
+    escritos = buffer.write(t0)
+    for valor, tramo in zip(valores, (t1, t2, t3, t4, t5)):
+        escritos += buffer.write(escapar_xml(valor).encode("utf-8"))
+        escritos += buffer.write(tramo)
+    return escritos
+
+
+# --- Sobres con varios eventos ---
+# Un sobre multievento es el mismo sobre con varios elementos EventoPNR seguidos dentro
+# del Body. Se monta reutilizando los cuerpos por fila ya construidos: se recorta de
+# cada uno el fragmento EventoPNR y se concatenan entre el prefijo y el sufijo comunes.
+
+_INICIO_EVENTO = PLANTILLA_SOAP.index("<ns2:EventoPNR")
+_FIN_EVENTO = PLANTILLA_SOAP.index("</ns2:EventoPNR>") + len("</ns2:EventoPNR>")
+PREFIJO_SOBRE = PLANTILLA_SOAP[:_INICIO_EVENTO].encode("utf-8")
+SUFIJO_SOBRE = PLANTILLA_SOAP[_FIN_EVENTO:].encode("utf-8")
+SEPARADOR_EVENTOS = b"\n    "
+
+
+def fragmento_evento(cuerpo_soap):
+    # El elemento EventoPNR (bytes) de un cuerpo construido con la plantilla.
+    return cuerpo_soap[len(PREFIJO_SOBRE):len(cuerpo_soap) - len(SUFIJO_SOBRE)]
+
+
+def construir_sobre_multievento(cuerpos_soap):
+    return PREFIJO_SOBRE + SEPARADOR_EVENTOS.join(fragmento_evento(c) for c in cuerpos_soap) + SUFIJO_SOBRE
@@ -0,0 +1,53 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+from soap_batch.respuestas import MAX_BYTES_FALLO_POR_DEFECTO, procesar_respuesta
+
+TIMEOUT_CONEXION_POR_DEFECTO = 5 # Segundos para establecer la conexión TCP/TLS
+TIMEOUT_LECTURA_POR_DEFECTO = 20 # Segundos esperando la respuesta una vez enviada la solicitud
+TAMANO_POOL_POR_DEFECTO = 10
+
+CABECERAS_SOAP = {'Content-Type': 'application/soap+xml; charset=utf-8'}
+
+
+class TransporteSOAP:
+    # Transporte HTTP reutilizable basado en requests.Session. Mantiene un pool de
+    # conexiones persistentes (keep-alive) hacia el endpoint, de modo que cada fila
+    # no paga un nuevo handshake TCP/TLS. Es seguro compartirlo entre los hilos del
+    # despachador: urllib3 gestiona el préstamo de conexiones del pool.
+    #
+    # post() devuelve una RespuestaSOAP ya procesada (ver respuestas.procesar_respuesta):
+    # el cuerpo de las respuestas 2xx no se guarda salvo con `conservar_contenido`, que
+    # hace falta para repartir los fallos de un sobre multievento.
+
+    def __init__(self, tamano_pool=TAMANO_POOL_POR_DEFECTO, timeout_conexion=TIMEOUT_CONEXION_POR_DEFECTO,
+                 timeout_lectura=TIMEOUT_LECTURA_POR_DEFECTO, keep_alive=True, bloquear_pool=True,
+                 conservar_contenido=False, max_bytes_fallo=MAX_BYTES_FALLO_POR_DEFECTO):
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.conservar_contenido = conservar_contenido
+        self.max_bytes_fallo = max_bytes_fallo
+        self.session = requests.Session()
+        self.session.headers.update(CABECERAS_SOAP)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        # Con bloquear_pool=True, un hilo que no encuentra conexión libre espera a que
+        # otro la devuelva en lugar de abrir una conexión extra que luego se descarta.
+        # Así el número de conexiones abiertas hacia el endpoint queda fijo en
+        # `tamano_pool` y todas se reutilizan petición tras petición.
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamano_pool, pool_block=bloquear_pool)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+
+    def post(self, url, data):
+        response = self.session.post(url, data=data, timeout=self.timeout, stream=True)
+        return procesar_respuesta(response, self.conservar_contenido, self.max_bytes_fallo)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,76 @@
+import datetime
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Definición de las columnas esperadas
+EXPECTED_COLUMNS = {"CDIAPTO", "FECHA_EVENTO", "PNR_CODE", "ASIENTO", "TARJETA_FIDELIZACION"}
+
+# Orden fijo de los valores de cada fila validada (el mismo en que van en el SOAP)
+COLUMNAS_EVENTO = ("CDIAPTO", "FECHA_EVENTO", "PNR_CODE", "ASIENTO", "TARJETA_FIDELIZACION")
+
+# `valores` es una tupla de str en el orden de COLUMNAS_EVENTO, o None si la fila se
+# omite; en ese caso `resultado` y `detalle` indican el motivo para el log.
+FilaValidada = namedtuple("FilaValidada", ["linea_excel", "valores", "resultado", "detalle"])
+
+_FECHA_ISO = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def columnas_faltantes(columnas):
+    return EXPECTED_COLUMNS - set(columnas)
+
+
+def normalizar_fechas(serie):
+    # Convierte una columna FECHA_EVENTO a str YYYY-MM-DD con operaciones por columna.
+    # Primero un parseo ISO vectorizado (caso habitual: fechas Excel o texto ISO) y,
+    # solo para lo que no encaje, un segundo intento flexible con día primero
+    # (p. ej. "12/03/2025" -> 2025-03-12). Lo que no se pueda interpretar se envía tal cual.
+    fechas = pd.to_datetime(serie, errors="coerce", format="ISO8601")
+    pendientes = fechas.isna() & serie.notna()
+    if pendientes.any():
+        flexibles = pd.to_datetime(serie[pendientes], errors="coerce", format="mixed", dayfirst=True)
+        fechas = fechas.where(~pendientes, flexibles)
+    resultado = fechas.dt.strftime("%Y-%m-%d")
+    sin_fecha = resultado.isna() & serie.notna()
+    if sin_fecha.any():
+        resultado = resultado.where(~sin_fecha, serie.astype(str))
+    return resultado
+
+
+def normalizar_fecha_evento(valor):
+    # Versión escalar de normalizar_fechas, con atajos para los casos que no necesitan parseo.
+    if isinstance(valor, str) and _FECHA_ISO.fullmatch(valor):
+        return valor
+    if isinstance(valor, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return valor.strftime("%Y-%m-%d")
+    return normalizar_fechas(pd.Series([valor], dtype=object)).iloc[0]
+
+
+def validar_bloque(df):
+    # Valida un bloque completo con operaciones por columna, en lugar de fila a fila:
+    # una máscara de nulos para COLUMNAS_EVENTO, un único pd.to_datetime para
+    # FECHA_EVENTO y la conversión a str de cada columna. Devuelve una FilaValidada
+    # por fila, en el orden del bloque. Se asume que la cabecera ya se ha comprobado.
+    columnas = list(COLUMNAS_EVENTO) # Tupla ordenada: el mensaje de nulos no depende del orden del set
+    lineas = (df.index + 2).tolist() # Para reportar al usuario (1-based + cabecera)
+    mascara_nulos = df[columnas].isnull().to_numpy()
+    filas_con_nulos = mascara_nulos.any(axis=1)
+
+    validas = df.loc[~filas_con_nulos]
+    columnas_str = [
+        normalizar_fechas(validas[columna]) if columna == "FECHA_EVENTO" else validas[columna].astype(str)
+        for columna in COLUMNAS_EVENTO
+    ]
+    valores_validos = zip(*(columna.tolist() for columna in columnas_str))
+
+    filas = []
+    for posicion, linea_excel in enumerate(lineas):
+        if filas_con_nulos[posicion]:
+            cols_nulas = [columnas[i] for i in np.flatnonzero(mascara_nulos[posicion])]
+            msg_error = f"Contiene valores nulos en columnas esperadas: {cols_nulas}"
+            filas.append(FilaValidada(linea_excel, None, "OMITIDO_NULOS", msg_error))
+        else:
+            filas.append(FilaValidada(linea_excel, next(valores_validos), None, None))
+    return filas
@@ -0,0 +1,148 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+
+from soap_batch.ingesta import listar_archivos
+
+INTERVALO_SONDEO_POR_DEFECTO = 5.0
+ESPERA_ESTABILIDAD = 1.0 # Segundos entre las dos lecturas de la firma de un archivo antes de procesarlo
+_PORCION_ESPERA = 0.5 # Cada cuánto se comprueba la señal de parada mientras se espera
+
+# Eventos de inotify que indican un archivo nuevo o terminado de escribir en el directorio.
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_MASCARA_INOTIFY = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+
+def _firma(ruta):
+    estado = ruta.stat()
+    return estado.st_mtime_ns, estado.st_size
+
+
+class IndiceArchivos:
+    # Índice en memoria de la firma (mtime, tamaño) de cada archivo del directorio. Un
+    # archivo nuevo o modificado solo está listo cuando su firma se repite en dos
+    # comprobaciones seguidas, para no leer un Excel que todavía se está copiando.
+    # Los ficheros de bloqueo de Excel (~$...) se ignoran.
+
+    def __init__(self):
+        self.procesados = {}
+        self.pendientes = {}
+
+    @property
+    def hay_pendientes(self):
+        return bool(self.pendientes)
+
+    def listos(self, rutas):
+        listos = []
+        vistas = set()
+        for ruta in rutas:
+            if ruta.name.startswith("~$"):
+                continue
+            try:
+                firma = _firma(ruta)
+            except FileNotFoundError:
+                continue
+            vistas.add(ruta)
+            if self.procesados.get(ruta) == firma:
+                self.pendientes.pop(ruta, None)
+            elif self.pendientes.get(ruta) == firma:
+                listos.append(ruta)
+            else:
+                self.pendientes[ruta] = firma
+        # Los archivos borrados se olvidan: si vuelven a aparecer se procesan de nuevo.
+        for tabla in (self.procesados, self.pendientes):
+            for ruta in [ruta for ruta in tabla if ruta not in vistas]:
+                del tabla[ruta]
+        return listos
+
+    def marcar_procesados(self, rutas):
+        # Se guarda la firma con la que se dieron por listos: si el archivo cambió durante
+        # el procesamiento, la siguiente comprobación lo vuelve a detectar.
+        for ruta in rutas:
+            firma = self.pendientes.pop(ruta, None)
+            if firma is not None:
+                self.procesados[ruta] = firma
+
+
+class _EsperaSondeo:
+    nombre = "sondeo"
+
+    def esperar(self, segundos, parar):
+        parar.wait(segundos)
+
+    def close(self):
+        pass
+
+
+class _EsperaInotify:
+    # Espera a un cambio en el directorio con inotify (Linux), llamado por ctypes para no
+    # añadir dependencias. Se despierta en cuanto llega un evento o al cumplirse el plazo.
+    nombre = "inotify"
+
+    def __init__(self, directorio):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self._fd, os.fsencode(directorio), _MASCARA_INOTIFY) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, os.strerror(error), str(directorio))
+
+    def esperar(self, segundos, parar):
+        fin = time.monotonic() + segundos
+        while not parar.is_set():
+            restante = fin - time.monotonic()
+            if restante <= 0:
+                return
+            listos, _, _ = select.select([self._fd], [], [], min(restante, _PORCION_ESPERA))
+            if listos:
+                self._vaciar()
+                return
+
+    def _vaciar(self):
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+def crear_espera(directorio):
+    # inotify donde esté disponible; en otros sistemas (o si falla) sondeo periódico.
+    if sys.platform.startswith("linux"):
+        try:
+            return _EsperaInotify(directorio)
+        except (OSError, AttributeError):
+            pass
+    return _EsperaSondeo()
+
+
+def vigilar(directorio, procesar, intervalo=INTERVALO_SONDEO_POR_DEFECTO, parar=None,
+            estabilidad=ESPERA_ESTABILIDAD, espera=None):
+    # Llama a procesar(rutas) con los archivos nuevos o modificados de `directorio` hasta
+    # que se active el evento `parar`. El directorio se vuelve a comprobar cada
+    # `intervalo` segundos o antes, si inotify avisa de un cambio.
+    parar = parar or threading.Event()
+    indice = IndiceArchivos()
+    espera = espera or crear_espera(directorio)
+    try:
+        while not parar.is_set():
+            listos = indice.listos(listar_archivos(directorio))
+            if listos:
+                procesar(listos)
+                indice.marcar_procesados(listos)
+            espera.esperar(estabilidad if indice.hay_pendientes else intervalo, parar)
+    finally:
+        espera.close()
@@ -0,0 +1,35 @@
+import openpyxl
+
+CABECERA = ["CDIAPTO", "FECHA_EVENTO", "PNR_CODE", "ASIENTO", "TARJETA_FIDELIZACION"]
+
+
+def crear_libro(ruta, filas, cabecera=CABECERA):
+    # Libro .xlsx de prueba con `cabecera` y `filas` tal cual.
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.append(cabecera)
+    for fila in filas:
+        hoja.append(fila)
+    libro.save(ruta)
+    return ruta
+
+
+def crear_xlsx(ruta, pnrs, cabecera=CABECERA, nulos_en=()):
+    # Un evento por cada PNR de `pnrs`; con un entero, ese número de PNR distintos con el
+    # nombre del archivo delante. Las filas en las posiciones de `nulos_en` van sin ASIENTO.
+    if isinstance(pnrs, int):
+        pnrs = [f"{ruta.stem}-{i:04d}" for i in range(pnrs)]
+    filas = [["MAD", "2023-01-01", pnr, None if i in nulos_en else "1A", "TF"] for i, pnr in enumerate(pnrs)]
+    return crear_libro(ruta, filas, cabecera)
+
+
+class RelojFalso:
+    # Reloj manual para los tests: `ahora` solo avanza al asignarlo o al "dormir".
+    def __init__(self):
+        self.ahora = 0.0
+
+    def __call__(self):
+        return self.ahora
+
+    def dormir(self, segundos):
+        self.ahora += segundos
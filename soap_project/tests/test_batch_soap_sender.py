@@ -78,22 +78,25 @@ def test_generar_cuerpo_soap_con_string_date_mmm_dd_yyyy(sample_row_data_str_dat
 # --- Pruebas para la lógica de main (simulada) ---
 
 @pytest.fixture
-def mock_main_args(tmp_path):
-    # tmp_path es una fixture de pytest que provee un directorio temporal único
+def mock_main_args(tmp_path, monkeypatch):
+    # tmp_path es una fixture de pytest que provee un directorio temporal único.
+    # main() escribe el log y el diario de checkpoint en el directorio actual: se
+    # ejecuta en tmp_path para no dejar estado entre pruebas.
+    monkeypatch.chdir(tmp_path)
     excel_dir = tmp_path / "excel_data"
     excel_dir.mkdir()
     return MagicMock(excel_dir=excel_dir, soap_endpoint="http://mock-endpoint.com")
 
 @patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
-@patch('soap_batch.batch_soap_sender.log_soap_request')
-@patch('pandas.read_excel')
-def test_main_df_columnas_correctas(mock_read_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_df_columnas_correctas(mock_leer_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
     # Datos de prueba para el DataFrame
     df_valid = pd.DataFrame([{
         "CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "PNR001",
         "ASIENTO": "1A", "TARJETA_FIDELIZACION": "TF001"
     }])
-    mock_read_excel.return_value = df_valid
+    mock_leer_excel.return_value = iter([df_valid])
     
     # Simular que el archivo existe creando un dummy .xlsx en el directorio temporal
     dummy_file = mock_main_args.excel_dir / "valid_data.xlsx"
@@ -112,18 +115,18 @@ def test_main_df_columnas_correctas(mock_read_excel, mock_log_soap, mock_enviar_
     captured = capsys.readouterr()
     assert "Procesando archivo: valid_data.xlsx" in captured.out
     mock_enviar_soap.assert_called_once()
-    mock_log_soap.assert_any_call(pathlib.Path("soap_log.csv"), "valid_data.xlsx", 2, 200, "OK", "")
+    mock_log_soap.assert_any_call("valid_data.xlsx", 2, 200, "OK", "")
     assert "Filas enviadas exitosamente: 1" in captured.out
 
 
 @patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
-@patch('soap_batch.batch_soap_sender.log_soap_request')
-@patch('pandas.read_excel')
-def test_main_df_columnas_faltantes(mock_read_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_df_columnas_faltantes(mock_leer_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
     df_missing_cols = pd.DataFrame([
         {"CDIAPTO": "BCN", "PNR_CODE": "XYZ789"} # Faltan FECHA_EVENTO, ASIENTO, TARJETA_FIDELIZACION
     ])
-    mock_read_excel.return_value = df_missing_cols
+    mock_leer_excel.return_value = iter([df_missing_cols])
 
     dummy_file = mock_main_args.excel_dir / "missing_cols.xlsx"
     dummy_file.touch()
@@ -137,9 +140,8 @@ def test_main_df_columnas_faltantes(mock_read_excel, mock_log_soap, mock_enviar_
     assert "WARNING: Archivo missing_cols.xlsx omitido. Cabecera no contiene todas las columnas esperadas." in captured.out
     mock_enviar_soap.assert_not_called()
     
-    # Verificar que log_soap_request fue llamado con los detalles de omisión de cabecera
+    # Verificar que se registró en el log la omisión por cabecera
     expected_log_call_args = [
-        pathlib.Path("soap_log.csv"),
         "missing_cols.xlsx",
         "N/A",
         "N/A",
@@ -150,11 +152,11 @@ def test_main_df_columnas_faltantes(mock_read_excel, mock_log_soap, mock_enviar_
     called_args_list = [c.args for c in mock_log_soap.call_args_list]
     found_log = False
     for called_args in called_args_list:
-        if called_args[:4] == tuple(expected_log_call_args[:4]) and expected_log_call_args[4] in called_args[4]:
+        if called_args[:3] == tuple(expected_log_call_args[:3]) and expected_log_call_args[3] in called_args[3]:
             # Check if the detail message contains the expected reason
-            assert "FECHA_EVENTO" in called_args[5] 
-            assert "ASIENTO" in called_args[5]
-            assert "TARJETA_FIDELIZACION" in called_args[5]
+            assert "FECHA_EVENTO" in called_args[4] 
+            assert "ASIENTO" in called_args[4]
+            assert "TARJETA_FIDELIZACION" in called_args[4]
             found_log = True
             break
     assert found_log, "Log de OMITIDO_CABECERA no encontrado o con detalles incorrectos"
@@ -162,14 +164,14 @@ def test_main_df_columnas_faltantes(mock_read_excel, mock_log_soap, mock_enviar_
 
 
 @patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
-@patch('soap_batch.batch_soap_sender.log_soap_request')
-@patch('pandas.read_excel')
-def test_main_df_fila_con_datos_nulos(mock_read_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_df_fila_con_datos_nulos(mock_leer_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
     df_nulos = pd.DataFrame([
         {"CDIAPTO": "VAL", "FECHA_EVENTO": "2023-11-10", "PNR_CODE": "PQR456", "ASIENTO": None, "TARJETA_FIDELIZACION": "F98765"},
         {"CDIAPTO": "LIS", "FECHA_EVENTO": "2023-11-11", "PNR_CODE": "LMN789", "ASIENTO": "12B", "TARJETA_FIDELIZACION": "F123098"}
     ])
-    mock_read_excel.return_value = df_nulos
+    mock_leer_excel.return_value = iter([df_nulos])
     
     dummy_file = mock_main_args.excel_dir / "nulos.xlsx"
     dummy_file.touch()
@@ -179,7 +181,7 @@ def test_main_df_fila_con_datos_nulos(mock_read_excel, mock_log_soap, mock_envia
     mock_soap_response.text = "Success"
     mock_enviar_soap.return_value = mock_soap_response
 
-    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint]
+    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint, "-v"]
     with patch('sys.argv', ['batch_soap_sender.py'] + batch_main_args):
         batch_main()
 
@@ -193,9 +195,9 @@ def test_main_df_fila_con_datos_nulos(mock_read_excel, mock_log_soap, mock_envia
     log_calls = mock_log_soap.call_args_list
     
     # Log para la fila omitida
-    expected_omit_log = call(pathlib.Path("soap_log.csv"), "nulos.xlsx", 2, "N/A", "OMITIDO_NULOS", "Contiene valores nulos en columnas esperadas: ['ASIENTO']")
+    expected_omit_log = call("nulos.xlsx", 2, "N/A", "OMITIDO_NULOS", "Contiene valores nulos en columnas esperadas: ['ASIENTO']")
     # Log para la fila enviada
-    expected_ok_log = call(pathlib.Path("soap_log.csv"), "nulos.xlsx", 3, 200, "OK", "")
+    expected_ok_log = call("nulos.xlsx", 3, 200, "OK", "")
     
     assert expected_omit_log in log_calls
     assert expected_ok_log in log_calls
@@ -204,38 +206,38 @@ def test_main_df_fila_con_datos_nulos(mock_read_excel, mock_log_soap, mock_envia
     assert "Filas omitidas (archivo con cabecera incorrecta, o fila con datos nulos/faltantes): 1" in captured.out
 
 @patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
-@patch('soap_batch.batch_soap_sender.log_soap_request')
-@patch('pandas.read_excel')
-def test_main_error_conexion_soap(mock_read_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_error_conexion_soap(mock_leer_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
     df_valid = pd.DataFrame([{
         "CDIAPTO": "SVQ", "FECHA_EVENTO": "2023-02-01", "PNR_CODE": "PNR002",
         "ASIENTO": "2B", "TARJETA_FIDELIZACION": "TF002"
     }])
-    mock_read_excel.return_value = df_valid
+    mock_leer_excel.return_value = iter([df_valid])
     
     dummy_file = mock_main_args.excel_dir / "conexion_error.xlsx"
     dummy_file.touch()
 
     mock_enviar_soap.return_value = None # Simula error de conexión/timeout
 
-    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint]
+    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint, "-v"]
     with patch('sys.argv', ['batch_soap_sender.py'] + batch_main_args):
         batch_main()
 
     captured = capsys.readouterr()
     assert "ERROR DE CONEXIÓN: Fila 2, PNR PNR002. Error de conexión o timeout" in captured.out
-    mock_log_soap.assert_any_call(pathlib.Path("soap_log.csv"), "conexion_error.xlsx", 2, "N/A", "ERROR_CONEXION", "Error de conexión o timeout")
+    mock_log_soap.assert_any_call("conexion_error.xlsx", 2, "N/A", "ERROR_CONEXION", "Error de conexión o timeout")
     assert "Filas con fallo en el envío (conexión, HTTP error, o error procesando fila): 1" in captured.out
 
 @patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
-@patch('soap_batch.batch_soap_sender.log_soap_request')
-@patch('pandas.read_excel')
-def test_main_error_http_soap(mock_read_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_error_http_soap(mock_leer_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
     df_valid = pd.DataFrame([{
         "CDIAPTO": "OPO", "FECHA_EVENTO": "2023-03-01", "PNR_CODE": "PNR003",
         "ASIENTO": "3C", "TARJETA_FIDELIZACION": "TF003"
     }])
-    mock_read_excel.return_value = df_valid
+    mock_leer_excel.return_value = iter([df_valid])
 
     dummy_file = mock_main_args.excel_dir / "http_error.xlsx"
     dummy_file.touch()
@@ -245,21 +247,21 @@ def test_main_error_http_soap(mock_read_excel, mock_log_soap, mock_enviar_soap,
     mock_soap_response.text = "Internal Server Error"
     mock_enviar_soap.return_value = mock_soap_response
 
-    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint]
+    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint, "-v"]
     with patch('sys.argv', ['batch_soap_sender.py'] + batch_main_args):
         batch_main()
 
     captured = capsys.readouterr()
     assert "ERROR HTTP: Fila 2, PNR PNR003, Status: 500, Msg: Internal Server Error" in captured.out
-    mock_log_soap.assert_any_call(pathlib.Path("soap_log.csv"), "http_error.xlsx", 2, 500, "ERROR_HTTP", "Internal Server Error")
+    mock_log_soap.assert_any_call("http_error.xlsx", 2, 500, "ERROR_HTTP", "Internal Server Error")
     assert "Filas con fallo en el envío (conexión, HTTP error, o error procesando fila): 1" in captured.out
 
 # Prueba para verificar que el archivo de log se crea y tiene la cabecera correcta
 @patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') # Necesario para que main corra
-@patch('pandas.read_excel') # Necesario para que main corra
-def test_log_file_creation_and_header(mock_read_excel, mock_enviar_soap, mock_main_args, tmp_path):
+@patch('soap_batch.batch_soap_sender.leer_por_bloques') # Necesario para que main corra
+def test_log_file_creation_and_header(mock_leer_excel, mock_enviar_soap, mock_main_args, tmp_path):
     # Configurar mocks para que la ejecución de main sea mínima pero cree el log
-    mock_read_excel.return_value = pd.DataFrame(columns=list(EXPECTED_COLUMNS)) # DF vacío pero con columnas
+    mock_leer_excel.return_value = iter([pd.DataFrame(columns=list(EXPECTED_COLUMNS))]) # DF vacío pero con columnas
     
     # Simular un archivo excel para que el bucle de archivos se ejecute
     dummy_excel_for_log_test = mock_main_args.excel_dir / "log_header_test.xlsx"
@@ -267,11 +269,8 @@ def test_log_file_creation_and_header(mock_read_excel, mock_enviar_soap, mock_ma
 
     batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint]
     
-    # El archivo de log se crea en el directorio actual donde se ejecuta el test
-    # Necesitamos asegurar que es el path esperado (relativo a donde se ejecuta pytest)
-    expected_log_path = pathlib.Path("soap_log.csv") 
-    if expected_log_path.exists():
-        expected_log_path.unlink() # Eliminar si existe de una ejecución anterior
+    # El archivo de log se crea en el directorio actual (tmp_path, ver mock_main_args)
+    expected_log_path = pathlib.Path("soap_log.csv")
 
     with patch('sys.argv', ['batch_soap_sender.py'] + batch_main_args):
         batch_main()
@@ -280,9 +279,64 @@ def test_log_file_creation_and_header(mock_read_excel, mock_enviar_soap, mock_ma
     with open(expected_log_path, 'r') as f:
         header = f.readline().strip()
         assert header == '"nombre_archivo","numero_linea","http_status","resultado","detalle_error"'
-    
-    # Limpiar el archivo de log creado
-    if expected_log_path.exists():
-        expected_log_path.unlink()
 
-```
+
+@patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_concurrencia_mantiene_orden_del_log(mock_leer_excel, mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+    filas = [
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": f"PNR{i:03d}",
+         "ASIENTO": "1A", "TARJETA_FIDELIZACION": "TF001"}
+        for i in range(10)
+    ]
+    filas[4]["ASIENTO"] = None
+    mock_leer_excel.return_value = iter([pd.DataFrame(filas)])
+
+    dummy_file = mock_main_args.excel_dir / "concurrente.xlsx"
+    dummy_file.touch()
+
+    mock_soap_response = MagicMock()
+    mock_soap_response.status_code = 200
+    mock_soap_response.text = "Success"
+    mock_enviar_soap.return_value = mock_soap_response
+
+    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint,
+                       "--concurrency", "4"]
+    with patch('sys.argv', ['batch_soap_sender.py'] + batch_main_args):
+        batch_main()
+
+    captured = capsys.readouterr()
+    assert mock_enviar_soap.call_count == 9
+    lineas_logueadas = [c.args[1] for c in mock_log_soap.call_args_list]
+    assert lineas_logueadas == list(range(2, 12))
+    assert mock_log_soap.call_args_list[4].args[3] == "OMITIDO_NULOS"
+    assert "Filas enviadas exitosamente: 9" in captured.out
+    assert "Filas omitidas (archivo con cabecera incorrecta, o fila con datos nulos/faltantes): 1" in captured.out
+
+
+@patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+def test_main_lee_xlsx_real_por_bloques(mock_log_soap, mock_enviar_soap, mock_main_args, capsys):
+    import openpyxl
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.append(["CDIAPTO", "FECHA_EVENTO", "PNR_CODE", "ASIENTO", "TARJETA_FIDELIZACION"])
+    hoja.append(["MAD", datetime(2023, 1, 1), "PNR001", "1A", "TF001"])
+    hoja.append(["BCN", datetime(2023, 1, 2), "PNR002", None, "TF002"])
+    hoja.append(["VAL", datetime(2023, 1, 3), "PNR003", "3C", "TF003"])
+    libro.save(mock_main_args.excel_dir / "real.xlsx")
+
+    mock_enviar_soap.return_value = MagicMock(status_code=200, text="ok")
+
+    batch_main_args = ["--excel-dir", str(mock_main_args.excel_dir), "--soap-endpoint", mock_main_args.soap_endpoint,
+                       "--chunk-size", "2"]
+    with patch('sys.argv', ['batch_soap_sender.py'] + batch_main_args):
+        batch_main()
+
+    captured = capsys.readouterr()
+    assert mock_enviar_soap.call_count == 2
+    assert b"<fechaEvento>2023-01-03</fechaEvento>" in mock_enviar_soap.call_args_list[1].args[1]
+    assert [c.args[1] for c in mock_log_soap.call_args_list] == [2, 3, 4]
+    assert "Total de filas leídas de los archivos: 3" in captured.out
+    assert "Filas enviadas exitosamente: 2" in captured.out
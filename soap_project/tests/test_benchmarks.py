@@ -0,0 +1,64 @@
+import pytest
+import requests
+
+from benchmarks.bench_extremo_a_extremo import comparar, ejecutar
+from benchmarks.libros_sinteticos import filas_sinteticas, generar_libro
+from benchmarks.servidor_soap import ServidorSOAPStub
+from soap_batch.lectores import leer_excel_por_bloques
+from soap_batch.validacion import COLUMNAS_EVENTO, validar_bloque
+
+
+def test_filas_sinteticas_reproducibles():
+    assert list(filas_sinteticas(50, semilla=3)) == list(filas_sinteticas(50, semilla=3))
+    assert list(filas_sinteticas(50, semilla=3)) != list(filas_sinteticas(50, semilla=4))
+
+
+def test_generar_libro_xlsx_se_lee_y_valida(tmp_path):
+    ruta = generar_libro(tmp_path / "datos.xlsx", 30, proporcion_nulos=0.2)
+
+    bloques = list(leer_excel_por_bloques(ruta, tamano_bloque=100))
+    assert list(bloques[0].columns) == list(COLUMNAS_EVENTO)
+    filas = validar_bloque(bloques[0])
+    assert len(filas) == 30
+    assert 0 < sum(fila.valores is None for fila in filas) < 30
+
+
+def test_generar_libro_xls(tmp_path):
+    pytest.importorskip("xlwt")
+    ruta = generar_libro(tmp_path / "datos.xls", 10)
+    assert len(next(leer_excel_por_bloques(ruta))) == 10
+
+
+def test_generar_libro_rechaza_extension(tmp_path):
+    with pytest.raises(ValueError):
+        generar_libro(tmp_path / "datos.csv", 10)
+
+
+def test_servidor_simula_errores():
+    with ServidorSOAPStub(tasa_errores=1.0, codigo_error=503) as servidor:
+        response = requests.post(servidor.url, data=b"<x/>")
+    assert response.status_code == 503
+    assert b"soap12:Fault" in response.content
+    assert servidor.errores == 1
+
+
+def test_ejecutar_extremo_a_extremo():
+    resultado = ejecutar(40, archivos=2, concurrencia=4, tasa_errores=0.1, semilla=1)
+
+    assert resultado["peticiones_servidor"] == 40
+    assert resultado["latencia_http_ms"]["solicitudes"] == 40
+    assert sum(resultado["codigos_http"].values()) == 40
+    assert resultado["codigos_http"].get("500", 0) == resultado["errores_simulados"]
+    assert resultado["filas_por_segundo"] > 0
+    assert set(resultado["etapas"]) >= {"ingesta", "validacion", "sobre", "envio", "log"}
+
+
+def test_comparar_marca_mejoras_y_empeoramientos():
+    anterior = {"filas_por_segundo": 100.0, "rss_pico_mb": 100.0, "latencia_http_ms": {"p50": 10.0}}
+    actual = {"filas_por_segundo": 150.0, "rss_pico_mb": 120.0, "latencia_http_ms": {"p50": 5.0}}
+    filas = {clave: (variacion, mejora) for clave, _, _, variacion, mejora in comparar(anterior, actual)}
+    assert filas == {
+        "filas_por_segundo": (50.0, True),
+        "rss_pico_mb": (20.0, False),
+        "latencia_http_ms.p50": (-50.0, True),
+    }
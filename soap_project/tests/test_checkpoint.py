@@ -0,0 +1,100 @@
+import csv
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.checkpoint import DiarioCheckpoint, hash_archivo
+from tests.conftest import crear_xlsx
+
+
+def test_hash_archivo_depende_del_contenido(tmp_path):
+    a = tmp_path / "a.xlsx"
+    b = tmp_path / "b.xlsx"
+    a.write_bytes(b"contenido")
+    b.write_bytes(b"contenido")
+    assert hash_archivo(a) == hash_archivo(b)
+    b.write_bytes(b"otro contenido")
+    assert hash_archivo(a) != hash_archivo(b)
+
+
+def test_diario_persiste_confirmaciones(tmp_path):
+    ruta = tmp_path / "checkpoint.sqlite"
+    with DiarioCheckpoint(ruta, filas_por_commit=2) as diario:
+        diario.confirmar("h1", 2)
+        diario.confirmar("h1", 3)
+        diario.confirmar("h1", 3) # Duplicado: se ignora
+        diario.confirmar("h2", 2)
+
+    with DiarioCheckpoint(ruta) as diario:
+        assert diario.lineas_confirmadas("h1") == {2, 3}
+        assert diario.lineas_confirmadas("h2") == {2}
+        assert diario.lineas_confirmadas("otro") == set()
+
+
+def test_diario_agrupa_commits(tmp_path):
+    ruta = tmp_path / "checkpoint.sqlite"
+    diario = DiarioCheckpoint(ruta, filas_por_commit=3, intervalo_commit=60)
+    try:
+        diario.confirmar("h", 2)
+        diario.confirmar("h", 3)
+        with DiarioCheckpoint(ruta) as otro:
+            assert otro.lineas_confirmadas("h") == set() # Aún sin commit
+        diario.confirmar("h", 4)
+        with DiarioCheckpoint(ruta) as otro:
+            assert otro.lineas_confirmadas("h") == {2, 3, 4}
+    finally:
+        diario.close()
+
+
+def test_diario_busqueda_con_muchas_entradas(tmp_path):
+    with DiarioCheckpoint(tmp_path / "checkpoint.sqlite", filas_por_commit=100_000) as diario:
+        for n in range(50):
+            for linea in range(2, 2002):
+                diario.confirmar(f"hash{n}", linea)
+        diario.commit()
+        plan = diario.conexion.execute(
+            "EXPLAIN QUERY PLAN SELECT linea_excel FROM filas_confirmadas WHERE hash_archivo = ?", ("hash7",)
+        ).fetchall()
+        assert "SEARCH" in plan[0][-1] # Búsqueda por índice, no recorrido completo
+        assert len(diario.lineas_confirmadas("hash7")) == 2000
+
+
+def _ejecutar(excel_dir, *extra):
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso", *extra]
+    with patch('sys.argv', argv):
+        batch_main()
+
+
+def test_main_resume_omite_filas_confirmadas(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "datos.xlsx", 5)
+
+    ok = MagicMock(status_code=200, text="ok")
+    with patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        # Primera ejecución: se cae la conexión en las filas 4 y 5 (líneas 5 y 6)
+        mock_enviar.side_effect = [ok, ok, ok, None, None]
+        _ejecutar(excel_dir)
+        assert mock_enviar.call_count == 5
+
+    with patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.return_value = ok
+        _ejecutar(excel_dir, "--resume")
+        assert mock_enviar.call_count == 2
+        assert [b"datos-0003" in c.args[1] for c in mock_enviar.call_args_list] == [True, False]
+
+    salida = capsys.readouterr().out
+    assert "Reanudando datos.xlsx: 3 filas ya confirmadas se omiten" in salida
+    assert "Filas omitidas por estar ya confirmadas (--resume): 3" in salida
+
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))
+    # El log de la primera ejecución se conserva y la reanudación se añade al final
+    assert [f[3] for f in filas_log[1:]] == ["OK", "OK", "OK", "ERROR_CONEXION", "ERROR_CONEXION", "OK", "OK"]
+
+
+def test_main_resume_incompatible_con_no_checkpoint(tmp_path):
+    with pytest.raises(SystemExit):
+        _ejecutar(tmp_path, "--resume", "--no-checkpoint")
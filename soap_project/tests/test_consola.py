@@ -0,0 +1,102 @@
+import io
+import logging
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.consola import ERROR, OK, OMITIDA, Progreso, configurar_consola, log
+from soap_batch.lectores import FILAS_ESTIMADAS, leer_por_bloques
+from tests.conftest import CABECERA, RelojFalso, crear_xlsx
+
+
+def test_progreso_redibuja_con_limite_de_frecuencia():
+    reloj = RelojFalso()
+    flujo = io.StringIO()
+    progreso = Progreso(flujo=flujo, linea=True, intervalo=1.0, intervalo_resumen=None, reloj=reloj)
+    progreso.inicio_archivo("a.xlsx", filas_estimadas=100)
+    for _ in range(50):
+        reloj.ahora += 0.1
+        progreso.fila("a.xlsx", OK)
+    progreso.fila("a.xlsx", ERROR)
+    progreso.fila("a.xlsx", OMITIDA, filas=2)
+
+    assert flujo.getvalue().count("\r") == 5 # Uno por segundo, no uno por fila
+    texto = progreso.texto()
+    assert "53 filas de ~100 (53%)" in texto
+    assert "11 filas/s" in texto # 53 filas en 5 s
+    assert "ETA 00:04" in texto
+    assert "a.xlsx: 50 OK, 1 con error, 2 omitidas" in texto
+
+
+def test_progreso_estima_por_bytes_los_archivos_sin_abrir(tmp_path):
+    (tmp_path / "a.csv").write_bytes(b"x" * 1000)
+    (tmp_path / "b.csv").write_bytes(b"x" * 3000)
+    progreso = Progreso(sorted(tmp_path.iterdir()), linea=False)
+    assert progreso.filas_totales_estimadas() is None
+    progreso.inicio_archivo("a.csv", filas_estimadas=10)
+    assert progreso.filas_totales_estimadas() == 40
+
+
+def test_progreso_resumen_periodico_y_desglose_por_archivo():
+    reloj = RelojFalso()
+    salida = io.StringIO()
+    configurar_consola(logging.INFO, salida)
+    with Progreso(linea=False, intervalo_resumen=10, reloj=reloj) as progreso:
+        progreso.inicio_archivo("a.xlsx")
+        for _ in range(30):
+            reloj.ahora += 1
+            progreso.fila("a.xlsx", OK)
+    texto = salida.getvalue()
+    assert texto.count("Progreso: ") == 3
+    assert "  a.xlsx: 30 OK, 0 con error, 0 omitidas" in texto
+
+
+def test_mensajes_borran_la_linea_de_progreso():
+    terminal = io.StringIO()
+    configurar_consola(logging.INFO, terminal)
+    with Progreso(flujo=terminal, linea=True, intervalo=0, intervalo_resumen=None, reloj=lambda: 1.0) as progreso:
+        progreso.fila("a.xlsx", OK)
+        log.info("mensaje")
+    assert terminal.getvalue().startswith("\r1 filas | 0 filas/s | ETA --:--\r" + " " * 31 + "\rmensaje\n")
+
+
+def test_mensajes_perezosos_no_se_formatean_sin_nivel():
+    configurar_consola(logging.INFO, io.StringIO())
+    argumento = MagicMock()
+    log.debug("fila %s", argumento)
+    argumento.__str__.assert_not_called()
+
+
+def test_lectores_anuncian_filas_estimadas(tmp_path):
+    xlsx = crear_xlsx(tmp_path / "a.xlsx", 7)
+    assert next(leer_por_bloques(xlsx, tamano_bloque=3)).attrs[FILAS_ESTIMADAS] == 7
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(pa.table({c: ["v"] * 5 for c in CABECERA}), tmp_path / "b.parquet")
+    assert next(leer_por_bloques(tmp_path / "b.parquet", tamano_bloque=2)).attrs[FILAS_ESTIMADAS] == 5
+
+
+@pytest.mark.parametrize("opcion, por_fila, por_archivo", [
+    ([], False, True),
+    (["-v"], True, True),
+    (["--quiet"], False, False),
+])
+def test_main_niveles_de_verbosidad(tmp_path, monkeypatch, capsys, opcion, por_fila, por_archivo):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", 4, nulos_en={1})
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--no-checkpoint", *opcion]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+        batch_main()
+
+    salida = capsys.readouterr().out
+    assert ("SUCCESS: Fila 2" in salida) == por_fila
+    assert ("WARNING: Fila 3 en a.xlsx omitida" in salida) == por_fila
+    assert ("Procesando archivo: a.xlsx" in salida) == por_archivo
+    assert ("  a.xlsx: 3 OK, 0 con error, 1 omitidas" in salida) == por_archivo
+    assert "Filas enviadas exitosamente: 3" in salida # El resumen final sale siempre
@@ -0,0 +1,193 @@
+import csv
+import sqlite3
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.deduplicacion import Deduplicador, FiltroBloom, IndiceDeduplicacion, clave_evento
+from soap_batch.ingesta import preparar_filas
+from tests.conftest import crear_xlsx
+
+
+def test_clave_evento_normaliza_y_excluye_tarjeta():
+    base = clave_evento(("MAD", "2023-01-01", "ABC123", "1A", "T1"))
+    assert len(base) == 16
+    assert clave_evento((" mad", "2023-01-01", "abc123 ", "1a", "OTRA")) == base
+    assert clave_evento(("MAD", "2023-01-02", "ABC123", "1A", "T1")) != base
+    assert clave_evento(("MAD", "2023-01-01", "ABC123", "2A", "T1")) != base
+
+
+def test_filtro_bloom_sin_falsos_negativos_y_tasa_acotada():
+    claves = [clave_evento(("MAD", "2023-01-01", f"P{i}", "1A", "")) for i in range(20000)]
+    bloom = FiltroBloom(10000)
+    for clave in claves[:10000]:
+        bloom.agregar(clave)
+    assert all(clave in bloom for clave in claves[:10000])
+    falsos = sum(clave in bloom for clave in claves[10000:])
+    assert falsos < 300 # 1 % esperado sobre 10000
+
+
+def test_indice_persiste_entre_aperturas(tmp_path):
+    ruta = tmp_path / "dedup.sqlite"
+    clave = clave_evento(("MAD", "2023-01-01", "P1", "1A", ""))
+    otra = clave_evento(("MAD", "2023-01-01", "P2", "1A", ""))
+    with IndiceDeduplicacion(ruta, filas_por_commit=100) as indice:
+        indice.agregar(clave)
+        assert clave in indice # Aún pendiente de commit
+        assert otra not in indice
+
+    with IndiceDeduplicacion(ruta, solo_lectura=True) as indice:
+        assert clave in indice
+        assert otra not in indice
+        with pytest.raises(ValueError):
+            indice.agregar(otra)
+
+
+def test_indice_reutiliza_el_filtro_guardado(tmp_path):
+    ruta = tmp_path / "dedup.sqlite"
+    claves = [clave_evento(("MAD", "2023-01-01", f"P{i}", "1A", "")) for i in range(3)]
+    with IndiceDeduplicacion(ruta) as indice:
+        for clave in claves[:2]:
+            indice.agregar(clave)
+    assert indice.ruta_bloom.exists()
+
+    # Filtro al día: se carga sin recorrer la tabla.
+    with patch.object(FiltroBloom, "agregar") as agregar, IndiceDeduplicacion(ruta, solo_lectura=True) as indice:
+        assert all(clave in indice for clave in claves[:2])
+        assert claves[2] not in indice
+    agregar.assert_not_called()
+
+    # Una alta que no pasó por el filtro (p. ej. una ejecución interrumpida): se reconstruye.
+    with sqlite3.connect(ruta) as conexion:
+        conexion.execute("INSERT INTO eventos_enviados VALUES (?, 0)", (claves[2],))
+    conexion.close()
+    with IndiceDeduplicacion(ruta, solo_lectura=True) as indice:
+        assert claves[2] in indice
+
+    # Un filtro ilegible también se descarta.
+    indice.ruta_bloom.write_bytes(b"roto")
+    with IndiceDeduplicacion(ruta, solo_lectura=True) as indice:
+        assert all(clave in indice for clave in claves)
+
+
+def test_indice_usa_el_filtro_recibido(tmp_path):
+    ruta = tmp_path / "dedup.sqlite"
+    clave = clave_evento(("MAD", "2023-01-01", "P1", "1A", ""))
+    with IndiceDeduplicacion(ruta) as indice:
+        indice.agregar(clave)
+        bloom = indice.bloom
+    with patch.object(IndiceDeduplicacion, "_leer_bloom") as leer, \
+            IndiceDeduplicacion(ruta, solo_lectura=True, bloom=bloom) as indice:
+        assert indice.bloom is bloom
+        assert clave in indice
+    leer.assert_not_called()
+
+
+def test_indice_solo_lectura_sin_fichero(tmp_path):
+    ruta = tmp_path / "no_existe.sqlite"
+    with IndiceDeduplicacion(ruta, solo_lectura=True) as indice:
+        assert clave_evento(("MAD", "2023-01-01", "P1", "1A", "")) not in indice
+    assert not ruta.exists()
+
+
+def test_deduplicador_ya_enviados(tmp_path):
+    clave_a = clave_evento(("MAD", "2023-01-01", "A", "1A", ""))
+    clave_b = clave_evento(("MAD", "2023-01-01", "B", "1A", ""))
+    with IndiceDeduplicacion(tmp_path / "dedup.sqlite") as indice:
+        indice.agregar(clave_a)
+        deduplicador = Deduplicador(indice)
+        assert deduplicador.motivo_duplicado(clave_a) == "Evento ya enviado en una ejecución anterior"
+        # Los repetidos dentro de la ejecución los decide la etapa de envío.
+        assert deduplicador.motivo_duplicado(clave_b) is None
+        assert deduplicador.motivo_duplicado(clave_b) is None
+
+
+def test_preparar_filas_descarta_duplicados_antes_de_construir(tmp_path):
+    df = pd.DataFrame([
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "P1", "ASIENTO": "1A", "TARJETA_FIDELIZACION": "T"},
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "p1", "ASIENTO": "1A", "TARJETA_FIDELIZACION": "X"},
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "P2", "ASIENTO": "1A", "TARJETA_FIDELIZACION": "T"},
+    ])
+    construidas = []
+
+    def construir(filas_valores):
+        construidas.extend(filas_valores)
+        return [b"x" for _ in construidas]
+
+    with IndiceDeduplicacion(tmp_path / "dedup.sqlite") as indice, \
+            patch('soap_batch.ingesta.construir_cuerpos_soap', side_effect=construir):
+        indice.agregar(clave_evento(("MAD", "2023-01-01", "P2", "1A", "")))
+        filas = list(preparar_filas(df, "a.xlsx", deduplicador=Deduplicador(indice)))
+
+    assert [f.resultado for f in filas] == [None, None, "DUPLICADO"]
+    assert filas[2].cuerpo_soap is None and filas[2].pnr == "P2"
+    assert filas[0].clave == filas[1].clave is not None # La repetición conserva su propio sobre
+    assert [valores[2] for valores in construidas] == ["P1", "p1"]
+
+
+@pytest.mark.parametrize("parse_workers", ["1", "2"])
+def test_main_dedup_entre_archivos_y_ejecuciones(tmp_path, monkeypatch, capsys, parse_workers):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", ["P1", "P2", "P3", "P1"])
+    crear_xlsx(excel_dir / "b.xlsx", ["P3", "P4"])
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--dedup", "--no-checkpoint", "-v", "--parse-workers", parse_workers]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+        batch_main()
+
+    salida = capsys.readouterr().out
+    assert mock_enviar.call_count == 4
+    assert "Filas enviadas exitosamente: 4" in salida
+    assert "Filas omitidas por ser eventos duplicados (--dedup): 2" in salida
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    assert sorted((f[0], f[1]) for f in filas_log if f[3] == "DUPLICADO") in (
+        [("a.xlsx", "5"), ("b.xlsx", "2")], # a.xlsx se procesa antes
+        [("a.xlsx", "4"), ("a.xlsx", "5")], # en paralelo, b.xlsx puede llegar antes
+    )
+
+    # Segunda ejecución con un archivo nuevo: solo se envía el evento que falta
+    crear_xlsx(excel_dir / "c.xlsx", ["P4", "P5"])
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+        batch_main()
+
+    salida = capsys.readouterr().out
+    assert mock_enviar.call_count == 1
+    assert "Filas omitidas por ser eventos duplicados (--dedup): 7" in salida
+    assert "Evento ya enviado en una ejecución anterior" in salida
+
+
+@pytest.mark.parametrize("opciones", [["--parse-workers", "1"], ["--parse-workers", "2"],
+                                      ["--events-per-request", "2"], ["--concurrency", "4"],
+                                      ["--concurrency", "4", "--events-per-request", "2"]])
+def test_main_dedup_reenvia_la_repeticion_si_falla_la_primera_copia(tmp_path, monkeypatch, opciones):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", ["P1", "P2", "P1", "P1"])
+
+    def enviar(endpoint, cuerpo, transporte=None):
+        # La primera solicitud falla; con --events-per-request 2 lleva P1 y P2.
+        return MagicMock(status_code=500 if mock_enviar.call_count == 1 else 200, text="ok")
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--dedup", "--no-checkpoint", *opciones]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.side_effect = enviar
+        batch_main()
+
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    resultados = {int(f[1]): f[3] for f in filas_log}
+    # La primera copia de P1 falla: la siguiente se envía y, confirmada, la última se descarta.
+    assert resultados[2] == "ERROR_HTTP"
+    assert (resultados[4], resultados[5]) == ("OK", "DUPLICADO")
+    with IndiceDeduplicacion(tmp_path / "soap_dedup.sqlite", solo_lectura=True) as indice:
+        assert clave_evento(("MAD", "2023-01-01", "P1", "1A", "TF")) in indice
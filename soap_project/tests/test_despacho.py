@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+
+import pytest
+
+from soap_batch.batch_soap_sender import enviar_solicitud_soap
+from soap_batch.despacho import BARRERA, ELEMENTOS_POR_LLAMADA, despachar_en_orden
+from benchmarks.servidor_soap import ServidorSOAPStub
+
+
+@pytest.mark.parametrize("concurrencia", [1, 4])
+def test_despachar_en_orden_mantiene_orden_de_entrada(concurrencia):
+    def lenta(n):
+        time.sleep(random.uniform(0, 0.01))
+        return n * 10
+
+    resultados = list(despachar_en_orden(range(20), lenta, concurrencia=concurrencia))
+    assert [r[0] for r in resultados] == list(range(20))
+    assert [r[1] for r in resultados] == [n * 10 for n in range(20)]
+    assert all(r[2] is None for r in resultados)
+
+
+def test_despachar_en_orden_respeta_limite_en_vuelo():
+    bloqueo = threading.Lock()
+    en_vuelo = 0
+    maximo = 0
+
+    def funcion(n):
+        nonlocal en_vuelo, maximo
+        with bloqueo:
+            en_vuelo += 1
+            maximo = max(maximo, en_vuelo)
+        time.sleep(0.005)
+        with bloqueo:
+            en_vuelo -= 1
+        return n
+
+    list(despachar_en_orden(range(30), funcion, concurrencia=3))
+    assert maximo <= 3
+
+
+def test_despachar_en_orden_filtro_y_excepciones():
+    def funcion(n):
+        if n == 3:
+            raise ValueError("fallo")
+        return n
+
+    resultados = list(despachar_en_orden(range(6), funcion, concurrencia=2, filtro=lambda n: n % 2 == 1))
+    assert [r[0] for r in resultados] == list(range(6))
+    assert resultados[0] == (0, None, None) # Filtrado: no se llama a la función
+    assert resultados[1] == (1, 1, None)
+    assert isinstance(resultados[3][2], ValueError)
+
+
+def test_despachar_en_orden_acota_la_ventana_con_elementos_filtrados():
+    liberar = threading.Event()
+    pedidos = []
+
+    def elementos():
+        for n in range(1000):
+            pedidos.append(n)
+            yield n
+
+    def funcion(n):
+        liberar.wait(5) # La primera petición tarda mientras llegan elementos filtrados
+        return n
+
+    resultados = despachar_en_orden(elementos(), funcion, concurrencia=2, filtro=lambda n: n == 0)
+    hilo = threading.Thread(target=lambda: next(resultados))
+    hilo.start()
+    time.sleep(0.2)
+    assert len(pedidos) == 2 * ELEMENTOS_POR_LLAMADA # No sigue leyendo con la cabeza en vuelo
+    liberar.set()
+    hilo.join()
+    assert [r[0] for r in resultados] == list(range(1, 1000))
+
+
+def test_despachar_en_orden_barrera_espera_a_lo_que_esta_en_vuelo():
+    terminadas = []
+
+    def funcion(n):
+        time.sleep(0.01)
+        terminadas.append(n)
+        return n
+
+    def elementos():
+        yield from (0, 1, 2)
+        yield BARRERA
+        assert sorted(terminadas) == [0, 1, 2] # Tras la BARRERA ya no queda nada en vuelo
+        yield 3
+
+    resultados = list(despachar_en_orden(elementos(), funcion, concurrencia=4))
+    assert [r[0] for r in resultados] == [0, 1, 2, 3]
+
+
+def test_throughput_escala_con_concurrencia_contra_stub():
+    filas = 16
+    with ServidorSOAPStub(latencia=0.05) as servidor:
+        tiempos = {}
+        for concurrencia in (1, 8):
+            inicio = time.perf_counter()
+            resultados = list(despachar_en_orden(
+                range(filas),
+                lambda _: enviar_solicitud_soap(servidor.url, "<soap/>"),
+                concurrencia=concurrencia,
+            ))
+            tiempos[concurrencia] = time.perf_counter() - inicio
+            assert all(r[1] is not None and r[1].status_code == 200 for r in resultados)
+        assert servidor.peticiones == 2 * filas
+
+    # Con 8 peticiones en vuelo el lote debe tardar claramente menos que en serie.
+    assert tiempos[8] * 3 < tiempos[1]
@@ -0,0 +1,146 @@
+import csv
+import threading
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.ingesta import (
+    ArchivoDescartado,
+    InicioArchivo,
+    eventos_archivo,
+    ingerir_en_paralelo,
+    ingerir_en_serie,
+    listar_archivos,
+    preparar_filas,
+)
+from soap_batch.pipeline import ingerir_por_etapas
+from tests.conftest import CABECERA, crear_xlsx
+
+
+def test_listar_archivos_xlsx_antes_que_xls(tmp_path):
+    for nombre in ["b.xls", "a.xlsx", "c.txt"]:
+        (tmp_path / nombre).touch()
+    assert [r.name for r in listar_archivos(tmp_path)] == ["a.xlsx", "b.xls"]
+
+
+def test_listar_archivos_incluye_csv_y_parquet(tmp_path):
+    for nombre in ["d.parquet", "c.csv", "a.xlsx", "e.txt"]:
+        (tmp_path / nombre).touch()
+    assert [r.name for r in listar_archivos(tmp_path)] == ["a.xlsx", "c.csv", "d.parquet"]
+
+
+def test_preparar_filas_construye_cuerpos_y_omite_nulos():
+    df = pd.DataFrame([
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "P1", "ASIENTO": "1A", "TARJETA_FIDELIZACION": "T"},
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "P2", "ASIENTO": None, "TARJETA_FIDELIZACION": "T"},
+    ])
+    filas = list(preparar_filas(df, "a.xlsx", "h"))
+    assert filas[0].pnr == "P1" and b"<pnr>P1</pnr>" in filas[0].cuerpo_soap
+    assert filas[0].nombre_archivo == "a.xlsx" and filas[0].hash_archivo == "h"
+    assert filas[1].resultado == "OMITIDO_NULOS" and filas[1].cuerpo_soap is None
+
+
+def test_eventos_archivo_cabecera_incorrecta(tmp_path):
+    ruta = crear_xlsx(tmp_path / "malo.xlsx", 3, cabecera=["CDIAPTO", "PNR_CODE"])
+    eventos = list(eventos_archivo(ruta))
+    assert eventos[0] == InicioArchivo("malo.xlsx", 0, 3)
+    assert isinstance(eventos[1], ArchivoDescartado)
+    assert eventos[1].resultado == "OMITIDO_CABECERA" and eventos[1].filas == 3
+
+
+def test_eventos_archivo_error_de_lectura(tmp_path):
+    ruta = tmp_path / "roto.xlsx"
+    ruta.write_bytes(b"no es un excel")
+    eventos = list(eventos_archivo(ruta))
+    assert len(eventos) == 1
+    assert eventos[0].resultado == "ERROR_LECTURA_PROCESO_ARCHIVO"
+
+
+def test_ingerir_en_paralelo_conserva_orden_por_archivo(tmp_path):
+    rutas = [crear_xlsx(tmp_path / f"f{n}.xlsx", 40) for n in range(3)]
+    # Cola de un solo lote: los procesos se bloquean hasta que el consumidor avanza
+    eventos = list(ingerir_en_paralelo(rutas, trabajadores=2, lotes_en_cola=1, tamano_bloque=7))
+
+    esperados = list(ingerir_en_serie(rutas, tamano_bloque=7))
+    assert sorted(eventos) == sorted(esperados)
+    for ruta in rutas:
+        del_archivo = [e for e in eventos if e.nombre_archivo == ruta.name]
+        assert isinstance(del_archivo[0], InicioArchivo)
+        assert [e.linea_excel for e in del_archivo[1:]] == list(range(2, 42))
+
+
+def _cerrar_a_mitad(eventos, n):
+    # Consume `n` eventos y cierra el generador en otro hilo; devuelve si terminó a tiempo.
+    def consumir():
+        for _ in range(n):
+            next(eventos)
+        eventos.close()
+    hilo = threading.Thread(target=consumir, daemon=True)
+    hilo.start()
+    hilo.join(60)
+    return not hilo.is_alive()
+
+
+def test_ingerir_en_paralelo_cerrar_a_mitad_no_bloquea(tmp_path):
+    # Con la cola llena los procesos esperan en su put: al abandonar, el consumidor
+    # debe pedirles parar y vaciar la cola en lugar de esperar al pool indefinidamente.
+    rutas = [crear_xlsx(tmp_path / f"f{n}.xlsx", 300) for n in range(3)]
+    assert _cerrar_a_mitad(ingerir_en_paralelo(rutas, trabajadores=2, lotes_en_cola=1, tamano_bloque=5), 50)
+    assert _cerrar_a_mitad(ingerir_por_etapas(rutas, trabajadores=2, tamano_bloque=5), 50)
+
+
+def test_main_parse_workers_combina_contadores(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", 30, nulos_en={5})
+    crear_xlsx(excel_dir / "b.xlsx", 20)
+    crear_xlsx(excel_dir / "c.xlsx", 10, cabecera=["CDIAPTO"])
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--parse-workers", "3", "--chunk-size", "4", "--concurrency", "4"]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+        batch_main()
+
+    salida = capsys.readouterr().out
+    assert mock_enviar.call_count == 49
+    assert "Total de archivos procesados (o intentados): 3" in salida
+    assert "Total de filas leídas de los archivos: 60" in salida
+    assert "Filas enviadas exitosamente: 49" in salida
+    assert "Filas omitidas (archivo con cabecera incorrecta, o fila con datos nulos/faltantes): 11" in salida
+
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    assert [int(f[1]) for f in filas_log if f[0] == "a.xlsx"] == list(range(2, 32))
+    assert [int(f[1]) for f in filas_log if f[0] == "b.xlsx"] == list(range(2, 22))
+    assert [f[3] for f in filas_log if f[0] == "c.xlsx"] == ["OMITIDO_CABECERA"]
+
+
+@pytest.mark.parametrize("parse_workers", ["1", "2"])
+def test_main_csv_y_cache_excel(tmp_path, monkeypatch, capsys, parse_workers):
+    pytest.importorskip("pyarrow")
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", 5)
+    (excel_dir / "b.csv").write_text(",".join(CABECERA) + "\nMAD,2023-01-01,B-0000,,TF\nMAD,2023-01-01,B-0001,2B,TF\n",
+                                     encoding="utf-8")
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--no-checkpoint", "--excel-cache", str(tmp_path / "cache"), "--parse-workers", parse_workers]
+    for _ in range(2): # La segunda pasada lee a.xlsx de la caché
+        with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+            mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+            batch_main()
+        salida = capsys.readouterr().out
+        assert mock_enviar.call_count == 6
+        assert "Filas omitidas (archivo con cabecera incorrecta, o fila con datos nulos/faltantes): 1" in salida
+    assert len(list((tmp_path / "cache").glob("*.parquet"))) == 1
+
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    assert [(f[0], f[1], f[3]) for f in filas_log if f[0] == "b.csv"] == [("b.csv", "2", "OMITIDO_NULOS"),
+                                                                         ("b.csv", "3", "OK")]
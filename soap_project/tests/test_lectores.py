@@ -0,0 +1,245 @@
+import datetime
+import functools
+from types import SimpleNamespace
+
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+import xlrd
+
+from soap_batch.checkpoint import hash_archivo
+from soap_batch.ingesta import ArchivoDescartado, eventos_archivo
+from soap_batch.lectores import (
+    LECTORES,
+    _valor_celda_xls,
+    leer_arrow_por_bloques,
+    leer_csv_por_bloques,
+    leer_excel_por_bloques,
+    leer_parquet_por_bloques,
+    leer_por_bloques,
+    registrar_lector,
+)
+from tests.conftest import CABECERA, crear_libro
+
+
+def test_leer_excel_por_bloques_divide_y_conserva_lineas(tmp_path):
+    filas = [["MAD", datetime.datetime(2023, 1, i + 1), f"PNR{i}", "1A", "TF"] for i in range(7)]
+    ruta = crear_libro(tmp_path / "datos.xlsx", filas)
+
+    bloques = list(leer_excel_por_bloques(ruta, tamano_bloque=3))
+
+    assert [len(b) for b in bloques] == [3, 3, 1]
+    assert list(bloques[0].columns) == CABECERA
+    assert list(bloques[1].index) == [3, 4, 5] # indice + 2 == línea del Excel
+    assert bloques[2].loc[6, "PNR_CODE"] == "PNR6"
+
+
+def test_leer_excel_por_bloques_equivale_a_read_excel(tmp_path):
+    filas = [
+        ["MAD", datetime.datetime(2023, 1, 1), "PNR1", "1A", 123],
+        [None, None, None, None, None], # Fila vacía intermedia: se conserva
+        ["BCN", "2023-01-02", "PNR2", None, "TF2"],
+        ["VAL", "2023-01-03", "PNR3", "3C"], # Fila corta
+        [None, None, None, None, None], # Filas vacías finales: se descartan
+        [None, None, None, None, None],
+    ]
+    ruta = crear_libro(tmp_path / "datos.xlsx", filas)
+
+    esperado = pd.read_excel(ruta, sheet_name=0, engine="openpyxl")
+    obtenido = pd.concat(list(leer_excel_por_bloques(ruta, tamano_bloque=2)))
+
+    assert list(obtenido.index) == list(esperado.index)
+    assert list(obtenido.columns) == list(esperado.columns)
+    assert obtenido.isnull().values.tolist() == esperado.isnull().values.tolist()
+    assert obtenido.loc[0, "TARJETA_FIDELIZACION"] == 123
+    assert pd.Timestamp(obtenido.loc[0, "FECHA_EVENTO"]) == pd.Timestamp("2023-01-01")
+
+
+def test_leer_excel_por_bloques_sin_filas_entrega_cabecera(tmp_path):
+    ruta = crear_libro(tmp_path / "vacio.xlsx", [], cabecera=["CDIAPTO", None, "PNR_CODE"])
+
+    bloques = list(leer_excel_por_bloques(ruta))
+
+    assert len(bloques) == 1
+    assert bloques[0].empty
+    assert list(bloques[0].columns) == ["CDIAPTO", "Unnamed: 1", "PNR_CODE"]
+
+
+def test_leer_excel_por_bloques_es_perezoso(tmp_path):
+    filas = [["MAD", "2023-01-01", f"PNR{i}", "1A", "TF"] for i in range(50)]
+    ruta = crear_libro(tmp_path / "datos.xlsx", filas)
+
+    bloques = leer_excel_por_bloques(ruta, tamano_bloque=10)
+    primero = next(bloques)
+    assert len(primero) == 10
+    bloques.close() # Abandonar a mitad debe cerrar el libro sin errores
+
+
+def test_leer_excel_por_bloques_extension_no_soportada(tmp_path):
+    with pytest.raises(ValueError):
+        next(leer_excel_por_bloques(tmp_path / "datos.ods"))
+
+
+def test_valor_celda_xls_convierte_como_pandas():
+    assert _valor_celda_xls(SimpleNamespace(ctype=xlrd.XL_CELL_EMPTY, value=""), 0) is None
+    assert _valor_celda_xls(SimpleNamespace(ctype=xlrd.XL_CELL_NUMBER, value=12.0), 0) == 12
+    assert isinstance(_valor_celda_xls(SimpleNamespace(ctype=xlrd.XL_CELL_NUMBER, value=12.0), 0), int)
+    assert _valor_celda_xls(SimpleNamespace(ctype=xlrd.XL_CELL_NUMBER, value=1.5), 0) == 1.5
+    assert _valor_celda_xls(SimpleNamespace(ctype=xlrd.XL_CELL_TEXT, value="MAD"), 0) == "MAD"
+    assert _valor_celda_xls(SimpleNamespace(ctype=xlrd.XL_CELL_DATE, value=45292.0), 0) == datetime.datetime(2024, 1, 1)
+
+
+@pytest.mark.parametrize("tamano_bloque", [1, 2, 3, 1000])
+def test_leer_excel_tipos_de_celda_no_dependen_del_bloque(tmp_path, tamano_bloque):
+    # Un nulo (o una fila vacía intermedia) en el bloque no debe convertir los enteros en
+    # float: el sobre enviado para una celda es el mismo con cualquier --chunk-size.
+    filas = [
+        ["MAD", "2023-01-01", "PNR1", 12, 123456],
+        ["BCN", "2023-01-01", "PNR2", 13, None],
+        [None] * 5,
+        ["VAL", "2023-01-01", "PNR3", 14, 654321],
+    ]
+    ruta = crear_libro(tmp_path / "enteros.xlsx", filas)
+    enviados = {linea: cuerpo for linea, resultado, cuerpo in
+                ((e.linea_excel, e.resultado, e.cuerpo_soap)
+                 for e in eventos_archivo(ruta, tamano_bloque=tamano_bloque) if hasattr(e, "linea_excel"))
+                if resultado is None}
+    assert sorted(enviados) == [2, 5]
+    assert b"<asiento>12</asiento>" in enviados[2]
+    assert b"<tarjetaFidelizacion>123456</tarjetaFidelizacion>" in enviados[2]
+    assert b"<tarjetaFidelizacion>654321</tarjetaFidelizacion>" in enviados[5]
+
+
+def _cuerpos(ruta, **opciones):
+    return [(e.linea_excel, e.resultado, e.cuerpo_soap) for e in eventos_archivo(ruta, tamano_bloque=2, **opciones)
+            if hasattr(e, "linea_excel")]
+
+
+FILAS_FORMATOS = [
+    ["MAD", "2023-01-01", "PNR1", "1A", "TF1"],
+    ["BCN", "02/01/2023", "PNR2", None, "TF2"],
+    ["VAL", "2023-01-03", "PNR3", "010", "TF3"],
+]
+
+
+def test_leer_csv_por_bloques_proyecta_columnas_y_conserva_texto(tmp_path):
+    ruta = tmp_path / "datos.csv"
+    ruta.write_text("EXTRA," + ",".join(CABECERA) + "\n"
+                    + "".join("x," + ",".join(v or "" for v in fila) + "\n" for fila in FILAS_FORMATOS),
+                    encoding="utf-8-sig")
+
+    bloques = list(leer_csv_por_bloques(ruta, tamano_bloque=2))
+
+    assert [len(b) for b in bloques] == [2, 1]
+    assert list(bloques[0].columns) == CABECERA
+    assert list(bloques[1].index) == [2]
+    assert bloques[1].loc[2, "ASIENTO"] == "010"
+    assert bloques[0]["ASIENTO"].isnull().tolist() == [False, True]
+
+
+def test_leer_csv_solo_cabecera(tmp_path):
+    ruta = tmp_path / "vacio.csv"
+    ruta.write_text("CDIAPTO,PNR_CODE\n", encoding="utf-8")
+    bloques = list(leer_csv_por_bloques(ruta))
+    assert len(bloques) == 1 and bloques[0].empty
+    assert list(bloques[0].columns) == ["CDIAPTO", "PNR_CODE"]
+
+
+def test_csv_sin_columnas_esperadas_cuenta_sus_filas(tmp_path):
+    ruta = tmp_path / "otro.csv"
+    ruta.write_text("A,B\n1,2\n3,4\n", encoding="utf-8")
+    descartado = list(eventos_archivo(ruta))[-1]
+    assert isinstance(descartado, ArchivoDescartado)
+    assert descartado.filas == 2
+
+
+def test_parquet_y_arrow_por_bloques_con_proyeccion(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    tabla = pa.table({"EXTRA": ["x"] * 5, **{columna: [f"{columna}{i}" for i in range(5)] for columna in CABECERA}})
+    pyarrow.parquet.write_table(tabla, tmp_path / "datos.parquet", row_group_size=3)
+    pyarrow.feather.write_feather(tabla, tmp_path / "datos.feather", chunksize=3)
+
+    for lector, nombre in [(leer_parquet_por_bloques, "datos.parquet"), (leer_arrow_por_bloques, "datos.feather")]:
+        bloques = list(lector(tmp_path / nombre, tamano_bloque=2))
+        assert sum(len(b) for b in bloques) == 5
+        assert all(len(b) <= 2 for b in bloques)
+        assert "EXTRA" not in bloques[0].columns
+        assert pd.concat(bloques).index.tolist() == [0, 1, 2, 3, 4]
+        assert pd.concat(bloques).loc[4, "PNR_CODE"] == "PNR_CODE4"
+
+
+def test_todos_los_formatos_comparten_validacion(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    xlsx = crear_libro(tmp_path / "datos.xlsx", FILAS_FORMATOS)
+    csv_ = tmp_path / "datos.csv"
+    csv_.write_text(",".join(CABECERA) + "\n" + "".join(",".join(v or "" for v in f) + "\n" for f in FILAS_FORMATOS))
+    parquet = tmp_path / "datos.parquet"
+    pyarrow.parquet.write_table(pa.table({c: [f[i] for f in FILAS_FORMATOS] for i, c in enumerate(CABECERA)}), parquet)
+
+    esperado = _cuerpos(xlsx)
+    assert [resultado for _, resultado, _ in esperado] == [None, "OMITIDO_NULOS", None]
+    assert _cuerpos(csv_) == esperado
+    assert _cuerpos(parquet) == esperado
+
+
+def test_registro_de_lectores_por_extension(tmp_path):
+    ruta = tmp_path / "datos.txt"
+    ruta.touch()
+    with pytest.raises(ValueError):
+        leer_por_bloques(ruta)
+
+    with patch.dict(LECTORES):
+        registrar_lector(".TXT", lambda ruta, tamano_bloque: iter([pd.DataFrame(columns=CABECERA)]))
+        assert list(next(leer_por_bloques(ruta)).columns) == CABECERA
+
+
+def test_cache_parquet_de_excel_evita_reparsear(tmp_path):
+    pytest.importorskip("pyarrow")
+    filas = [["MAD", datetime.datetime(2023, 1, i + 1), f"PNR{i}", i if i % 2 else "1A", "TF"] for i in range(5)]
+    filas.append(["BCN", "05/02/2023", "PNR5", None, "TF"])
+    xlsx = crear_libro(tmp_path / "datos.xlsx", filas)
+    cache = tmp_path / "cache"
+    sin_cache = _cuerpos(xlsx)
+
+    assert _cuerpos(xlsx, lector=lambda ruta, tamano_bloque: leer_por_bloques(ruta, tamano_bloque, cache)) == sin_cache
+    assert len(list(cache.glob("*.parquet"))) == 1
+    assert not list(cache.glob("*.tmp"))
+
+    with patch("soap_batch.lectores.leer_excel_por_bloques", side_effect=AssertionError("no debe parsear")):
+        con_cache = _cuerpos(xlsx, lector=lambda ruta, tamano_bloque: leer_por_bloques(ruta, tamano_bloque, cache))
+    assert con_cache == sin_cache
+
+
+@pytest.mark.parametrize("con_cache_previa", [False, True])
+def test_cache_parquet_calcula_el_hash_una_vez(tmp_path, con_cache_previa):
+    pytest.importorskip("pyarrow")
+    xlsx = crear_libro(tmp_path / "datos.xlsx", [["MAD", "2023-01-01", f"P{i}", "1A", "TF"] for i in range(5)])
+    cache = tmp_path / "cache"
+    lector = functools.partial(leer_por_bloques, directorio_cache=cache)
+    if con_cache_previa:
+        list(lector(xlsx))
+
+    with patch("soap_batch.lectores.hash_archivo", wraps=hash_archivo) as hash_lector, \
+            patch("soap_batch.ingesta.hash_archivo", wraps=hash_archivo) as hash_ingesta:
+        filas = [e for e in eventos_archivo(xlsx, lector=lector, ruta_checkpoint=tmp_path / "checkpoint")
+                 if hasattr(e, "linea_excel")]
+
+    assert hash_lector.call_count + hash_ingesta.call_count == 1
+    assert {fila.hash_archivo for fila in filas} == {hash_archivo(xlsx)}
+
+
+def test_cache_parquet_incompleta_no_se_guarda(tmp_path):
+    pytest.importorskip("pyarrow")
+    xlsx = crear_libro(tmp_path / "datos.xlsx", [["MAD", "2023-01-01", f"P{i}", "1A", "TF"] for i in range(10)])
+    cache = tmp_path / "cache"
+
+    bloques = leer_por_bloques(xlsx, tamano_bloque=3, directorio_cache=cache)
+    next(bloques)
+    bloques.close()
+    assert list(cache.iterdir()) == []
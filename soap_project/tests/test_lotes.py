@@ -0,0 +1,119 @@
+import csv
+from unittest.mock import MagicMock, patch
+
+from benchmarks.servidor_soap import RESPUESTA_FAULT, RESPUESTA_OK, ServidorSOAPStub, fault_eventos
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.ingesta import FilaPreparada, InicioArchivo
+from soap_batch.lotes import FalloEvento, LoteEventos, agrupar_en_lotes, desagrupar_resultados
+from soap_batch.politica_envio import ResultadoEnvio
+from soap_batch.sobre_soap import construir_cuerpo_soap
+from tests.conftest import crear_xlsx
+
+
+def _fila(linea, asiento="1A"):
+    cuerpo = construir_cuerpo_soap(("MAD", "2023-01-01", f"P{linea}", asiento, "T"))
+    return FilaPreparada("a.xlsx", linea, f"P{linea}", cuerpo, None, None, None)
+
+
+def _omitida(linea):
+    return FilaPreparada("a.xlsx", linea, None, None, "OMITIDO_NULOS", "nulos", None)
+
+
+def test_agrupar_respeta_tamano_de_lote_y_orden():
+    eventos = [InicioArchivo("a.xlsx", 0), _fila(2), _omitida(3), _fila(4), _omitida(5), _fila(6), _fila(7),
+               _fila(8)]
+    salida = list(agrupar_en_lotes(eventos, eventos_por_solicitud=2))
+
+    assert salida[0] == eventos[0]
+    assert isinstance(salida[1], LoteEventos) and salida[1].eventos == eventos[1:4]
+    assert salida[2] == eventos[4] # Entre lotes, los eventos no enviables pasan tal cual
+    assert isinstance(salida[3], LoteEventos) and salida[3].eventos == eventos[5:7]
+    assert isinstance(salida[4], LoteEventos) and salida[4].eventos == [eventos[7]]
+    assert salida[1].cuerpo_soap.count(b"<ns2:EventoPNR") == 2
+
+
+def test_agrupar_no_retiene_eventos_no_enviables_sin_limite():
+    eventos = [_fila(2)] + [_omitida(linea) for linea in range(3, 103)] + [_fila(103)]
+    salida = list(agrupar_en_lotes(eventos, eventos_por_solicitud=2))
+
+    # Con el lote abierto solo se retienen 4 no enviables por fila admitida: después se
+    # envía incompleto y el resto pasa tal cual.
+    assert isinstance(salida[0], LoteEventos) and salida[0].eventos == eventos[:9]
+    assert salida[1:-1] == eventos[9:-1]
+    assert isinstance(salida[-1], LoteEventos) and salida[-1].filas == [eventos[-1]]
+
+
+def test_agrupar_respeta_max_bytes():
+    filas = [_fila(linea) for linea in range(2, 8)]
+    un_evento = len(LoteEventos([filas[0]]).cuerpo_soap)
+    dos_eventos = len(LoteEventos(filas[:2]).cuerpo_soap)
+
+    lotes = list(agrupar_en_lotes(filas, eventos_por_solicitud=10, max_bytes=dos_eventos))
+    assert [len(lote.filas) for lote in lotes] == [2, 2, 2]
+    assert all(len(lote.cuerpo_soap) <= dos_eventos for lote in lotes)
+
+    # Una fila que por sí sola supera el máximo viaja sola
+    lotes = list(agrupar_en_lotes(filas[:2], eventos_por_solicitud=10, max_bytes=un_evento - 1))
+    assert [len(lote.filas) for lote in lotes] == [1, 1]
+
+
+def test_resultados_por_fila_mapea_fallos_por_evento():
+    lote = LoteEventos([_fila(2), _fila(3), _fila(4)])
+    response = MagicMock(status_code=200, content=fault_eventos([2]))
+
+    resultados = lote.resultados_por_fila(ResultadoEnvio(response, 1))
+
+    assert resultados[0] == ResultadoEnvio(response, 1)
+    assert resultados[1] == ResultadoEnvio(FalloEvento(200, "soap12:Sender: Evento 2 rechazado (simulado)"), 1)
+    assert resultados[2] == ResultadoEnvio(response, 1)
+
+
+def test_resultados_por_fila_sobre_completo():
+    lote = LoteEventos([_fila(2), _fila(3)])
+    ok = MagicMock(status_code=200, content=RESPUESTA_OK)
+    error = MagicMock(status_code=500, content=RESPUESTA_FAULT)
+
+    assert lote.resultados_por_fila(ResultadoEnvio(ok, 0)) == [ResultadoEnvio(ok, 0)] * 2
+    assert lote.resultados_por_fila(ResultadoEnvio(error, 0)) == [ResultadoEnvio(error, 0)] * 2
+    assert lote.resultados_por_fila(ResultadoEnvio(None, 2)) == [ResultadoEnvio(None, 2)] * 2
+
+
+def test_desagrupar_devuelve_los_eventos_originales():
+    eventos = [_fila(2), _omitida(3), _fila(4)]
+    lote = LoteEventos(eventos)
+    ok = MagicMock(status_code=200, content=RESPUESTA_OK)
+
+    salida = list(desagrupar_resultados([(lote, ResultadoEnvio(ok, 0), None)]))
+    assert [e for e, _, _ in salida] == eventos
+    assert [r for _, r, _ in salida] == [ResultadoEnvio(ok, 0), None, ResultadoEnvio(ok, 0)]
+
+    fallo = RuntimeError("x")
+    salida = list(desagrupar_resultados([(lote, None, fallo)]))
+    assert [err for _, _, err in salida] == [fallo, None, fallo]
+
+
+def test_main_events_per_request_contra_servidor(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "datos.xlsx", 23, nulos_en={4})
+
+    with ServidorSOAPStub(tasa_errores=0.2, semilla=7) as servidor:
+        argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", servidor.url,
+                "--events-per-request", "5", "--concurrency", "2", "--no-checkpoint"]
+        with patch('sys.argv', argv):
+            batch_main()
+
+    salida = capsys.readouterr().out
+    assert servidor.peticiones == 5 # 22 filas válidas en sobres de 5
+    assert servidor.eventos == 22
+    assert 0 < servidor.errores < 22
+    assert f"Filas enviadas exitosamente: {22 - servidor.errores}" in salida
+
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    assert [int(f[1]) for f in filas_log] == list(range(2, 25))
+    resultados = [f[3] for f in filas_log]
+    assert resultados[4] == "OMITIDO_NULOS"
+    assert resultados.count("ERROR_SOAP") == servidor.errores
+    assert all(f[2] == "200" for f in filas_log if f[3] in ("OK", "ERROR_SOAP"))
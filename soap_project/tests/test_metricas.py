@@ -0,0 +1,153 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.ingesta import eventos_archivo
+from soap_batch.metricas import Metricas, TiemposArchivo, TiemposEtapas, percentil
+from tests.conftest import RelojFalso, crear_xlsx
+
+
+def test_percentil_rango_mas_cercano():
+    valores = list(range(1, 101))
+    assert percentil(valores, 50) == 50
+    assert percentil(valores, 95) == 95
+    assert percentil(valores, 99) == 99
+    assert percentil([7], 99) == 7
+    assert percentil([], 50) is None
+
+
+def test_tiempos_etapas_fusiona_y_ordena_por_pipeline():
+    a = TiemposEtapas()
+    a.sumar("sobre", 0.5)
+    a.sumar("ingesta", 1.0)
+    b = TiemposEtapas()
+    b.sumar("ingesta", 2.0, llamadas=3)
+    a.fusionar(b)
+    assert a.como_dict() == {
+        "ingesta": {"llamadas": 4, "segundos": 3.0},
+        "sobre": {"llamadas": 1, "segundos": 0.5},
+    }
+
+
+def test_resumen_latencias_bytes_y_serie():
+    reloj = RelojFalso()
+    metricas = Metricas(reloj=reloj)
+    for ms in range(1, 101):
+        metricas.registrar_envio(ms / 1000, 10, MagicMock(status_code=200))
+    metricas.registrar_envio(0.5, 10, None)
+    metricas.fila_completada()
+    reloj.ahora = 1.5
+    metricas.fila_completada()
+    metricas.fila_completada()
+    reloj.ahora = 2.0
+    metricas.finalizar()
+
+    resumen = metricas.resumen()
+    assert resumen["bytes_enviados"] == 1010
+    assert resumen["codigos_http"] == {"200": 100, "ERROR_CONEXION": 1}
+    assert resumen["latencia_http_ms"]["p50"] == 51.0
+    assert resumen["latencia_http_ms"]["p99"] == 100.0
+    assert resumen["latencia_http_ms"]["max"] == 500.0
+    assert resumen["etapas"]["envio"]["llamadas"] == 101
+    assert resumen["filas_completadas"] == 3
+    assert resumen["filas_por_segundo"] == 1.5
+    assert resumen["serie_filas_por_segundo"] == [
+        {"segundo": 0.0, "filas_por_segundo": 1.0},
+        {"segundo": 1.0, "filas_por_segundo": 2.0},
+    ]
+    buckets = {b["le"]: b["solicitudes"] for b in resumen["histograma_latencia_http"]}
+    assert buckets[0.01] == 10
+    assert buckets[0.25] == 100
+    assert buckets[10.0] == 101
+
+
+def test_texto_prometheus():
+    metricas = Metricas()
+    metricas.registrar_envio(0.02, 100, MagicMock(status_code=500))
+    metricas.registrar_etapa("validacion", 0.25)
+    texto = metricas.texto_prometheus()
+
+    assert "# TYPE soap_batch_latencia_http_segundos histogram" in texto
+    assert 'soap_batch_latencia_http_segundos_bucket{le="0.01"} 0' in texto
+    assert 'soap_batch_latencia_http_segundos_bucket{le="0.025"} 1' in texto
+    assert 'soap_batch_latencia_http_segundos_bucket{le="+Inf"} 1' in texto
+    assert "soap_batch_latencia_http_segundos_count 1" in texto
+    assert 'soap_batch_etapa_segundos_total{etapa="validacion"} 0.25' in texto
+    assert 'soap_batch_solicitudes_http_total{codigo="500"} 1' in texto
+    assert "soap_batch_bytes_enviados_total 100" in texto
+    assert texto.endswith("\n")
+
+
+def test_medir_suma_la_etapa_aunque_falle():
+    reloj = RelojFalso()
+    metricas = Metricas(reloj=reloj)
+
+    def lenta():
+        reloj.ahora += 2
+        raise ValueError("fallo")
+
+    with pytest.raises(ValueError):
+        metricas.medir(lenta, "log")()
+    assert metricas.resumen()["etapas"]["log"] == {"llamadas": 1, "segundos": 2.0}
+
+
+def test_eventos_archivo_con_medir_termina_con_tiempos(tmp_path):
+    ruta = crear_xlsx(tmp_path / "datos.xlsx", 25)
+
+    sin_medir = list(eventos_archivo(ruta, tamano_bloque=10))
+    eventos = list(eventos_archivo(ruta, tamano_bloque=10, medir=True))
+
+    assert eventos[:-1] == sin_medir
+    tiempos = eventos[-1]
+    assert isinstance(tiempos, TiemposArchivo)
+    etapas = tiempos.tiempos.como_dict()
+    assert etapas["ingesta"]["llamadas"] == 4 # 3 bloques + el final del lector
+    assert etapas["validacion"]["llamadas"] == 3
+    assert etapas["sobre"]["llamadas"] == 3
+
+
+def test_main_guarda_metricas_json_y_prometheus(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "datos.xlsx", 12)
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--chunk-size", "5", "--concurrency", "3", "--no-checkpoint",
+            "--metrics-json", "metricas.json", "--metrics-prom", "metricas.prom"]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar:
+        mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+        batch_main()
+
+    salida = capsys.readouterr().out
+    assert "Latencia HTTP (ms): p50" in salida
+    assert "Métricas guardadas en:" in salida
+
+    resumen = json.loads((tmp_path / "metricas.json").read_text(encoding="utf-8"))
+    assert resumen["filas_completadas"] == 12
+    assert resumen["codigos_http"] == {"200": 12}
+    assert resumen["latencia_http_ms"]["solicitudes"] == 12
+    assert resumen["bytes_enviados"] > 12 * 300
+    assert set(resumen["etapas"]) == {"ingesta", "validacion", "sobre", "envio", "log", "escritura_log"}
+    assert resumen["etapas"]["log"]["llamadas"] == 12
+    assert 'soap_batch_filas_completadas_total 12' in (tmp_path / "metricas.prom").read_text(encoding="utf-8")
+    assert not (tmp_path / "metricas.prom.tmp").exists()
+
+
+def test_main_sin_metricas_no_mide(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "datos.xlsx", 3)
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--no-checkpoint"]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.enviar_solicitud_soap') as mock_enviar, \
+            patch('soap_batch.batch_soap_sender.Metricas') as mock_metricas:
+        mock_enviar.return_value = MagicMock(status_code=200, text="ok")
+        batch_main()
+
+    mock_metricas.assert_not_called()
+    assert "Métricas guardadas" not in capsys.readouterr().out
@@ -0,0 +1,185 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.deduplicacion import IndiceDeduplicacion
+from soap_batch.ingesta import FilaPreparada, ingerir_en_serie
+from soap_batch.lectores import leer_por_bloques
+from soap_batch.pipeline import PresupuestoMemoria, en_hilo, enviar_eventos, ingerir_por_etapas
+from soap_batch.sobre_soap import construir_cuerpo_soap
+from tests.conftest import crear_xlsx
+
+
+def _hilos_de_etapa():
+    return [hilo for hilo in threading.enumerate() if hilo.name.startswith("soap-")]
+
+
+def test_en_hilo_conserva_orden_y_relanza_errores():
+    def etapa():
+        yield from range(5)
+        raise ValueError("fallo en la etapa")
+
+    recibidos = []
+    with pytest.raises(ValueError, match="fallo en la etapa"):
+        for elemento in en_hilo(etapa(), capacidad=2):
+            recibidos.append(elemento)
+    assert recibidos == [0, 1, 2, 3, 4]
+
+
+def test_en_hilo_cola_acotada_y_abandono():
+    producidos = []
+    cerrada = threading.Event()
+
+    def etapa():
+        try:
+            for i in range(1000):
+                producidos.append(i)
+                yield i
+        finally:
+            cerrada.set()
+
+    salida = en_hilo(etapa(), capacidad=3)
+    assert next(salida) == 0
+    time.sleep(0.2)
+    assert len(producidos) <= 5 # El elemento entregado, la cola llena y el que espera al put
+    salida.close()
+    assert cerrada.is_set()
+    assert not _hilos_de_etapa()
+
+
+def test_presupuesto_bloquea_hasta_liberar():
+    presupuesto = PresupuestoMemoria(100)
+    presupuesto.reservar(250) # Sin nada reservado se admite aunque supere el límite
+    reservado = threading.Event()
+    hilo = threading.Thread(target=lambda: (presupuesto.reservar(10), reservado.set()))
+    hilo.start()
+    assert not reservado.wait(0.2)
+    presupuesto.ajustar(250, 60)
+    assert reservado.wait(5)
+    hilo.join()
+    assert (presupuesto.en_uso, presupuesto.maximo) == (70, 250)
+
+
+def test_ingerir_por_etapas_mismos_eventos_que_en_serie(tmp_path):
+    rutas = [
+        crear_xlsx(tmp_path / "a.xlsx", [f"a-{i % 7}" for i in range(25)], nulos_en={3, 17}),
+        crear_xlsx(tmp_path / "b.xlsx", 4, cabecera=["CDIAPTO", "PNR_CODE"]),
+        crear_xlsx(tmp_path / "c.xlsx", 12),
+    ]
+    with IndiceDeduplicacion(tmp_path / "dedup.sqlite") as indice:
+        esperados = list(ingerir_en_serie(rutas, tamano_bloque=4, medir=True, indice_deduplicacion=indice))
+        presupuesto = PresupuestoMemoria(1)
+        obtenidos = list(ingerir_por_etapas(rutas, presupuesto=presupuesto, tamano_bloque=4, medir=True,
+                                            indice_deduplicacion=indice))
+    assert [e.__class__ for e in obtenidos] == [e.__class__ for e in esperados]
+    assert [e for e in obtenidos if isinstance(e, FilaPreparada)] == [
+        e for e in esperados if isinstance(e, FilaPreparada)]
+    assert presupuesto.en_uso == 0 and presupuesto.maximo > 0
+    assert not _hilos_de_etapa()
+
+
+def test_presupuesto_frena_la_lectura(tmp_path):
+    ruta = crear_xlsx(tmp_path / "a.xlsx", 200)
+    bloques_leidos = []
+
+    def lector(ruta, tamano_bloque):
+        for bloque in leer_por_bloques(ruta, tamano_bloque=tamano_bloque):
+            bloques_leidos.append(len(bloque))
+            yield bloque
+
+    def leidos_tras_la_primera_fila(presupuesto):
+        bloques_leidos.clear()
+        eventos = ingerir_por_etapas([ruta], presupuesto=presupuesto, tamano_bloque=10, lector=lector)
+        next(eventos) # InicioArchivo
+        next(eventos)
+        time.sleep(0.3)
+        leidos = len(bloques_leidos)
+        eventos.close()
+        return leidos
+
+    # Con un presupuesto mínimo no se lee un bloque nuevo hasta que el emisor toma todas
+    # las filas del anterior: el primero se está enviando y el segundo espera reservado.
+    assert leidos_tras_la_primera_fila(PresupuestoMemoria(1)) <= 2
+    # Sin presupuesto solo frenan las colas acotadas, que admiten varios bloques.
+    assert leidos_tras_la_primera_fila(None) > 2
+    assert not _hilos_de_etapa()
+
+
+def test_enviar_eventos_en_orden_y_en_lotes(tmp_path):
+    ruta = crear_xlsx(tmp_path / "a.xlsx", 9, nulos_en={4})
+    enviados = []
+
+    def enviar(elemento):
+        enviados.append(elemento.cuerpo_soap.count(b"<pnr>"))
+        return MagicMock(status_code=200), 0
+
+    resultados = list(enviar_eventos(ingerir_por_etapas([ruta], tamano_bloque=3), enviar, concurrencia=3,
+                                     eventos_por_solicitud=4))
+    filas = [evento for evento, _, _ in resultados if isinstance(evento, FilaPreparada)]
+    assert [fila.linea_excel for fila in filas] == list(range(2, 11))
+    assert sorted(enviados) == [4, 4]
+    sin_enviar = [evento.linea_excel for evento, resultado, _ in resultados
+                  if isinstance(evento, FilaPreparada) and resultado is None]
+    assert sin_enviar == [6] # La fila con nulos
+
+
+@pytest.mark.parametrize("concurrencia, eventos_por_solicitud", [(1, 1), (3, 1), (3, 2)])
+def test_enviar_eventos_repetido_espera_a_la_copia_anterior(concurrencia, eventos_por_solicitud):
+    def fila(linea, pnr):
+        cuerpo = construir_cuerpo_soap(("MAD", "2023-01-01", pnr, "1A", f"T{linea}"))
+        return FilaPreparada("a.xlsx", linea, pnr, cuerpo, None, None, "h", pnr.encode())
+
+    eventos = [fila(2, "A"), fila(3, "A"), fila(4, "B"), fila(5, "B"), fila(6, "A")]
+    confirmadas = set()
+    enviados = []
+
+    def enviar(elemento):
+        enviados.append(elemento.cuerpo_soap)
+        # Falla el envío de la primera copia de A; todo lo demás se confirma.
+        return MagicMock(status_code=500 if b"T2<" in elemento.cuerpo_soap else 200, content=b""), 0
+
+    resultados = []
+    for evento, resultado, _ in enviar_eventos(iter(eventos), enviar, concurrencia=concurrencia,
+                                               eventos_por_solicitud=eventos_por_solicitud,
+                                               indice_deduplicacion=confirmadas):
+        if resultado is not None and resultado[0].status_code == 200:
+            confirmadas.add(evento.clave) # Lo que hace main() al confirmar
+        resultados.append((evento.linea_excel, evento.resultado))
+
+    # La copia de la línea 3 sale con su propio sobre porque la anterior falló; la de la
+    # línea 6 y la repetición de B se descartan porque su copia anterior ya se confirmó.
+    assert resultados == [(2, None), (3, None), (4, None), (5, "DUPLICADO"), (6, "DUPLICADO")]
+    assert any(b"T3<" in cuerpo for cuerpo in enviados)
+    assert not any(b"T5<" in cuerpo or b"T6<" in cuerpo for cuerpo in enviados)
+
+
+@pytest.mark.parametrize("parse_workers", [1, 2])
+def test_main_max_memory(tmp_path, monkeypatch, capsys, parse_workers):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", 30)
+    crear_xlsx(excel_dir / "b.xlsx", 20)
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--no-checkpoint", "--chunk-size", "5", "--max-memory", "1", "--concurrency", "2",
+            "--parse-workers", str(parse_workers)]
+    transporte = MagicMock()
+    transporte.post.return_value = MagicMock(status_code=200, text="ok")
+    with patch('sys.argv', argv):
+        batch_main(transporte=transporte)
+
+    salida = capsys.readouterr().out
+    assert "Filas enviadas exitosamente: 50" in salida
+    assert "Pico de datos en vuelo en el pipeline:" in salida and "(presupuesto 1 MiB)" in salida
+    assert not _hilos_de_etapa()
+
+
+def test_main_max_memory_invalido(tmp_path):
+    argv = ["batch_soap_sender.py", "--excel-dir", str(tmp_path), "--soap-endpoint", "http://falso",
+            "--max-memory", "0"]
+    with patch('sys.argv', argv), pytest.raises(SystemExit):
+        batch_main()
@@ -0,0 +1,153 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.politica_envio import (
+    ConcurrenciaAdaptativa,
+    LimitadorTasa,
+    PoliticaEnvio,
+    ResultadoEnvio,
+)
+from tests.conftest import RelojFalso
+
+
+def _respuesta(status, headers=None):
+    return MagicMock(status_code=status, text="", headers=headers or {})
+
+
+def test_limitador_tasa_respeta_la_tasa():
+    reloj = RelojFalso()
+    limitador = LimitadorTasa(10, rafaga=1, reloj=reloj, dormir=reloj.dormir)
+    for _ in range(21):
+        limitador.adquirir()
+    # 1 token inicial + 20 repuestos a 10/s
+    assert reloj.ahora == pytest.approx(2.0)
+
+
+def test_limitador_tasa_permite_rafaga_inicial():
+    reloj = RelojFalso()
+    limitador = LimitadorTasa(100, rafaga=5, reloj=reloj, dormir=reloj.dormir)
+    for _ in range(5):
+        limitador.adquirir()
+    assert reloj.ahora == 0.0
+
+
+def test_limitador_tasa_rechaza_tasa_no_positiva():
+    with pytest.raises(ValueError):
+        LimitadorTasa(0)
+
+
+def test_politica_reintenta_conexion_y_codigos_reintentables():
+    esperas = []
+    politica = PoliticaEnvio(max_reintentos=3, dormir=esperas.append)
+    respuestas = iter([None, _respuesta(503), _respuesta(200)])
+
+    resultado = politica.ejecutar(lambda: next(respuestas))
+
+    assert resultado.response.status_code == 200
+    assert resultado.reintentos == 2
+    assert len(esperas) == 2
+
+
+def test_politica_no_reintenta_codigos_no_reintentables():
+    esperas = []
+    politica = PoliticaEnvio(max_reintentos=3, dormir=esperas.append)
+    resultado = politica.ejecutar(lambda: _respuesta(500))
+    assert resultado == ResultadoEnvio(resultado.response, 0)
+    assert esperas == []
+
+
+def test_politica_agota_reintentos():
+    politica = PoliticaEnvio(max_reintentos=2, dormir=lambda s: None)
+    llamadas = []
+    resultado = politica.ejecutar(lambda: llamadas.append(1))
+    assert resultado.response is None
+    assert resultado.reintentos == 2
+    assert len(llamadas) == 3
+
+
+def test_politica_espera_exponencial_con_jitter_y_tope():
+    politica = PoliticaEnvio(espera_base=1.0, espera_maxima=5.0, aleatorio=lambda: 1.0)
+    assert [politica.espera(i) for i in range(5)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    politica = PoliticaEnvio(espera_base=1.0, espera_maxima=5.0, aleatorio=lambda: 0.0)
+    assert [politica.espera(i) for i in range(3)] == [0.5, 1.0, 2.0]
+
+
+def test_politica_respeta_retry_after():
+    politica = PoliticaEnvio(espera_maxima=10.0)
+    assert politica.espera(0, _respuesta(429, {"Retry-After": "3"})) == 3.0
+    assert politica.espera(0, _respuesta(429, {"Retry-After": "120"})) == 10.0
+
+
+def test_concurrencia_adaptativa_reduce_y_recupera():
+    reloj = RelojFalso()
+    concurrencia = ConcurrenciaAdaptativa(8, reloj=reloj)
+    for _ in range(5):
+        concurrencia.adquirir()
+        concurrencia.liberar(0.1, sobrecarga=False)
+    assert concurrencia.limite == 8
+
+    concurrencia.adquirir()
+    concurrencia.liberar(0.1, sobrecarga=True)
+    assert concurrencia.limite == 4
+    concurrencia.adquirir()
+    concurrencia.liberar(0.1, sobrecarga=True) # Mismo instante: no se reduce dos veces
+    assert concurrencia.limite == 4
+
+    reloj.ahora += 1
+    concurrencia.adquirir()
+    concurrencia.liberar(5.0, sobrecarga=False) # Pico de latencia
+    assert concurrencia.limite == 2
+
+    for _ in range(20):
+        concurrencia.adquirir()
+        concurrencia.liberar(0.1, sobrecarga=False)
+    assert concurrencia.limite > 4
+
+
+def test_concurrencia_adaptativa_limita_en_vuelo():
+    concurrencia = ConcurrenciaAdaptativa(2)
+    concurrencia.adquirir()
+    concurrencia.adquirir()
+    adquirido = threading.Event()
+
+    def tercero():
+        concurrencia.adquirir()
+        adquirido.set()
+
+    hilo = threading.Thread(target=tercero)
+    hilo.start()
+    assert not adquirido.wait(0.05)
+    concurrencia.liberar(0.01, sobrecarga=False)
+    assert adquirido.wait(1)
+    hilo.join()
+
+
+@patch('soap_batch.batch_soap_sender.enviar_solicitud_soap')
+@patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar')
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_reintentos_se_registran_en_el_log(mock_leer_excel, mock_log_soap, mock_enviar_soap, tmp_path, monkeypatch,
+                                                capsys):
+    monkeypatch.chdir(tmp_path)
+    mock_leer_excel.return_value = iter([pd.DataFrame([
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "PNR001", "ASIENTO": "1A", "TARJETA_FIDELIZACION": "T"},
+        {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "PNR002", "ASIENTO": "1A", "TARJETA_FIDELIZACION": "T"},
+    ])])
+    (tmp_path / "datos.xlsx").touch()
+    mock_enviar_soap.side_effect = [None, _respuesta(503), _respuesta(200), None, None, None]
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(tmp_path), "--soap-endpoint", "http://falso",
+            "--max-retries", "2", "--retry-backoff", "0.001", "--max-rps", "1000", "--no-checkpoint"]
+    with patch('sys.argv', argv):
+        batch_main()
+
+    salida = capsys.readouterr().out
+    assert mock_enviar_soap.call_count == 6
+    llamadas_log = [c.args[1:] for c in mock_log_soap.call_args_list]
+    assert llamadas_log[0] == (2, 200, "OK", "(reintentos: 2)")
+    assert llamadas_log[1] == (3, "N/A", "ERROR_CONEXION", "Error de conexión o timeout (reintentos: 2)")
+    assert "Filas que necesitaron reintentos: 2" in salida
+    assert "Filas enviadas exitosamente: 1" in salida
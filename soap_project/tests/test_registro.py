@@ -0,0 +1,115 @@
+import csv
+import threading
+import time
+
+import pytest
+
+from soap_batch.batch_soap_sender import log_soap_request
+from soap_batch.registro import CABECERA_LOG, RegistroSOAP, registro_abierto
+
+
+def _leer_csv(ruta):
+    with open(ruta, newline='', encoding='utf-8') as f:
+        return list(csv.reader(f))
+
+
+def test_registro_escribe_cabecera_y_filas_al_cerrar(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    with RegistroSOAP(ruta) as registro:
+        registro.registrar("a.xlsx", 2, 200, "OK", "")
+        registro.registrar("a.xlsx", 3, "N/A", "ERROR_CONEXION", 'con "comillas", y comas')
+
+    filas = _leer_csv(ruta)
+    assert filas[0] == CABECERA_LOG
+    assert filas[1] == ["a.xlsx", "2", "200", "OK", ""]
+    assert filas[2][4] == 'con "comillas", y comas'
+
+
+def test_registro_vuelca_al_llenar_el_buffer(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    registro = RegistroSOAP(ruta, max_filas_buffer=5, intervalo_flush=60)
+    try:
+        for linea in range(5):
+            registro.registrar("a.xlsx", linea, 200, "OK", "")
+        limite = time.monotonic() + 2
+        while len(_leer_csv(ruta)) < 6 and time.monotonic() < limite:
+            time.sleep(0.01)
+        assert len(_leer_csv(ruta)) == 6
+    finally:
+        registro.close()
+
+
+def test_registro_vuelca_por_tiempo(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    registro = RegistroSOAP(ruta, max_filas_buffer=1000, intervalo_flush=0.05)
+    try:
+        registro.registrar("a.xlsx", 2, 200, "OK", "")
+        limite = time.monotonic() + 2
+        while len(_leer_csv(ruta)) < 2 and time.monotonic() < limite:
+            time.sleep(0.01)
+        assert len(_leer_csv(ruta)) == 2
+    finally:
+        registro.close()
+
+
+def test_registro_flush_explicito(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    with RegistroSOAP(ruta, intervalo_flush=60) as registro:
+        registro.registrar("a.xlsx", 2, 200, "OK", "")
+        registro.flush()
+        assert len(_leer_csv(ruta)) == 2
+
+
+def test_registro_productores_concurrentes(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    with RegistroSOAP(ruta, max_filas_buffer=7) as registro:
+        def productor(n):
+            for linea in range(200):
+                registro.registrar(f"f{n}.xlsx", linea, 200, "OK", "")
+
+        hilos = [threading.Thread(target=productor, args=(n,)) for n in range(8)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+    filas = _leer_csv(ruta)[1:]
+    assert len(filas) == 8 * 200
+    for n in range(8):
+        # El orden de cada productor se conserva
+        assert [int(f[1]) for f in filas if f[0] == f"f{n}.xlsx"] == list(range(200))
+
+
+def test_log_soap_request_delega_en_registro_abierto(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    with RegistroSOAP(ruta, intervalo_flush=60) as registro:
+        assert registro_abierto(ruta) is registro
+        log_soap_request(ruta, "a.xlsx", 2, 200, "OK", "")
+        assert len(_leer_csv(ruta)) <= 1 # Aún en el buffer, sin abrir el fichero por fila
+    assert registro_abierto(ruta) is None
+    assert _leer_csv(ruta)[1] == ["a.xlsx", "2", "200", "OK", ""]
+
+    log_soap_request(ruta, "b.xlsx", 3, 500, "ERROR_HTTP", "x") # Sin registro: escritura directa
+    assert _leer_csv(ruta)[2][0] == "b.xlsx"
+
+
+def test_registro_cerrado_no_admite_filas(tmp_path):
+    registro = RegistroSOAP(tmp_path / "soap_log.csv")
+    registro.close()
+    registro.close() # Idempotente
+    with pytest.raises(ValueError):
+        registro.registrar("a.xlsx", 2, 200, "OK", "")
+
+
+def test_registro_parquet(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    ruta = tmp_path / "soap_log.parquet"
+    with RegistroSOAP(ruta, formato="parquet", max_filas_buffer=2) as registro:
+        for linea in range(5):
+            registro.registrar("a.xlsx", linea + 2, 200, "OK", "")
+        registro.registrar("a.xlsx", "N/A", "N/A", "OMITIDO_CABECERA", "faltan columnas")
+
+    tabla = pq.read_table(ruta)
+    assert tabla.column_names == CABECERA_LOG
+    assert tabla.num_rows == 6
+    assert tabla.column("numero_linea").to_pylist()[-1] == "N/A"
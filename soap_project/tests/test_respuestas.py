@@ -0,0 +1,109 @@
+import io
+
+import pytest
+import requests
+import urllib3
+
+from benchmarks.servidor_soap import RESPUESTA_FAULT, RESPUESTA_OK, fault_eventos
+from soap_batch.respuestas import (
+    Fallo,
+    analizar_fallos,
+    detalle_fallo,
+    extraer_fallo,
+    procesar_respuesta,
+    resumir_error,
+)
+
+
+class _CuerpoQueFalla(io.BytesIO):
+    def read(self, *args, **kwargs):
+        raise urllib3.exceptions.ProtocolError("conexión cortada")
+
+
+def _respuesta(status, cuerpo):
+    # requests.Response pedida con stream=True, con el cuerpo aún sin leer.
+    response = requests.Response()
+    response.status_code = status
+    fuente = cuerpo if isinstance(cuerpo, io.IOBase) else io.BytesIO(cuerpo)
+    response.raw = urllib3.HTTPResponse(body=fuente, status=status, preload_content=False, decode_content=False)
+    return response
+
+
+def test_sin_fault_no_hay_fallos():
+    assert analizar_fallos(RESPUESTA_OK) == (None, {})
+    assert analizar_fallos(b"") == (None, {})
+    assert analizar_fallos(b"<Fault sin cerrar") == (None, {})
+
+
+def test_fault_general_soap12():
+    fallo_general, por_evento = analizar_fallos(RESPUESTA_FAULT)
+    assert fallo_general == Fallo("soap12:Receiver", "Error simulado por el servidor de pruebas")
+    assert por_evento == {}
+
+
+def test_fault_soap11():
+    contenido = '''<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><s:Fault>
+        <faultcode>s:Client</faultcode><faultstring>Petición inválida</faultstring>
+        </s:Fault></s:Body></s:Envelope>'''.encode("utf-8")
+    assert analizar_fallos(contenido)[0] == Fallo("s:Client", "Petición inválida")
+
+
+def test_fallos_por_evento():
+    fallo_general, por_evento = analizar_fallos(fault_eventos([2, 5]))
+    assert fallo_general.codigo == "soap12:Sender"
+    assert por_evento == {
+        2: Fallo("soap12:Sender", "Evento 2 rechazado (simulado)"),
+        5: Fallo("soap12:Sender", "Evento 5 rechazado (simulado)"),
+    }
+
+
+def test_no_resuelve_entidades_externas(tmp_path):
+    secreto = tmp_path / "secreto.txt"
+    secreto.write_text("no debe aparecer")
+    contenido = f'''<?xml version="1.0"?>
+<!DOCTYPE r [<!ENTITY x SYSTEM "{secreto.as_uri()}">]>
+<Envelope><Body><Fault><faultcode>c</faultcode><faultstring>&x;</faultstring></Fault></Body></Envelope>'''.encode()
+    fallo_general, _ = analizar_fallos(contenido)
+    assert "no debe aparecer" not in fallo_general.motivo
+
+
+def test_detalle_fallo():
+    assert detalle_fallo(Fallo("c", "m")) == "c: m"
+    assert detalle_fallo(Fallo("", "m")) == "m"
+    assert detalle_fallo(Fallo("", "")) == "SOAP Fault sin detalle"
+
+
+def test_procesar_respuesta_2xx_descarta_el_cuerpo():
+    response = _respuesta(200, RESPUESTA_OK)
+    procesada = procesar_respuesta(response)
+    assert (procesada.status_code, procesada.text, procesada.content) == (200, "", b"")
+    assert response.raw.closed
+
+
+def test_procesar_respuesta_2xx_conserva_contenido_si_se_pide():
+    procesada = procesar_respuesta(_respuesta(200, fault_eventos([1])), conservar_contenido=True)
+    assert analizar_fallos(procesada.content)[1].keys() == {1}
+    assert procesada.text == ""
+
+
+def test_procesar_respuesta_error_solo_guarda_fault():
+    procesada = procesar_respuesta(_respuesta(500, RESPUESTA_FAULT))
+    assert procesada.text == "soap12:Receiver: Error simulado por el servidor de pruebas"
+    assert procesada.content == b""
+
+
+def test_procesar_respuesta_error_recorta_cuerpos_grandes():
+    procesada = procesar_respuesta(_respuesta(502, b"<html>" + b"x" * 100_000), max_bytes_fallo=100)
+    assert procesada.text.endswith(" [...]")
+    assert len(procesada.text) <= 100 + len(" [...]")
+
+
+def test_fault_recortado_conserva_codigo_y_motivo():
+    recortado = fault_eventos(range(1, 200))[:600]
+    assert extraer_fallo(recortado) == Fallo("soap12:Sender", "Eventos rechazados")
+    assert resumir_error(b"") == ""
+
+
+def test_procesar_respuesta_corte_leyendo_el_cuerpo_es_error_de_conexion():
+    with pytest.raises(requests.exceptions.ConnectionError):
+        procesar_respuesta(_respuesta(500, _CuerpoQueFalla()))
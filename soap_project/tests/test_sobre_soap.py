@@ -0,0 +1,87 @@
+import io
+
+import pandas as pd
+import pytest
+from lxml import etree
+
+from soap_batch.batch_soap_sender import generar_cuerpo_soap
+from soap_batch.sobre_soap import (
+    PLANTILLA_SOAP,
+    construir_cuerpo_soap,
+    construir_cuerpo_soap_str,
+    construir_cuerpos_soap,
+    construir_sobre_multievento,
+    escapar_xml,
+    escribir_cuerpo_soap,
+    fragmento_evento,
+)
+
+NS = {"soap12": "http://www.w3.org/2003/05/soap-envelope", "ns2": "http://ejemplo.com/eventoPNR/v1"}
+VALORES = ("MAD", "2023-10-26", "ABC123", "10A", "F123456")
+
+
+def _campos(cuerpo):
+    raiz = etree.fromstring(cuerpo)
+    evento = raiz.find("soap12:Body/ns2:EventoPNR", NS)
+    return tuple(hijo.text for hijo in evento)
+
+
+def test_construir_cuerpo_soap_coincide_con_la_plantilla():
+    assert construir_cuerpo_soap(VALORES) == PLANTILLA_SOAP.format(*VALORES).encode("utf-8")
+    assert construir_cuerpo_soap_str(VALORES) == PLANTILLA_SOAP.format(*VALORES)
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("ABC123", "ABC123"),
+    ("A&B", "A&amp;B"),
+    ("<x>", "&lt;x&gt;"),
+    ("&lt;", "&amp;lt;"),
+    (123, "123"),
+])
+def test_escapar_xml(texto, esperado):
+    assert escapar_xml(texto) == esperado
+
+
+def test_construir_cuerpo_soap_escapa_y_es_xml_valido():
+    valores = ("M&D", "2023-10-26", "<PNR>", "10A", "Ñandú & cía")
+    assert _campos(construir_cuerpo_soap(valores)) == valores
+
+
+def test_construir_cuerpos_soap_por_lotes_equivale_a_fila_a_fila():
+    filas = [VALORES, ("BCN", "2024-01-01", "X&Y", "2B", "F<1>"), ("VAL", "2024-01-02", "Z", "3C", "F2")]
+    assert construir_cuerpos_soap(filas) == [construir_cuerpo_soap(f) for f in filas]
+    assert _campos(construir_cuerpos_soap(filas)[1]) == filas[1]
+    assert construir_cuerpos_soap([]) == []
+
+
+def test_construir_cuerpos_soap_valor_con_separador_no_desplaza_filas():
+    filas = [("A\x00B", "2024-01-01", "P1", "1A", "F1"), ("X&Y", "2024-01-01", "P2", "2B", "F2")]
+    assert construir_cuerpos_soap(filas) == [construir_cuerpo_soap(f) for f in filas]
+    assert b"<cdiApto>X&amp;Y</cdiApto>" in construir_cuerpos_soap(filas)[1]
+
+
+def test_escribir_cuerpo_soap_en_buffer_reutilizable():
+    buffer = io.BytesIO()
+    escritos = escribir_cuerpo_soap(buffer, VALORES)
+    escribir_cuerpo_soap(buffer, VALORES)
+    assert escritos == len(construir_cuerpo_soap(VALORES))
+    assert buffer.getvalue() == construir_cuerpo_soap(VALORES) * 2
+
+
+def test_generar_cuerpo_soap_escapa_valores():
+    datos_fila = pd.Series({"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-10-26", "PNR_CODE": "A<B",
+                            "ASIENTO": "10A", "TARJETA_FIDELIZACION": "F&1"})
+    xml_generado = generar_cuerpo_soap(datos_fila)
+    assert "<pnr>A&lt;B</pnr>" in xml_generado
+    assert _campos(xml_generado.encode("utf-8")) == ("MAD", "2023-10-26", "A<B", "10A", "F&1")
+
+
+def test_sobre_multievento():
+    cuerpos = [construir_cuerpo_soap(("MAD", "2023-01-01", f"P{i}", "1A", "T")) for i in range(3)]
+    assert construir_sobre_multievento(cuerpos[:1]) == cuerpos[0]
+
+    sobre = construir_sobre_multievento(cuerpos)
+    raiz = etree.fromstring(sobre)
+    eventos = raiz.findall(".//{http://ejemplo.com/eventoPNR/v1}EventoPNR")
+    assert [e.findtext("pnr") for e in eventos] == ["P0", "P1", "P2"]
+    assert fragmento_evento(cuerpos[0]).startswith(b"<ns2:EventoPNR")
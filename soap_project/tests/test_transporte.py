@@ -0,0 +1,89 @@
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import requests
+
+from soap_batch.batch_soap_sender import enviar_solicitud_soap, main as batch_main
+from soap_batch.despacho import despachar_en_orden
+from soap_batch.transporte import TransporteSOAP
+from benchmarks.servidor_soap import ServidorSOAPStub
+
+
+def test_transporte_reutiliza_conexiones():
+    with ServidorSOAPStub() as servidor, TransporteSOAP(tamano_pool=2) as transporte:
+        for _ in range(10):
+            response = enviar_solicitud_soap(servidor.url, "<soap/>", transporte)
+            assert response.status_code == 200
+        assert servidor.peticiones == 10
+        assert servidor.conexiones == 1
+
+
+def test_transporte_pool_acota_conexiones_con_concurrencia():
+    with ServidorSOAPStub(latencia=0.01) as servidor, TransporteSOAP(tamano_pool=4) as transporte:
+        resultados = list(despachar_en_orden(
+            range(40), lambda _: enviar_solicitud_soap(servidor.url, "<soap/>", transporte), concurrencia=4,
+        ))
+        assert all(r[1].status_code == 200 for r in resultados)
+        assert servidor.conexiones <= 4
+
+
+def test_transporte_procesa_respuestas_sin_guardar_cuerpos():
+    with ServidorSOAPStub(tasa_errores=0.5, semilla=3) as servidor, TransporteSOAP(tamano_pool=1) as transporte:
+        respuestas = [enviar_solicitud_soap(servidor.url, "<soap/>", transporte) for _ in range(10)]
+        assert servidor.conexiones == 1 # Los cuerpos descartados no impiden reutilizar la conexión
+    ok = [r for r in respuestas if r.status_code == 200]
+    errores = [r for r in respuestas if r.status_code == 500]
+    assert ok and errores
+    assert all(r.text == "" and r.content == b"" for r in ok)
+    assert all(r.text == "soap12:Receiver: Error simulado por el servidor de pruebas" for r in errores)
+
+
+def test_transporte_conserva_contenido_para_sobres_multievento():
+    with ServidorSOAPStub() as servidor, TransporteSOAP(conservar_contenido=True) as transporte:
+        response = enviar_solicitud_soap(servidor.url, "<soap/>", transporte)
+    assert b"EventoPNRResponse" in response.content
+
+
+def test_transporte_sin_keep_alive_abre_una_conexion_por_solicitud():
+    with ServidorSOAPStub() as servidor, TransporteSOAP(keep_alive=False) as transporte:
+        for _ in range(3):
+            enviar_solicitud_soap(servidor.url, "<soap/>", transporte)
+        assert servidor.conexiones == 3
+
+
+def test_transporte_usa_timeouts_separados():
+    transporte = TransporteSOAP(timeout_conexion=1.5, timeout_lectura=7)
+    with patch.object(transporte.session, "post", return_value=MagicMock(status_code=200)) as mock_post:
+        transporte.post("http://x", b"<soap/>")
+    assert mock_post.call_args.kwargs["timeout"] == (1.5, 7)
+    assert mock_post.call_args.kwargs["stream"] is True
+
+
+def test_enviar_solicitud_soap_devuelve_none_si_el_transporte_falla():
+    transporte = MagicMock()
+    transporte.post.side_effect = requests.exceptions.ConnectTimeout("timeout")
+    assert enviar_solicitud_soap("http://x", "<soap/>", transporte) is None
+
+
+@patch('soap_batch.batch_soap_sender.leer_por_bloques')
+def test_main_acepta_transporte_inyectado(mock_leer_excel, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path) # Log y diario de checkpoint fuera del directorio del proyecto
+    mock_leer_excel.return_value = iter([pd.DataFrame([{
+        "CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "PNR001",
+        "ASIENTO": "1A", "TARJETA_FIDELIZACION": "TF001"
+    }])])
+    (tmp_path / "datos.xlsx").touch()
+
+    transporte_falso = MagicMock()
+    transporte_falso.post.return_value = MagicMock(status_code=200, text="ok")
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(tmp_path), "--soap-endpoint", "http://falso"]
+    with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.RegistroSOAP.registrar'):
+        batch_main(transporte=transporte_falso)
+
+    transporte_falso.post.assert_called_once()
+    url, cuerpo = transporte_falso.post.call_args.args
+    assert url == "http://falso"
+    assert b"<pnr>PNR001</pnr>" in cuerpo
+    transporte_falso.close.assert_not_called() # El transporte inyectado lo cierra quien lo creó
+    assert "Filas enviadas exitosamente: 1" in capsys.readouterr().out
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from soap_batch.validacion import (
+    EXPECTED_COLUMNS,
+    columnas_faltantes,
+    normalizar_fecha_evento,
+    normalizar_fechas,
+    validar_bloque,
+)
+
+
+def _fila(**cambios):
+    fila = {"CDIAPTO": "MAD", "FECHA_EVENTO": "2023-01-01", "PNR_CODE": "PNR001",
+            "ASIENTO": "1A", "TARJETA_FIDELIZACION": "TF001"}
+    fila.update(cambios)
+    return fila
+
+
+def test_columnas_faltantes():
+    assert columnas_faltantes(list(EXPECTED_COLUMNS) + ["OTRA"]) == set()
+    assert columnas_faltantes(["CDIAPTO", "PNR_CODE"]) == {"FECHA_EVENTO", "ASIENTO", "TARJETA_FIDELIZACION"}
+
+
+def test_validar_bloque_devuelve_tuplas_en_orden_de_evento():
+    df = pd.DataFrame([_fila(), _fila(PNR_CODE="PNR002", TARJETA_FIDELIZACION=12345)])
+
+    filas = validar_bloque(df)
+
+    assert filas[0].linea_excel == 2
+    assert filas[0].valores == ("MAD", "2023-01-01", "PNR001", "1A", "TF001")
+    assert filas[1].valores == ("MAD", "2023-01-01", "PNR002", "1A", "12345")
+    assert all(f.resultado is None for f in filas)
+
+
+def test_validar_bloque_marca_nulos_con_sus_columnas():
+    df = pd.DataFrame([_fila(ASIENTO=None), _fila(), _fila(PNR_CODE=np.nan, CDIAPTO=None)],
+                      index=[10, 11, 12])
+
+    filas = validar_bloque(df)
+
+    assert [f.linea_excel for f in filas] == [12, 13, 14]
+    assert filas[0].valores is None
+    assert filas[0].resultado == "OMITIDO_NULOS"
+    assert filas[0].detalle == "Contiene valores nulos en columnas esperadas: ['ASIENTO']"
+    assert filas[1].valores[2] == "PNR001"
+    assert filas[2].resultado == "OMITIDO_NULOS"
+    # Columnas en el orden de COLUMNAS_EVENTO, no en el del set EXPECTED_COLUMNS
+    assert filas[2].detalle == "Contiene valores nulos en columnas esperadas: ['CDIAPTO', 'PNR_CODE']"
+
+
+def test_validar_bloque_vacio():
+    assert validar_bloque(pd.DataFrame(columns=list(EXPECTED_COLUMNS))) == []
+
+
+def test_normalizar_fechas_mezcla_de_formatos():
+    serie = pd.Series([datetime(2023, 10, 26, 11, 20), "2024-01-15", "12/03/2025", "Mar 03, 2025", "sin fecha"],
+                      dtype=object)
+    assert normalizar_fechas(serie).tolist() == ["2023-10-26", "2024-01-15", "2025-03-12", "2025-03-03", "sin fecha"]
+
+
+def test_normalizar_fechas_columna_datetime():
+    serie = pd.Series([pd.Timestamp("2023-01-01 10:00"), pd.Timestamp("2023-12-31")])
+    assert normalizar_fechas(serie).tolist() == ["2023-01-01", "2023-12-31"]
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ("2024-01-15", "2024-01-15"),
+    (pd.Timestamp("2024-01-15 10:00"), "2024-01-15"),
+    ("15/01/2024", "2024-01-15"),
+    ("no es fecha", "no es fecha"),
+])
+def test_normalizar_fecha_evento(valor, esperado):
+    assert normalizar_fecha_evento(valor) == esperado
@@ -0,0 +1,191 @@
+import csv
+import os
+import signal
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from soap_batch.batch_soap_sender import main as batch_main
+from soap_batch.registro import rotar_log
+from soap_batch.vigilancia import IndiceArchivos, _EsperaSondeo, crear_espera, vigilar
+from tests.conftest import crear_xlsx
+
+
+def _esperar_a(condicion, timeout=10):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, "La condición no se cumplió a tiempo"
+        time.sleep(0.05)
+
+
+def test_indice_archivos_espera_firma_estable(tmp_path):
+    ruta = tmp_path / "a.xlsx"
+    ruta.write_bytes(b"uno")
+    (tmp_path / "~$a.xlsx").write_bytes(b"bloqueo")
+    indice = IndiceArchivos()
+
+    rutas = sorted(tmp_path.iterdir())
+    assert indice.listos(rutas) == [] # Primera vez que se ve: pendiente
+    assert indice.hay_pendientes
+    assert indice.listos(rutas) == [ruta] # Misma firma dos veces: listo
+    indice.marcar_procesados([ruta])
+    assert indice.listos(rutas) == []
+    assert not indice.hay_pendientes
+
+    ruta.write_bytes(b"modificado")
+    assert indice.listos(rutas) == []
+    assert indice.listos(rutas) == [ruta]
+
+
+def test_indice_archivos_olvida_los_borrados(tmp_path):
+    ruta = tmp_path / "a.xlsx"
+    ruta.write_bytes(b"uno")
+    indice = IndiceArchivos()
+    indice.listos([ruta])
+    indice.marcar_procesados(indice.listos([ruta]))
+    ruta.unlink()
+    assert indice.listos([ruta]) == []
+    assert indice.procesados == {}
+
+
+def test_rotar_log(tmp_path):
+    ruta = tmp_path / "soap_log.csv"
+    assert rotar_log(ruta) is None
+    ruta.write_text("cabecera\n")
+    rotado = rotar_log(ruta)
+    assert not ruta.exists()
+    assert rotado.read_text() == "cabecera\n"
+    assert rotado.name.startswith("soap_log.") and rotado.suffix == ".csv"
+
+    ruta.write_text("otra\n")
+    os.utime(ruta, (rotado.stat().st_mtime, rotado.stat().st_mtime))
+    assert rotar_log(ruta) != rotado # Misma marca de tiempo: no se sobrescribe
+
+
+@pytest.mark.skipif(not hasattr(os, "O_CLOEXEC"), reason="inotify solo existe en Linux")
+def test_espera_inotify_despierta_con_un_archivo_nuevo(tmp_path):
+    espera = crear_espera(tmp_path)
+    if isinstance(espera, _EsperaSondeo):
+        pytest.skip("inotify no disponible")
+    try:
+        threading.Timer(0.2, (tmp_path / "nuevo.xlsx").write_bytes, [b"x"]).start()
+        inicio = time.monotonic()
+        espera.esperar(10, threading.Event())
+        assert time.monotonic() - inicio < 5
+    finally:
+        espera.close()
+
+
+def test_vigilar_procesa_solo_nuevos_y_modificados(tmp_path):
+    (tmp_path / "a.xlsx").write_bytes(b"a")
+    parar = threading.Event()
+    lotes = []
+
+    def procesar(rutas):
+        lotes.append(sorted(ruta.name for ruta in rutas))
+        if len(lotes) == 1:
+            (tmp_path / "b.xlsx").write_bytes(b"b")
+        else:
+            parar.set()
+
+    vigilar(tmp_path, procesar, intervalo=0.05, parar=parar, estabilidad=0.05, espera=_EsperaSondeo())
+    assert lotes == [["a.xlsx"], ["b.xlsx"]]
+
+
+def test_main_watch_procesa_archivos_nuevos_con_el_mismo_transporte(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "soap_log.csv").write_text("log de la ejecución anterior\n", encoding="utf-8")
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", ["P1", "P2"])
+
+    transporte = MagicMock()
+    transporte.post.return_value = MagicMock(status_code=200, text="ok")
+    parar = threading.Event()
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--watch", "--watch-interval", "0.1", "--dedup"]
+    with patch('sys.argv', argv):
+        hilo = threading.Thread(target=batch_main, kwargs={"transporte": transporte, "parar": parar})
+        hilo.start()
+        try:
+            _esperar_a(lambda: transporte.post.call_count == 2)
+            crear_xlsx(excel_dir / "b.xlsx", ["P3"])
+            _esperar_a(lambda: transporte.post.call_count == 3)
+            # Un archivo modificado se vuelve a leer, pero con --dedup solo sale la fila nueva.
+            crear_xlsx(excel_dir / "a.xlsx", ["P1", "P2", "P4"])
+            _esperar_a(lambda: transporte.post.call_count == 4)
+        finally:
+            parar.set()
+            hilo.join(10)
+    assert not hilo.is_alive()
+
+    salida = capsys.readouterr().out
+    assert "--- Resumen del ciclo ---" in salida
+    assert "Filas enviadas exitosamente: 4" in salida.split("--- Resumen del Procesamiento ---")[1]
+    rotados = [ruta for ruta in tmp_path.glob("soap_log.*.csv")]
+    assert len(rotados) == 1
+    assert rotados[0].read_text(encoding="utf-8") == "log de la ejecución anterior\n"
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    assert [(f[0], f[3]) for f in filas_log if f[3] == "OK"] == [
+        ("a.xlsx", "OK"), ("a.xlsx", "OK"), ("b.xlsx", "OK"), ("a.xlsx", "OK"),
+    ]
+
+
+def test_main_watch_sin_dedup_reenvia_entero_un_archivo_modificado(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+    crear_xlsx(excel_dir / "a.xlsx", ["P1", "P2"])
+
+    transporte = MagicMock()
+    transporte.post.return_value = MagicMock(status_code=200, text="ok")
+    parar = threading.Event()
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso",
+            "--watch", "--watch-interval", "0.1"]
+    with patch('sys.argv', argv):
+        hilo = threading.Thread(target=batch_main, kwargs={"transporte": transporte, "parar": parar})
+        hilo.start()
+        try:
+            _esperar_a(lambda: transporte.post.call_count == 2)
+            # El diario de checkpoint va por hash del archivo: al cambiar el contenido
+            # se reenvían también las filas ya confirmadas.
+            crear_xlsx(excel_dir / "a.xlsx", ["P1", "P2", "P4"])
+            _esperar_a(lambda: transporte.post.call_count == 5)
+        finally:
+            parar.set()
+            hilo.join(10)
+    assert not hilo.is_alive()
+
+    salida = capsys.readouterr().out
+    assert "Filas enviadas exitosamente: 5" in salida.split("--- Resumen del Procesamiento ---")[1]
+    with open(tmp_path / "soap_log.csv", newline='', encoding='utf-8') as f:
+        filas_log = list(csv.reader(f))[1:]
+    assert [(f[0], f[1]) for f in filas_log if f[3] == "OK"] == [
+        ("a.xlsx", "2"), ("a.xlsx", "3"), ("a.xlsx", "2"), ("a.xlsx", "3"), ("a.xlsx", "4"),
+    ]
+
+
+def test_main_watch_restaura_el_manejador_de_sigterm(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    excel_dir = tmp_path / "excel"
+    excel_dir.mkdir()
+
+    def anterior(*_):
+        pass
+
+    def vigilar_falso(*args, parar, **kwargs):
+        # SIGTERM durante la vigilancia solo pide parar
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        assert parar.is_set()
+
+    argv = ["batch_soap_sender.py", "--excel-dir", str(excel_dir), "--soap-endpoint", "http://falso", "--watch"]
+    original = signal.signal(signal.SIGTERM, anterior)
+    try:
+        with patch('sys.argv', argv), patch('soap_batch.batch_soap_sender.vigilar', side_effect=vigilar_falso):
+            batch_main(transporte=MagicMock())
+        assert signal.getsignal(signal.SIGTERM) is anterior
+    finally:
+        signal.signal(signal.SIGTERM, original)